@@ -0,0 +1,130 @@
+###############################################################################
+# Description: Cached account balances for multi account bots
+###############################################################################
+
+import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from altonomy.core.Side import BUY, SELL
+
+from . import config
+
+
+class BalanceService():
+    """
+    Account balances of several accounts, fetched in parallel and cached
+    for ttl seconds. Sends are debited locally until a balance fetched after
+    the send replaces them, and accounts with new fills are refetched on the
+    next snapshot.
+    """
+
+    def __init__(
+        self,
+        alt_client,
+        account_ids,
+        *,
+        ttl=config.BALANCE_CACHE_TTL,
+        force_rpc=True,
+        logger=None,
+    ):
+        self.logger = logger or logging.getLogger()
+        self.client = alt_client
+        self.account_ids = list(account_ids)
+        self.ttl = ttl
+        self.force_rpc = force_rpc
+        self.balances = {}
+        self.fetched_ts = {}
+        # account_id -> currency -> [(ts, delta)]
+        self.adjustments = defaultdict(lambda: defaultdict(list))
+        self.seen_completed = set()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(len(self.account_ids), 1),
+            thread_name_prefix='BalanceService')
+
+    def fetch(self, account_id):
+        start = time.time()
+        balance = self.client.get_account_balance(
+            account_id, force_rpc=self.force_rpc)
+        with self.lock:
+            self.balances[account_id] = balance
+            self.fetched_ts[account_id] = start
+            # the fetched balance already includes the earlier sends
+            for deltas in self.adjustments[account_id].values():
+                deltas[:] = [(ts, d) for ts, d in deltas if ts >= start]
+        return balance
+
+    def stale(self, account_id):
+        return time.time() - self.fetched_ts.get(account_id, 0) > self.ttl
+
+    def refresh(self, account_ids=None, force=False):
+        """ fetch the stale balances in parallel """
+        account_ids = [
+            a for a in (account_ids or self.account_ids)
+            if force or self.stale(a)]
+        futures = {a: self.executor.submit(self.fetch, a) for a in account_ids}
+        for account_id, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                self.logger.error(
+                    f'BalanceService failed to fetch {account_id} - {e}')
+
+    def snapshot(self, account_ids=None, force=False):
+        """ balances of the accounts for a run cycle, refreshed when stale """
+        self.refresh(account_ids, force)
+        with self.lock:
+            return {
+                a: self.balances[a] for a in (account_ids or self.account_ids)
+                if a in self.balances}
+
+    def get(self, account_id, force=False):
+        return self.snapshot([account_id], force).get(account_id)
+
+    def cached(self, account_id):
+        """ balance as last fetched, None if missing or stale, never fetches """
+        if self.stale(account_id):
+            return None
+        with self.lock:
+            return self.balances.get(account_id)
+
+    def available(self, account_id, currency, balance=None):
+        """ available balance net of the local adjustments """
+        balance = balance if balance is not None else self.get(account_id)
+        if not balance or currency not in balance.keys():
+            return None
+        with self.lock:
+            adjustment = sum(
+                d for _, d in self.adjustments[account_id].get(currency, []))
+        return balance[currency].available + adjustment
+
+    def adjust(self, account_id, currency, delta):
+        with self.lock:
+            self.adjustments[account_id][currency].append((time.time(), delta))
+
+    def on_send(self, account_id, side, price, amount, base, quote):
+        """ debit what the order can spend until the next fetch """
+        if side == SELL:
+            self.adjust(account_id, base, -amount)
+        elif side == BUY:
+            self.adjust(account_id, quote, -amount * price)
+
+    def invalidate(self, account_id):
+        with self.lock:
+            self.fetched_ts.pop(account_id, None)
+
+    def sync_fills(self, order_monitor):
+        """ refetch the accounts of orders completed since the last call """
+        with order_monitor.lock:
+            completed = dict(order_monitor.completed_orders)
+        for order_id in completed.keys() - self.seen_completed:
+            order = completed[order_id]
+            if order is not None and order.account_id in self.account_ids:
+                self.invalidate(order.account_id)
+        self.seen_completed = set(completed)
+
+    def stop(self):
+        self.executor.shutdown(wait=False)
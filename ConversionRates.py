@@ -0,0 +1,142 @@
+###############################################################################
+# Description: Process wide conversion rate cache fed by streamed mids
+###############################################################################
+
+import logging
+import threading
+import time
+
+from altonomy.core import Streams
+from altonomy.core.OrderBook import UDSOrderBook
+
+from . import config
+
+
+class ConversionRateService():
+    """
+    Conversion rates between coins shared by the bots of the process, kept
+    per exchange since the book rates differ between exchanges. Rates of
+    streamed pairs are updated on every book; the other rates come from an
+    order book or the price server and are refetched in a background thread
+    once older than ttl, while the cached rate keeps being served. Only the
+    background refetch waits between price server retries.
+    """
+
+    def __init__(
+        self,
+        ttl=config.CONVERSION_RATE_TTL,
+        pricer_retries=3,
+        logger=None,
+    ):
+        self.logger = logger or logging.getLogger()
+        self.ttl = ttl
+        self.pricer_retries = pricer_retries
+        # (exchange, coin1, coin2) -> (ts, rate)
+        self.rates = {}
+        self.refreshing = set()
+        self.streams = {}
+        self.lock = threading.RLock()
+
+    def update(self, coin1, coin2, rate, ts=None, exchange=None):
+        if not (rate and rate > 0):
+            return
+        with self.lock:
+            self.rates[(exchange, coin1, coin2)] = (ts or time.time(), rate)
+
+    def cached(self, coin1, coin2, max_age=None, exchange=None):
+        """ cached rate, None if missing or older than max_age """
+        ts, rate = self.rates.get((exchange, coin1, coin2), (0, None))
+        if max_age is not None and time.time() - ts > max_age:
+            return None
+        return rate
+
+    def fetch(
+        self, coin1, coin2, pricer=None, alt_client=None, exchange=None, retries=0
+    ):
+        """
+        Mid of the coin1coin2 book of alt_client's exchange, else the price
+        server rate, retried every second up to retries times
+        """
+        rate = None
+        if alt_client is not None:
+            try:
+                ob = alt_client.get_orderbook(pair=coin1 + coin2)
+                if ob.bids and ob.asks:
+                    rate = 0.5 * (ob.bids[0].price + ob.asks[0].price)
+            except Exception as e:
+                self.logger.error(f'ConversionRateService {coin1}{coin2} book - {e}')
+        for attempt in range(retries + 1):
+            if (rate and rate > 0) or pricer is None:
+                break
+            try:
+                rate = pricer.get_rate(coin1, coin2)
+            except Exception as e:
+                self.logger.error(f'ConversionRateService {coin1}/{coin2} rate - {e}')
+            if rate is None and attempt < retries:
+                time.sleep(1)
+        self.update(coin1, coin2, rate, exchange=exchange)
+        self.logger.info(
+            f'ConversionRateService {exchange} {coin1}->{coin2} rate - {rate}')
+        return rate
+
+    def background_fetch(self, coin1, coin2, pricer, alt_client, exchange):
+        try:
+            self.fetch(
+                coin1, coin2, pricer, alt_client, exchange, self.pricer_retries)
+        finally:
+            with self.lock:
+                self.refreshing.discard((exchange, coin1, coin2))
+
+    def get_rate(
+        self, coin1, coin2, pricer=None, alt_client=None, block=True, exchange=None
+    ):
+        """
+        Rate from coin1 to coin2 on exchange, the one alt_client trades on.
+        A missing rate is fetched once, without retries, when block is set;
+        a rate older than ttl is served and refetched in the background.
+        """
+        rate = self.cached(coin1, coin2, max_age=self.ttl, exchange=exchange)
+        if rate is not None:
+            return rate
+        stale = self.cached(coin1, coin2, exchange=exchange)
+        if stale is None and block:
+            return self.fetch(coin1, coin2, pricer, alt_client, exchange)
+        with self.lock:
+            if (exchange, coin1, coin2) not in self.refreshing:
+                self.refreshing.add((exchange, coin1, coin2))
+                threading.Thread(
+                    target=self.background_fetch,
+                    args=(coin1, coin2, pricer, alt_client, exchange),
+                    name=f'ConversionRateService-{exchange}-{coin1}{coin2}',
+                    daemon=True,
+                ).start()
+        return stale
+
+    def stream(self, alt_client, exchange_name, coin1, coin2):
+        """ keep the rate updated from the mid of a streamed book """
+        with self.lock:
+            if (exchange_name, coin1, coin2) in self.streams:
+                return
+
+            def update_mid(*args):
+                ob = UDSOrderBook(args, source=exchange_name)
+                if ob.status != 1 or not ob.bids or not ob.asks:
+                    return
+                self.update(
+                    coin1, coin2, 0.5 * (ob.bids[0].price + ob.asks[0].price),
+                    exchange=exchange_name)
+
+            self.logger.info(
+                f'ConversionRateService streaming {coin1}{coin2} on {exchange_name}')
+            self.streams[(exchange_name, coin1, coin2)] = alt_client.subscribe_streams(
+                [[exchange_name, coin1 + coin2, Streams.l2_detailed, update_mid]]
+            )
+
+    def stop(self):
+        with self.lock:
+            for exit_flag in self.streams.values():
+                exit_flag.set()
+            self.streams.clear()
+
+
+conversion_rates = ConversionRateService()
@@ -21,6 +21,7 @@ import requests
 import operator
 from importlib import import_module
 from .HelmClient import HelmClient
+from .InstrumentCache import instrument_cache
 import ast
 class ExecutionBot():
     """ExecutionBot is a generic class for automatic execution, grid trading, Spoofy......"""
@@ -179,12 +180,9 @@ class ExecutionBot():
 
     def load_instrument_data(self):
         exchange_id = self.exchange_id_of(account_id=self.broker.get_account_id())
-        s = self.broker.client.instrument_data()
-        instruments = s.get_active_instruments_for_exchange(exchange_id)
         exchange_symbol = self.get_exchange_symbol()
-        for ins in instruments:
-            if ins.exchange_symbol == exchange_symbol:
-                self.instrument_data = ins
+        self.instrument_data = instrument_cache.get(
+            self.broker.client, exchange_id, exchange_symbol) or self.instrument_data
         if self.instrument_data is None:
             self.logger.error(
                 f'Instrument_data not found for {exchange_symbol}')
@@ -0,0 +1,182 @@
+###############################################################################
+# Description: Process wide instrument data cache
+###############################################################################
+
+import logging
+import os
+import pickle
+import threading
+import time
+
+from . import config
+
+
+class InstrumentCache():
+    """
+    Active instruments per exchange, indexed by exchange symbol and
+    altonomy symbol. Entries older than ttl are refreshed in a background
+    thread while the current ones keep being served. Every load is written
+    to an on-disk snapshot so a restart does not wait on the reference data
+    api when a recent snapshot exists.
+    """
+
+    def __init__(
+        self,
+        ttl=config.INSTRUMENT_CACHE_TTL,
+        snapshot_dir=config.INSTRUMENT_CACHE_SNAPSHOT_DIR,
+        snapshot_max_age=config.INSTRUMENT_CACHE_SNAPSHOT_MAX_AGE,
+        logger=None,
+    ):
+        self.logger = logger or logging.getLogger()
+        self.ttl = ttl
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_max_age = snapshot_max_age
+        self.by_exchange_symbol = {}
+        self.by_altonomy_symbol = {}
+        self.loaded_ts = {}
+        self.refreshing = set()
+        # first loads in progress, set once done
+        self.loading = {}
+        self.lock = threading.RLock()
+
+    def get(self, alt_client, exchange_id, exchange_symbol):
+        """ instrument of the exchange symbol, None if not listed """
+        self.ensure_loaded(alt_client, exchange_id)
+        return self.by_exchange_symbol.get((exchange_id, exchange_symbol))
+
+    def get_by_altonomy_symbol(self, alt_client, exchange_id, altonomy_symbol):
+        """ instrument of the altonomy symbol, None if not listed """
+        self.ensure_loaded(alt_client, exchange_id)
+        return self.by_altonomy_symbol.get((exchange_id, altonomy_symbol))
+
+    def instruments(self, alt_client, exchange_id):
+        """ all active instruments of the exchange """
+        self.ensure_loaded(alt_client, exchange_id)
+        return [
+            ins for (_exchange_id, _), ins in self.by_exchange_symbol.items()
+            if _exchange_id == exchange_id]
+
+    def ensure_loaded(self, alt_client, exchange_id):
+        while not self.loaded(alt_client, exchange_id):
+            self.first_load(alt_client, exchange_id)
+
+    def loaded(self, alt_client, exchange_id):
+        """ False if the exchange was never loaded, refreshes stale ones """
+        with self.lock:
+            if exchange_id not in self.loaded_ts:
+                return False
+
+            if time.time() - self.loaded_ts[exchange_id] > self.ttl \
+                    and exchange_id not in self.refreshing:
+                self.refreshing.add(exchange_id)
+                threading.Thread(
+                    target=self.background_refresh,
+                    args=(alt_client, exchange_id),
+                    name=f'InstrumentCache-{exchange_id}',
+                    daemon=True,
+                ).start()
+            return True
+
+    def first_load(self, alt_client, exchange_id):
+        """
+        Load the exchange outside the lock, other exchanges are served
+        meanwhile. Concurrent callers wait for the first one's load and
+        retry it if that one failed.
+        """
+        with self.lock:
+            if exchange_id in self.loaded_ts:
+                return
+            event = self.loading.get(exchange_id)
+            if event is None:
+                event = self.loading[exchange_id] = threading.Event()
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            event.wait()
+            return
+
+        try:
+            if not self.load_snapshot(exchange_id):
+                self.refresh(alt_client, exchange_id)
+        finally:
+            with self.lock:
+                self.loading.pop(exchange_id, None)
+            event.set()
+
+    def background_refresh(self, alt_client, exchange_id):
+        try:
+            self.refresh(alt_client, exchange_id)
+        except Exception as e:
+            self.logger.error(
+                f'InstrumentCache refresh failed for {exchange_id} - {e}')
+        finally:
+            with self.lock:
+                self.refreshing.discard(exchange_id)
+
+    def refresh(self, alt_client, exchange_id):
+        s = alt_client.instrument_data()
+        instruments = s.get_active_instruments_for_exchange(exchange_id)
+        self.update(exchange_id, instruments, time.time())
+        self.save_snapshot(exchange_id, instruments)
+        self.logger.info(
+            f'InstrumentCache loaded {len(instruments)} instruments '
+            f'for exchange {exchange_id}')
+
+    def update(self, exchange_id, instruments, loaded_ts):
+        by_exchange_symbol = {
+            (exchange_id, ins.exchange_symbol): ins for ins in instruments}
+        by_altonomy_symbol = {
+            (exchange_id, ins.altonomy_symbol): ins for ins in instruments}
+        with self.lock:
+            for index, new_index in (
+                (self.by_exchange_symbol, by_exchange_symbol),
+                (self.by_altonomy_symbol, by_altonomy_symbol),
+            ):
+                for key in [k for k in index if k[0] == exchange_id]:
+                    if key not in new_index:
+                        del index[key]
+                index.update(new_index)
+            self.loaded_ts[exchange_id] = loaded_ts
+
+    def snapshot_path(self, exchange_id):
+        return os.path.join(self.snapshot_dir, f'instruments_{exchange_id}.pickle')
+
+    def load_snapshot(self, exchange_id):
+        """ warm start from a snapshot younger than snapshot_max_age """
+        if not self.snapshot_dir:
+            return False
+        try:
+            path = self.snapshot_path(exchange_id)
+            if not os.path.exists(path):
+                return False
+            snapshot_ts = os.path.getmtime(path)
+            if time.time() - snapshot_ts > self.snapshot_max_age:
+                return False
+            with open(path, 'rb') as f:
+                instruments = pickle.load(f)
+            self.update(exchange_id, instruments, snapshot_ts)
+            self.logger.info(
+                f'InstrumentCache warm started {len(instruments)} instruments '
+                f'for exchange {exchange_id} from {path}')
+            return True
+        except Exception as e:
+            self.logger.error(
+                f'InstrumentCache snapshot load failed for {exchange_id} - {e}')
+            return False
+
+    def save_snapshot(self, exchange_id, instruments):
+        if not self.snapshot_dir:
+            return
+        try:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            path = self.snapshot_path(exchange_id)
+            with open(f'{path}.tmp', 'wb') as f:
+                pickle.dump(list(instruments), f)
+            os.replace(f'{path}.tmp', path)
+        except Exception as e:
+            self.logger.error(
+                f'InstrumentCache snapshot save failed for {exchange_id} - {e}')
+
+
+instrument_cache = InstrumentCache()
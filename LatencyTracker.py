@@ -0,0 +1,90 @@
+###############################################################################
+# Description: Tick to trade latency histograms per venue
+###############################################################################
+
+import bisect
+import threading
+import time
+from collections import defaultdict, deque
+
+# histogram bucket upper edges in milliseconds, the last bucket is open
+BUCKET_EDGES_MS = (
+    0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# stage name, start timestamp, end timestamp
+STAGES = (
+    ('feed', 'exchange_ts', 'receive_ts'),
+    ('decide', 'receive_ts', 'decision_ts'),
+    ('dispatch', 'decision_ts', 'send_ts'),
+    ('send', 'send_ts', 'sent_ts'),
+    ('ack', 'sent_ts', 'ack_ts'),
+    ('tick_to_trade', 'exchange_ts', 'sent_ts'),
+)
+
+
+class LatencyTracker():
+    """
+    Timestamps of each order from the exchange book time to the order
+    monitor acknowledgement, aggregated into a latency histogram per venue
+    and stage. All timestamps are epoch seconds.
+    """
+
+    def __init__(self, edges_ms=BUCKET_EDGES_MS, recent=100):
+        self.edges_ms = edges_ms
+        self.counts = defaultdict(lambda: [0] * (len(edges_ms) + 1))
+        self.totals = defaultdict(float)
+        self.recent = deque(maxlen=recent)
+        self.lock = threading.Lock()
+
+    def record(self, venue, order_id, **timestamps):
+        """ add an order's timestamps, stages missing a timestamp are skipped """
+        with self.lock:
+            self.recent.append(dict(venue=venue, order_id=order_id, **timestamps))
+            for stage, start, end in STAGES:
+                if timestamps.get(start) is None or timestamps.get(end) is None:
+                    continue
+                ms = max(timestamps[end] - timestamps[start], 0.0) * 1000
+                self.counts[(venue, stage)][
+                    bisect.bisect_left(self.edges_ms, ms)] += 1
+                self.totals[(venue, stage)] += ms
+
+    def percentile(self, counts, q):
+        """
+        Upper bucket edge holding the q quantile, None without samples or
+        when it falls in the open bucket, so summaries stay valid json
+        """
+        target = q * sum(counts)
+        cumulative = 0
+        for i, count in enumerate(counts):
+            cumulative += count
+            if count and cumulative >= target:
+                return self.edges_ms[i] if i < len(self.edges_ms) else None
+        return None
+
+    def summary(self):
+        """ {venue: {stage: count, mean and percentiles in ms, buckets}} """
+        with self.lock:
+            summary = defaultdict(dict)
+            for (venue, stage), counts in self.counts.items():
+                n = sum(counts)
+                summary[venue][stage] = {
+                    'count': n,
+                    'mean_ms': round(self.totals[(venue, stage)] / n, 3),
+                    'p50_ms': self.percentile(counts, 0.5),
+                    'p99_ms': self.percentile(counts, 0.99),
+                    'buckets': {
+                        f'le_{edge}': count
+                        for edge, count in zip(self.edges_ms, counts)
+                    },
+                }
+                summary[venue][stage]['buckets']['inf'] = counts[-1]
+            return dict(summary)
+
+
+def received(ob, receive_ts=None):
+    """ stamp the local receive time on an order book """
+    try:
+        ob.receive_ts = receive_ts or time.time()
+    except AttributeError:
+        pass
+    return ob
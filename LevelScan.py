@@ -0,0 +1,137 @@
+###############################################################################
+# Description: Order book level scan for SniperBot
+###############################################################################
+
+import argparse
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from altonomy.core.Side import BUY
+
+
+def levels_in_band(price_levels, side, *, min_price, max_price, max_slippage_threshold):
+    """
+    Number of leading levels not worse than the price range or the slippage
+    threshold, by binary search so only those levels need converting
+    """
+    lo, hi = 0, len(price_levels)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        level = price_levels[mid]
+        worse = level.price > max_price if side == BUY else level.price < min_price
+        if worse or level.slippage > max_slippage_threshold:
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+def qualifying_levels(
+    price_levels,
+    side,
+    *,
+    large_order_threshold,
+    cumulative_order_threshold,
+    min_price,
+    max_price,
+    max_slippage_threshold,
+):
+    """
+    Indices of the levels a sniper order can be sent on, best first.
+    A level qualifies on the amount and cumulative thresholds, and the scan
+    stops at the first qualifying level outside the price range or over the
+    slippage threshold. Levels past the band can never qualify, so only
+    the levels_in_band prefix is walked.
+    """
+    end = levels_in_band(
+        price_levels, side,
+        min_price=min_price,
+        max_price=max_price,
+        max_slippage_threshold=max_slippage_threshold,
+    )
+    indices = []
+    for i in range(end):
+        level = price_levels[i]
+        if level.amount < large_order_threshold:
+            continue
+        if level.cumulative < cumulative_order_threshold:
+            continue
+        # better than the price range
+        if level.price < min_price if side == BUY else level.price > max_price:
+            break
+        indices.append(i)
+    return indices
+
+
+def qualifying_levels_loop(price_levels, side, **thresholds):
+    """ level by level scan, reference for qualifying_levels """
+    indices = []
+    for i, level in enumerate(price_levels):
+        if level.amount < thresholds['large_order_threshold']:
+            continue
+        if level.cumulative < thresholds['cumulative_order_threshold']:
+            continue
+        if (
+            level.price < thresholds['min_price']
+            or level.price > thresholds['max_price']
+        ):
+            break
+        if level.slippage > thresholds['max_slippage_threshold']:
+            break
+        indices.append(i)
+    return indices
+
+
+def random_levels(depth, side, seed=0):
+    rng = np.random.default_rng(seed)
+    step = 0.01 if side == BUY else -0.01
+    prices = 100 + step * np.arange(1, depth + 1)
+    amounts = rng.exponential(1.0, depth)
+    return [
+        SimpleNamespace(
+            price=price,
+            amount=amount,
+            cumulative=cumulative,
+            slippage=abs(price - prices[0]) / prices[0],
+        )
+        for price, amount, cumulative in zip(prices, amounts, np.cumsum(amounts))
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Micro-benchmark the sniper level scan')
+    parser.add_argument('--depth', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=2000)
+    parser.add_argument(
+        '--slippage', type=float, nargs='+', default=[0.005, 0.02, 0.1])
+    args = parser.parse_args()
+
+    levels = random_levels(args.depth, BUY)
+    for slippage in args.slippage:
+        # no level large enough, so the loop walks the whole book
+        thresholds = dict(
+            large_order_threshold=100.0,
+            cumulative_order_threshold=0.0,
+            min_price=0.0,
+            max_price=1e9,
+            max_slippage_threshold=slippage,
+        )
+        cases = (
+            ('loop', qualifying_levels_loop),
+            ('scan', qualifying_levels),
+        )
+        for name, func in cases:
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                func(levels, BUY, **thresholds)
+            elapsed = (time.perf_counter() - start) / args.repeat
+            print(
+                f'{name}: {elapsed * 1e6:.1f} us per {args.depth} level book '
+                f'at {slippage:.1%} slippage')
+
+
+if __name__ == '__main__':
+    main()
@@ -18,6 +18,7 @@ import datetime
 import requests
 from bisect import bisect
 from .ServiceBot import ServiceBot
+from .OrderDetailsSnapshot import OrderDetailsSnapshot
 from .alphas import mean_reversion_ema
 
 class LiquidityEnhancerBot(ServiceBot):
@@ -90,6 +91,8 @@ class LiquidityEnhancerBot(ServiceBot):
         #order list of all quoting levels
         self.icebergOrderbuylist = []
         self.icebergOrderselllist = []
+        # order details shared by the stages of a market making cycle
+        self.order_details = OrderDetailsSnapshot(logger=self.logger)
         #store moving average
         self.currentmovingaverage = 0.0
         #current depth book
@@ -902,6 +905,15 @@ class LiquidityEnhancerBot(ServiceBot):
         return iceburgOrderlist
 
 
+    def get_layer_order_details(self, ordertype, orderid):
+        return self.order_details.get(self.brokers[0].client, self.tradingpair, ordertype, orderid)
+
+    def refresh_layer_order_details(self):
+        """ fetch the details of every resting layer order for this cycle """
+        orders = [('BUY_LIMIT', border['orderid']) for border in self.icebergOrderbuylist] + \
+            [('SELL_LIMIT', sorder['orderid']) for sorder in self.icebergOrderselllist]
+        self.order_details.refresh(self.brokers[0].client, self.tradingpair, orders)
+
     def is_orderdetails_valid(self, orderdetails):
         return isinstance(orderdetails, dict) and len(orderdetails) > 0
 
@@ -916,7 +928,7 @@ class LiquidityEnhancerBot(ServiceBot):
             currentbuyorderid = border['orderid']
             if currentbuyorderid:
                 time.sleep(self.loop_interval)
-                buyorderdetails = self.brokers[0].client.get_order_details(self.tradingpair, 'BUY_LIMIT', currentbuyorderid, data_format='legacy')
+                buyorderdetails = self.get_layer_order_details('BUY_LIMIT', currentbuyorderid)
                 if self.is_orderdetails_valid(buyorderdetails):
                     border['lastAccumFilledAmount'] = border['accumFilledAmount']
                     border['accumFilledAmount'] = float(buyorderdetails.get('FilledAmount',0))
@@ -930,7 +942,7 @@ class LiquidityEnhancerBot(ServiceBot):
             currentsellorderid = sorder['orderid'] 
             if currentsellorderid:
                 time.sleep(self.loop_interval)
-                sellorderdetails = self.brokers[0].client.get_order_details(self.tradingpair, 'SELL_LIMIT', currentsellorderid, data_format='legacy')
+                sellorderdetails = self.get_layer_order_details('SELL_LIMIT', currentsellorderid)
                 if self.is_orderdetails_valid(sellorderdetails):
                     sorder['lastAccumFilledAmount'] = sorder['accumFilledAmount']
                     sorder['accumFilledAmount'] = float(sellorderdetails.get('FilledAmount',0))
@@ -952,7 +964,7 @@ class LiquidityEnhancerBot(ServiceBot):
             for border in self.icebergOrderbuylist:
                 borderid = border['orderid']
                 time.sleep(self.loop_interval)
-                borderdetails = self.brokers[0].client.get_order_details(self.tradingpair, 'BUY_LIMIT', borderid, data_format='legacy')
+                borderdetails = self.get_layer_order_details('BUY_LIMIT', borderid)
                 if self.is_orderdetails_valid(borderdetails):
                     self.controlled_cancel(self.brokers[0],self.tradingpair, 'BUY_LIMIT', borderid)
                     self.total_cancels += 1
@@ -963,7 +975,7 @@ class LiquidityEnhancerBot(ServiceBot):
             for sorder in self.icebergOrderselllist:
                 sorderid = sorder['orderid']
                 time.sleep(self.loop_interval)
-                sorderdetails = self.brokers[0].client.get_order_details(self.tradingpair, 'SELL_LIMIT', sorderid, data_format='legacy')
+                sorderdetails = self.get_layer_order_details('SELL_LIMIT', sorderid)
                 if self.is_orderdetails_valid(sorderdetails):
                     self.controlled_cancel(self.brokers[0],self.tradingpair, 'SELL_LIMIT', sorderid)
                     self.total_cancels += 1
@@ -985,7 +997,7 @@ class LiquidityEnhancerBot(ServiceBot):
             buyorderid = border['orderid']
             if buyorderid:
                 time.sleep(self.loop_interval)
-                buyorderdetails = self.brokers[0].client.get_order_details(self.tradingpair,'BUY_LIMIT', buyorderid, data_format='legacy')
+                buyorderdetails = self.get_layer_order_details('BUY_LIMIT', buyorderid)
                 if self.is_orderdetails_valid(buyorderdetails):
                     left_amount = border['ordersize'] - float(buyorderdetails.get('FilledAmount',0))
                     if buyorderdetails.get('Status',None) == 'Completed' or buyorderdetails.get('Status',None) == 'Canceled':
@@ -1011,7 +1023,7 @@ class LiquidityEnhancerBot(ServiceBot):
             sellorderid = sorder['orderid']
             if sellorderid:
                 time.sleep(self.loop_interval)
-                sellorderdetails = self.brokers[0].client.get_order_details(self.tradingpair, 'SELL_LIMIT', sellorderid, data_format='legacy')
+                sellorderdetails = self.get_layer_order_details('SELL_LIMIT', sellorderid)
                 if self.is_orderdetails_valid(sellorderdetails):
                     left_amount = sorder['ordersize'] - float(sellorderdetails.get('FilledAmount',0))
                     if sellorderdetails.get('Status',None) == 'Completed' or sellorderdetails.get('Status',None) == 'Canceled':
@@ -1049,7 +1061,7 @@ class LiquidityEnhancerBot(ServiceBot):
             if cancel_for_chase:
                 self.logger.info('[cancel_for_chasing]:: new_orderprice=%s, border0_price=%s' % (str(new_buy_order_price),str(border0['orderprice'])))
                 borderid = border1['orderid']
-                borderdetails = self.brokers[0].client.get_order_details(self.tradingpair, 'BUY_LIMIT', borderid, data_format='legacy')
+                borderdetails = self.get_layer_order_details('BUY_LIMIT', borderid)
                 if self.is_orderdetails_valid(borderdetails):
                     self.logger.info("[cancel_for_chasing]:: cancel - buy chase, orderid=%s, cancel_reason=%s" % (borderid, cancel_reason))
                     self.controlled_cancel(self.brokers[0],self.tradingpair, 'BUY_LIMIT', borderid)
@@ -1074,7 +1086,7 @@ class LiquidityEnhancerBot(ServiceBot):
             if cancel_for_chase:
                 self.logger.info('[cancel_for_chasing]:: new_orderprice=%s, border0_price=%s' % (str(new_sell_order_price),str(sorder0['orderprice'])))
                 sorderid = sorder1['orderid']
-                sorderdetails = self.brokers[0].client.get_order_details(self.tradingpair, 'SELL_LIMIT', sorderid, data_format='legacy')
+                sorderdetails = self.get_layer_order_details('SELL_LIMIT', sorderid)
                 if self.is_orderdetails_valid(sorderdetails):
                     self.logger.info("[cancel_for_chasing]:: cancel - sell chase, orderid=%s" % sorderid)
                     self.controlled_cancel(self.brokers[0],self.tradingpair, 'SELL_LIMIT', sorderid)
@@ -1121,7 +1133,7 @@ class LiquidityEnhancerBot(ServiceBot):
             for idx in list(reversed(range(numOrders))):
                 border = self.icebergOrderbuylist[idx]
                 borderid = border['orderid']
-                borderdetails = self.brokers[0].client.get_order_details(self.tradingpair, 'BUY_LIMIT', borderid, data_format='legacy')
+                borderdetails = self.get_layer_order_details('BUY_LIMIT', borderid)
                 if self.is_orderdetails_valid(borderdetails):
                     self.controlled_cancel(self.brokers[0],self.tradingpair,'BUY_LIMIT',borderid)
                     self.total_cancels += 1
@@ -1138,7 +1150,7 @@ class LiquidityEnhancerBot(ServiceBot):
             for idx in list(reversed(range(numOrders))):
                 sorder = self.icebergOrderselllist[idx]
                 sorderid = sorder['orderid']
-                sorderdetails = self.brokers[0].client.get_order_details(self.tradingpair, 'SELL_LIMIT', sorderid, data_format='legacy')
+                sorderdetails = self.get_layer_order_details('SELL_LIMIT', sorderid)
                 if self.is_orderdetails_valid(sorderdetails):
                     self.controlled_cancel(self.brokers[0],self.tradingpair, 'SELL_LIMIT', sorderid)
                     self.total_cancels += 1
@@ -1165,23 +1177,27 @@ class LiquidityEnhancerBot(ServiceBot):
             self.minimum_spread_final = round(self.minimum_spread_final, self.orderpricerounding)
             self.logger.info('[do_market_making]:: minimum spread for pair %s is %s' % (self.tradingpair, str(self.minimum_spread_final)))
 
-        self.logger.debug('[do_market_making]:: update_status_for_layers()')
-        self.update_status_for_layers()
-        self.update_coin_balances()
-        # ABOTS-105: updated message
-        self.logger.info('[do_market_making]:: %s%s imbalance_btc=%s, imbalance_alt=%s' % (self.altcoin,self.quotecoin,str(self.imbalance_btc),str(self.imbalance_alt)))
-        ## check if any orders needs to be cancelled (due to alpha/risk etc), and update record accordingly
-        ## check if we need to cancel furthest posted order to save room for closer post
-        self.logger.debug('[do_market_making]:: clear_and_cancel_by_alpha()')
-        self.clear_and_cancel_by_alpha()
-        self.logger.debug('[do_market_making]:: cancel_for_chasing()')
-        self.cancel_for_chasing()      
-        self.logger.debug('[do_market_making]:: cancel_for_risk()')
-        self.cancel_for_risk()
+        self.refresh_layer_order_details()
+        try:
+            self.logger.debug('[do_market_making]:: update_status_for_layers()')
+            self.update_status_for_layers()
+            self.update_coin_balances()
+            # ABOTS-105: updated message
+            self.logger.info('[do_market_making]:: %s%s imbalance_btc=%s, imbalance_alt=%s' % (self.altcoin,self.quotecoin,str(self.imbalance_btc),str(self.imbalance_alt)))
+            ## check if any orders needs to be cancelled (due to alpha/risk etc), and update record accordingly
+            ## check if we need to cancel furthest posted order to save room for closer post
+            self.logger.debug('[do_market_making]:: clear_and_cancel_by_alpha()')
+            self.clear_and_cancel_by_alpha()
+            self.logger.debug('[do_market_making]:: cancel_for_chasing()')
+            self.cancel_for_chasing()      
+            self.logger.debug('[do_market_making]:: cancel_for_risk()')
+            self.cancel_for_risk()
         
-        ## check if any orders needs to be posted, and update active orders list accordingly
-        self.logger.debug('[do_market_making]:: do_posting()')
-        self.do_posting()
+            ## check if any orders needs to be posted, and update active orders list accordingly
+            self.logger.debug('[do_market_making]:: do_posting()')
+            self.do_posting()
+        finally:
+            self.order_details.clear()
 
     # ABOTS-110: check prices for le bot
     def prices_are_out_of_range(self, price: float):
@@ -1427,6 +1443,7 @@ class LiquidityEnhancerBot(ServiceBot):
 
     def exit_processing(self):
         """make sure to exit the bot safely, no opening orders left"""
+        self.order_details.stop()
         for buyorderid in self.brokers[0].buyorderlist:
             self.logger.debug("cancel buy orders: %s" % buyorderid)
             self.controlled_cancel(self.brokers[0],self.tradingpair, 'BUY_LIMIT', buyorderid)
@@ -0,0 +1,152 @@
+###############################################################################
+# Description: Process wide market history (kline) service over zerorpc
+###############################################################################
+
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+import cachetools
+
+from . import config
+
+
+class MarketHistoryConnection():
+    """
+    Long lived zerorpc connection of one source. Calls are serialized on
+    the connection, which is reopened after an error, and before use when
+    it has been idle for longer than idle_timeout.
+    """
+
+    def __init__(self, source, idle_timeout, timer, logger):
+        self.logger = logger
+        self.source = source
+        self.idle_timeout = idle_timeout
+        self.timer = timer
+        self.connection = None
+        self.zrpc = None
+        self.last_used_ts = 0
+        self.lock = threading.Lock()
+
+    def connect(self, alt_client):
+        self.connection = alt_client.zerorpc()
+        self.zrpc = self.connection.__enter__()
+        self.last_used_ts = self.timer()
+        self.logger.info(
+            f'MarketHistoryService connected {self.source} - {self.zrpc}')
+
+    def close(self):
+        if self.connection is None:
+            return
+        try:
+            self.connection.__exit__(None, None, None)
+        except Exception as e:
+            self.logger.error(
+                f'MarketHistoryService close {self.source} failed - {e}')
+        finally:
+            self.connection = None
+            self.zrpc = None
+
+    def healthy(self):
+        return self.zrpc is not None \
+            and self.timer() - self.last_used_ts < self.idle_timeout
+
+    def call(self, alt_client, method, *args):
+        """ call the rpc method, reconnecting and retrying once on error """
+        with self.lock:
+            for attempt in range(2):
+                if not self.healthy():
+                    self.close()
+                    self.connect(alt_client)
+                try:
+                    result = getattr(self.zrpc, method)(*args)
+                    self.last_used_ts = self.timer()
+                    return result
+                except Exception as e:
+                    self.logger.warning(
+                        f'MarketHistoryService {self.source} {method} failed, '
+                        f'reconnecting - {e}')
+                    self.close()
+                    if attempt:
+                        raise
+
+
+class MarketHistoryService():
+    """
+    Market history requests shared by the bots of the process, over one
+    long lived zerorpc connection per source, the exchange and account the
+    requesting client serves. Responses are cached for ttl seconds by
+    (source, pair, duration, count) and concurrent identical requests wait
+    on the one in flight, so bots on the same market share a request.
+    """
+
+    def __init__(
+        self,
+        ttl=config.MARKET_HISTORY_CACHE_TTL,
+        idle_timeout=config.ZERORPC_IDLE_TIMEOUT,
+        timer=time.monotonic,
+        logger=None,
+    ):
+        self.logger = logger or logging.getLogger()
+        self.idle_timeout = idle_timeout
+        self.timer = timer
+        self.cache = cachetools.TTLCache(maxsize=256, ttl=ttl, timer=timer)
+        self.connections = {}
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    def connection_of(self, source):
+        with self.lock:
+            connection = self.connections.get(source)
+            if connection is None:
+                connection = self.connections[source] = MarketHistoryConnection(
+                    source, self.idle_timeout, self.timer, self.logger)
+            return connection
+
+    def close(self):
+        with self.lock:
+            connections = list(self.connections.values())
+        for connection in connections:
+            with connection.lock:
+                connection.close()
+
+    def call(self, alt_client, source, method, *args):
+        return self.connection_of(source).call(alt_client, method, *args)
+
+    def get_market_history(self, alt_client, source, pair, duration, count):
+        """
+        :source hashable identifying the market served by alt_client,
+            e.g. (exchange name, account id)
+        """
+        key = (source, pair, duration, count)
+        owner = False
+        with self.lock:
+            history = self.cache.get(key)
+            if history is not None:
+                return history
+            future = self.in_flight.get(key)
+            if future is None:
+                future = self.in_flight[key] = Future()
+                future.set_running_or_notify_cancel()
+                owner = True
+        if not owner:
+            return future.result()
+
+        try:
+            history = self.call(
+                alt_client, source, 'get_market_history', pair, duration, count)
+        except Exception as e:
+            with self.lock:
+                self.in_flight.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self.lock:
+            if history:
+                self.cache[key] = history
+            self.in_flight.pop(key, None)
+        future.set_result(history)
+        return history
+
+
+market_history = MarketHistoryService()
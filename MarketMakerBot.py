@@ -18,6 +18,7 @@ import datetime
 import requests
 from bisect import bisect
 from .ServiceBot import ServiceBot
+from .OrderDetailsSnapshot import OrderDetailsSnapshot
 from .alphas import mean_reversion_ema, book_pressure
 
 class MarketMakerBot(ServiceBot):
@@ -81,6 +82,8 @@ class MarketMakerBot(ServiceBot):
         #order list of all quoting levels
         self.icebergOrderbuylist = []
         self.icebergOrderselllist = []
+        # order details shared by the stages of a market making cycle
+        self.order_details = OrderDetailsSnapshot(logger=self.logger)
         #store moving average
         self.currentmovingaverage = 0.0
         #current depth book
@@ -793,6 +796,15 @@ class MarketMakerBot(ServiceBot):
         return iceburgOrderlist
 
 
+    def get_layer_order_details(self, ordertype, orderid):
+        return self.order_details.get(self.brokers[0].client, self.tradingpair, ordertype, orderid)
+
+    def refresh_layer_order_details(self):
+        """ fetch the details of every resting layer order for this cycle """
+        orders = [('BUY_LIMIT', border['orderid']) for border in self.icebergOrderbuylist] + \
+            [('SELL_LIMIT', sorder['orderid']) for sorder in self.icebergOrderselllist]
+        self.order_details.refresh(self.brokers[0].client, self.tradingpair, orders)
+
     def is_orderdetails_valid(self, orderdetails):
         return isinstance(orderdetails, dict) and len(orderdetails) > 0 and orderdetails.get('FilledAmount',-1) >= 0
 
@@ -806,7 +818,7 @@ class MarketMakerBot(ServiceBot):
         for border in self.icebergOrderbuylist:
             currentbuyorderid = border['orderid']
             if currentbuyorderid:
-                buyorderdetails = self.brokers[0].client.get_order_details(self.tradingpair, 'BUY_LIMIT', currentbuyorderid, data_format='legacy')
+                buyorderdetails = self.get_layer_order_details('BUY_LIMIT', currentbuyorderid)
                 if self.is_orderdetails_valid(buyorderdetails):
                     border['lastAccumFilledAmount'] = border['accumFilledAmount']
                     border['accumFilledAmount'] = float(buyorderdetails['FilledAmount'])
@@ -820,7 +832,7 @@ class MarketMakerBot(ServiceBot):
         for sorder in self.icebergOrderselllist:
             currentsellorderid = sorder['orderid'] 
             if currentsellorderid:
-                sellorderdetails = self.brokers[0].client.get_order_details(self.tradingpair, 'SELL_LIMIT', currentsellorderid, data_format='legacy')
+                sellorderdetails = self.get_layer_order_details('SELL_LIMIT', currentsellorderid)
                 if self.is_orderdetails_valid(sellorderdetails):
                     sorder['lastAccumFilledAmount'] = sorder['accumFilledAmount']
                     sorder['accumFilledAmount'] = float(sellorderdetails['FilledAmount'])
@@ -844,7 +856,7 @@ class MarketMakerBot(ServiceBot):
         if side == 'BUY':
             for border in self.icebergOrderbuylist:
                 borderid = border['orderid']
-                borderdetails = self.brokers[0].client.get_order_details(self.tradingpair, 'BUY_LIMIT', borderid, data_format='legacy')
+                borderdetails = self.get_layer_order_details('BUY_LIMIT', borderid)
                 if self.is_orderdetails_valid(borderdetails):
                     self.brokers[0].client.cancel_wait(borderid, no_wait=True)
                     self.update_imbalance_from_order(border, borderdetails)
@@ -858,7 +870,7 @@ class MarketMakerBot(ServiceBot):
         elif side == 'SELL':
             for sorder in self.icebergOrderselllist:
                 sorderid = sorder['orderid']
-                sorderdetails = self.brokers[0].client.get_order_details(self.tradingpair, 'SELL_LIMIT', sorderid, data_format='legacy')
+                sorderdetails = self.get_layer_order_details('SELL_LIMIT', sorderid)
                 if self.is_orderdetails_valid(sorderdetails):
                     self.brokers[0].client.cancel_wait(sorderid, no_wait=True)
                     self.update_imbalance_from_order(sorder, sorderdetails)
@@ -883,7 +895,7 @@ class MarketMakerBot(ServiceBot):
                 continue
             buyorderid = border['orderid']
             if buyorderid:
-                buyorderdetails = self.brokers[0].client.get_order_details(self.tradingpair,'BUY_LIMIT', buyorderid, data_format='legacy')
+                buyorderdetails = self.get_layer_order_details('BUY_LIMIT', buyorderid)
                 if self.is_orderdetails_valid(buyorderdetails):
                     left_amount = border['ordersize'] - float(buyorderdetails['FilledAmount'])
                     if buyorderdetails['Status'] == 'Completed' or buyorderdetails['Status'] == 'Canceled':
@@ -910,7 +922,7 @@ class MarketMakerBot(ServiceBot):
                 continue
             sellorderid = sorder['orderid']
             if sellorderid:
-                sellorderdetails = self.brokers[0].client.get_order_details(self.tradingpair, 'SELL_LIMIT', sellorderid, data_format='legacy')
+                sellorderdetails = self.get_layer_order_details('SELL_LIMIT', sellorderid)
                 if self.is_orderdetails_valid(sellorderdetails):
                     left_amount = sorder['ordersize'] - float(sellorderdetails['FilledAmount'])
                     if sellorderdetails['Status'] == 'Completed' or sellorderdetails['Status'] == 'Canceled':
@@ -942,7 +954,7 @@ class MarketMakerBot(ServiceBot):
             if (new_buy_order_price - border0['orderprice']) > min_sep:
                 self.logger.info('[cancel_for_chasing]:: new_orderprice=%s, border0_price=%s' % (str(new_buy_order_price),str(border0['orderprice'])))
                 borderid = border1['orderid']
-                borderdetails = self.brokers[0].client.get_order_details(self.tradingpair, 'BUY_LIMIT', borderid, data_format='legacy')
+                borderdetails = self.get_layer_order_details('BUY_LIMIT', borderid)
                 if self.is_orderdetails_valid(borderdetails):
                     self.logger.info("[cancel_for_chasing]:: cancel - buy chase, orderid=%s" % borderid)
                     self.brokers[0].client.cancel_wait(borderid, no_wait=True)
@@ -959,7 +971,7 @@ class MarketMakerBot(ServiceBot):
             if (new_sell_order_price - sorder0['orderprice']) < -min_sep:
                 self.logger.info('[cancel_for_chasing]:: new_orderprice=%s, border0_price=%s' % (str(new_sell_order_price),str(sorder0['orderprice'])))
                 sorderid = sorder1['orderid']
-                sorderdetails = self.brokers[0].client.get_order_details(self.tradingpair, 'SELL_LIMIT', sorderid, data_format='legacy')
+                sorderdetails = self.get_layer_order_details('SELL_LIMIT', sorderid)
                 if self.is_orderdetails_valid(sorderdetails):
                     self.logger.info("[cancel_for_chasing]:: cancel - sell chase, orderid=%s" % sorderid)
                     self.brokers[0].client.cancel_wait(sorderid, no_wait=True)
@@ -991,7 +1003,7 @@ class MarketMakerBot(ServiceBot):
             for idx in list(reversed(range(numOrders))):
                 border = self.icebergOrderbuylist[idx]
                 borderid = border['orderid']
-                borderdetails = self.brokers[0].client.get_order_details(self.tradingpair, 'BUY_LIMIT', borderid, data_format='legacy')
+                borderdetails = self.get_layer_order_details('BUY_LIMIT', borderid)
                 if self.is_orderdetails_valid(borderdetails):
                     self.brokers[0].client.cancel_wait(borderid, no_wait=True)
                     self.update_imbalance_from_order(border, borderdetails)
@@ -1009,7 +1021,7 @@ class MarketMakerBot(ServiceBot):
             for idx in list(reversed(range(numOrders))):
                 sorder = self.icebergOrderselllist[idx]
                 sorderid = sorder['orderid']
-                sorderdetails = self.brokers[0].client.get_order_details(self.tradingpair, 'SELL_LIMIT', sorderid, data_format='legacy')
+                sorderdetails = self.get_layer_order_details('SELL_LIMIT', sorderid)
                 if self.is_orderdetails_valid(sorderdetails):
                     self.brokers[0].client.cancel_wait(sorderid, no_wait=True)
                     self.update_imbalance_from_order(sorder, sorderdetails)
@@ -1029,23 +1041,27 @@ class MarketMakerBot(ServiceBot):
             self.update_min_separation()
             self.logger.info('[do_market_making]:: minimum separation for pair %s is %s, min order value is %s' % (self.tradingpair, str(self.min_sep), str(self.min_ordervalue)))
 
-        self.logger.debug('[do_market_making]:: update_status_for_layers()')
-        self.update_status_for_layers()
-        self.update_coin_balances()
-        self.logger.info('[do_market_making]:: %s%s imbalance_btc=%s' % (self.altcoin,self.quotecoin,str(self.imbalance_btc)))
-        ## check if any orders needs to be cancelled (due to alpha/risk etc), and update record accordingly
-        ## check if we need to cancel furthest posted order to save room for closer post
-        self.calculate_consolidated_alpha()
-        self.logger.debug('[do_market_making]:: clear_and_cancel_by_alpha()')
-        self.clear_and_cancel_by_alpha()
-        self.logger.debug('[do_market_making]:: cancel_for_chasing()')
-        self.cancel_for_chasing()      
-        self.logger.debug('[do_market_making]:: cancel_for_risk()')
-        self.cancel_for_risk()
+        self.refresh_layer_order_details()
+        try:
+            self.logger.debug('[do_market_making]:: update_status_for_layers()')
+            self.update_status_for_layers()
+            self.update_coin_balances()
+            self.logger.info('[do_market_making]:: %s%s imbalance_btc=%s' % (self.altcoin,self.quotecoin,str(self.imbalance_btc)))
+            ## check if any orders needs to be cancelled (due to alpha/risk etc), and update record accordingly
+            ## check if we need to cancel furthest posted order to save room for closer post
+            self.calculate_consolidated_alpha()
+            self.logger.debug('[do_market_making]:: clear_and_cancel_by_alpha()')
+            self.clear_and_cancel_by_alpha()
+            self.logger.debug('[do_market_making]:: cancel_for_chasing()')
+            self.cancel_for_chasing()      
+            self.logger.debug('[do_market_making]:: cancel_for_risk()')
+            self.cancel_for_risk()
         
-        ## check if any orders needs to be posted, and update active orders list accordingly
-        self.logger.debug('[do_market_making]:: do_posting()')
-        self.do_posting()
+            ## check if any orders needs to be posted, and update active orders list accordingly
+            self.logger.debug('[do_market_making]:: do_posting()')
+            self.do_posting()
+        finally:
+            self.order_details.clear()
 
     def do_posting(self):
         self.logger.debug("[do_posting]::")
@@ -1192,6 +1208,7 @@ class MarketMakerBot(ServiceBot):
 
     def exit_processing(self):
         """make sure to exit the bot safely, no opening orders left"""
+        self.order_details.stop()
         for buyorderid in self.brokers[0].buyorderlist:
             self.logger.debug("cancel buy orders: %s" % buyorderid)
             self.brokers[0].client.cancel_wait(buyorderid, no_wait=True)
@@ -0,0 +1,94 @@
+###############################################################################
+# Description: Incrementally maintained multi venue order book
+###############################################################################
+
+import heapq
+import threading
+
+
+class BookSlot():
+    """
+    Double buffered book of one venue. The writer fills the idle buffer and
+    then flips the active index, so a reader always gets a complete
+    (seq, book) pair without taking a lock; seq increases on every write.
+    """
+
+    __slots__ = ('buffers', 'active', 'seq', 'write_lock')
+
+    def __init__(self):
+        self.buffers = [(0, None), (0, None)]
+        self.active = 0
+        self.seq = 0
+        self.write_lock = threading.Lock()
+
+    def write(self, ob):
+        with self.write_lock:
+            idle = 1 - self.active
+            self.buffers[idle] = (self.seq + 1, ob)
+            self.active = idle
+            self.seq += 1
+            return self.seq
+
+    def read(self):
+        return self.buffers[self.active]
+
+
+class MergedOrderBook():
+    """
+    Latest order book of each venue, merged on read. An update only
+    replaces the levels of its own venue; the merged ladder is a lazy k-way
+    merge of the already sorted venue ladders, so the best N levels cost
+    O(N log venues) with no re-sort of the combined book.
+    """
+
+    def __init__(self):
+        self.slots = {}
+        self.slots_lock = threading.Lock()
+
+    def __len__(self):
+        return sum(1 for slot in list(self.slots.values()) if slot.seq)
+
+    def slot(self, venue):
+        slot = self.slots.get(venue)
+        if slot is None:
+            with self.slots_lock:
+                slot = self.slots.setdefault(venue, BookSlot())
+        return slot
+
+    def update(self, venue, ob):
+        """ replace the book of venue, returns its seq """
+        return self.slot(venue).write(ob)
+
+    def snapshot(self):
+        """ (seq, book) of every venue with a book """
+        books = {}
+        for venue, slot in list(self.slots.items()):
+            seq, ob = slot.read()
+            if ob is not None:
+                books[venue] = (seq, ob)
+        return books
+
+    def changed(self, seen_seq):
+        """
+        (seq, book) of the venues updated since the seq recorded in
+        seen_seq, which is advanced to the returned seq
+        """
+        books = {
+            venue: (seq, ob) for venue, (seq, ob) in self.snapshot().items()
+            if seq > seen_seq.get(venue, 0)}
+        seen_seq.update({venue: seq for venue, (seq, _) in books.items()})
+        return books
+
+    @property
+    def books(self):
+        return {venue: ob for venue, (_, ob) in self.snapshot().items()}
+
+    @staticmethod
+    def merge_levels(books, side):
+        """ lazy merge of the 'bids' or 'asks' ladders of books """
+        ladders = [getattr(ob, side) for ob in books]
+        if side == 'bids':
+            return heapq.merge(
+                *ladders, key=lambda level: level.price, reverse=True)
+        return heapq.merge(*ladders, key=lambda level: level.price)
+
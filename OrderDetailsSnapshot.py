@@ -0,0 +1,63 @@
+###############################################################################
+# Description: Per cycle snapshot of resting order details
+###############################################################################
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+
+class OrderDetailsSnapshot():
+    """
+    Legacy order details of the resting orders, fetched once at the start
+    of a market making cycle, in parallel, and shared by every stage of the
+    cycle. Orders missing from the snapshot are fetched on demand and
+    added; outside a cycle every lookup goes to the client.
+    """
+
+    def __init__(self, max_workers=8, logger=None):
+        self.logger = logger or logging.getLogger()
+        self.details = {}
+        self.active = False
+        self.fetches = 0
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='OrderDetailsSnapshot')
+
+    def fetch(self, alt_client, tradingpair, ordertype, orderid):
+        self.fetches += 1
+        return alt_client.get_order_details(
+            tradingpair, ordertype, orderid, data_format='legacy')
+
+    def refresh(self, alt_client, tradingpair, orders):
+        """ start a cycle with the details of orders, [(ordertype, orderid)] """
+        self.details = {}
+        self.fetches = 0
+        futures = {
+            orderid: self.executor.submit(
+                self.fetch, alt_client, tradingpair, ordertype, orderid)
+            for ordertype, orderid in orders if orderid
+        }
+        for orderid, future in futures.items():
+            try:
+                self.details[orderid] = future.result()
+            except Exception as e:
+                self.logger.error(
+                    f'[OrderDetailsSnapshot]:: failed to fetch {orderid} - {e}')
+        self.active = True
+
+    def get(self, alt_client, tradingpair, ordertype, orderid):
+        if not self.active:
+            return self.fetch(alt_client, tradingpair, ordertype, orderid)
+        if orderid not in self.details:
+            self.details[orderid] = self.fetch(
+                alt_client, tradingpair, ordertype, orderid)
+        return self.details[orderid]
+
+    def clear(self):
+        """ end of the cycle """
+        self.logger.debug(
+            f'[OrderDetailsSnapshot]:: {self.fetches} order details fetched this cycle')
+        self.details = {}
+        self.active = False
+
+    def stop(self):
+        self.executor.shutdown(wait=False)
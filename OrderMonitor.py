@@ -17,8 +17,10 @@ class OrderMonitor(threading.Thread, contextlib.AbstractContextManager):
         try_cancels=0,
         refresh_interval=0.2,
         try_cancel_interval=10,
+        clock=None,
     ):
         super().__init__(name='OrderMonitor')
+        self.clock = clock or time
         self.open_orders = {}
         self.completed_orders = {}
         self.failed_orders = {}
@@ -34,6 +36,9 @@ class OrderMonitor(threading.Thread, contextlib.AbstractContextManager):
         self.try_cancel_interval = try_cancel_interval
         self.cancel_count = defaultdict(int)
         self.last_cancel_attempt = defaultdict(int)
+        # quantity placed and not given back by cancels/fails, kept per order
+        self.committed_qty = 0.0
+        self.committed_by_order = {}
         self.lock = threading.Lock()
 
     def initialise_starting_position(self, open_orders, total_dealt_by_side, total_dealt_notional_by_side):
@@ -57,58 +62,64 @@ class OrderMonitor(threading.Thread, contextlib.AbstractContextManager):
         self.logger.info('Thread for OrderMonitor started')
         while not self.stop_flag.is_set():
             try:
-                for order_id in list(self.open_orders):
-                    self.logger.debug(f'OrderMonitor checking {order_id}')
-                    order = self.client.get_order_details(
-                        order_id=order_id, force_refresh=True
-                    )
-                    order.pop('raw', None) # raw message detail is not required
-                    self.logger.debug(f'OrderMonitor got order {order_id}: {order}')
-                    with self.lock:
-                        if order.completed or order.canceled:
-                            self.logger.debug(
-                                f'OrderMonitor deem {order_id} as complete'
-                            )
-                            self.open_orders.pop(order_id, None)
-                            if order.dealt > 0:
-                                self.completed_orders[order_id] = self.completed_order(order)
-                                self.logger.debug(
-                                    f'Added in completed orders {order_id}'
-                                )
-                                self.total_dealt_by_side[str(order.side)] += order.dealt
-                                self.total_dealt_notional_by_side[str(order.side)] += order.dealt * order.price
-                        elif (
-                            order.failed(exchange_response_timeout=300)
-                            or self.cancel_count[order_id] > self.try_cancels
-                        ):
-                            self.logger.debug(
-                                f'OrderMonitor deem {order_id} as in invalid state'
-                            )
-                            self.open_orders.pop(order_id, None)
-                            self.failed_orders[order_id] = order
-                            if order.dealt > 0:
-                                self.completed_orders[order_id] = self.completed_order(order)
-                                self.total_dealt_by_side[str(order.side)] += order.dealt
-                                self.total_dealt_notional_by_side[str(order.side)] += order.dealt * order.price
-                        else:
-                            if order:
-                                self.open_orders[order_id] = order
-                            if (
-                                self.try_cancels > 0
-                                and order.state != OrderState.SENDING
-                                and time.time()
-                                > self.last_cancel_attempt[order_id]
-                                + self.try_cancel_interval
-                            ):
-                                self.logger.debug(f'OrderMonitor canceling {order_id}')
-                                self.client.cancel(order_id)
-                                self.last_cancel_attempt[order_id] = time.time()
-                                self.cancel_count[order_id] += 1
-                    time.sleep(self.refresh_interval)
+                self.refresh()
             except:
                 self.logger.error(f'OrderMonitor error: {traceback.format_exc()}')
-                time.sleep(5)
-            time.sleep(self.refresh_interval)
+                self.clock.sleep(5)
+            self.clock.sleep(self.refresh_interval)
+
+    def refresh(self):
+        """ single pass over the open orders """
+        for order_id in list(self.open_orders):
+            self.logger.debug(f'OrderMonitor checking {order_id}')
+            order = self.client.get_order_details(
+                order_id=order_id, force_refresh=True
+            )
+            order.pop('raw', None) # raw message detail is not required
+            self.logger.debug(f'OrderMonitor got order {order_id}: {order}')
+            with self.lock:
+                if order.completed or order.canceled:
+                    self.logger.debug(
+                        f'OrderMonitor deem {order_id} as complete'
+                    )
+                    self.open_orders.pop(order_id, None)
+                    self._settle_committed(order_id, order.dealt)
+                    if order.dealt > 0:
+                        self.completed_orders[order_id] = self.completed_order(order)
+                        self.logger.debug(
+                            f'Added in completed orders {order_id}'
+                        )
+                        self.total_dealt_by_side[str(order.side)] += order.dealt
+                        self.total_dealt_notional_by_side[str(order.side)] += order.dealt * order.price
+                elif (
+                    order.failed(exchange_response_timeout=300)
+                    or self.cancel_count[order_id] > self.try_cancels
+                ):
+                    self.logger.debug(
+                        f'OrderMonitor deem {order_id} as in invalid state'
+                    )
+                    self.open_orders.pop(order_id, None)
+                    self._settle_committed(order_id, order.dealt)
+                    self.failed_orders[order_id] = order
+                    if order.dealt > 0:
+                        self.completed_orders[order_id] = self.completed_order(order)
+                        self.total_dealt_by_side[str(order.side)] += order.dealt
+                        self.total_dealt_notional_by_side[str(order.side)] += order.dealt * order.price
+                else:
+                    if order:
+                        self.open_orders[order_id] = order
+                    if (
+                        self.try_cancels > 0
+                        and order.state != OrderState.SENDING
+                        and self.clock.time()
+                        > self.last_cancel_attempt[order_id]
+                        + self.try_cancel_interval
+                    ):
+                        self.logger.debug(f'OrderMonitor canceling {order_id}')
+                        self.client.cancel(order_id)
+                        self.last_cancel_attempt[order_id] = self.clock.time()
+                        self.cancel_count[order_id] += 1
+            self.clock.sleep(self.refresh_interval)
 
     @property
     def dealt(self):
@@ -207,6 +218,16 @@ class OrderMonitor(threading.Thread, contextlib.AbstractContextManager):
     def orders(self):
         return {**self.open_orders, **self.completed_orders}
 
+    def open_orders_snapshot(self):
+        """ the open orders, copied under the lock """
+        with self.lock:
+            return list(self.open_orders.values())
+
+    def orders_snapshot(self):
+        """ the open and completed orders, copied under the lock """
+        with self.lock:
+            return list(self.orders.values())
+
     def set_try_cancel_interval(self, value):
         self.try_cancel_interval = value
 
@@ -219,19 +240,82 @@ class OrderMonitor(threading.Thread, contextlib.AbstractContextManager):
             "account_id": order.account_id,
         })
 
-    def add(self, order_id):
+    def reserve(self, size, limit):
+        """
+        Reserve up to size for an order about to be sent, without the
+        committed quantity going over limit. Returns the reserved size.
+        """
+        with self.lock:
+            reserved = min(size, limit - self.committed_qty)
+            if reserved <= 0:
+                return 0.0
+            self.committed_qty += reserved
+            return reserved
+
+    def release(self, size):
+        """ give back a reservation that was not sent """
+        with self.lock:
+            self.committed_qty -= size
+
+    def _settle_committed(self, order_id, dealt):
+        # only the dealt part of a finished order stays committed
+        committed = self.committed_by_order.pop(order_id, None)
+        if committed is not None:
+            self.committed_qty -= max(committed - (dealt or 0.0), 0.0)
+
+    def recompute_committed_qty(self):
+        """ rebuild the committed quantity after the orders are replaced """
+        with self.lock:
+            self.committed_by_order = {
+                order_id: order.amount
+                for order_id, order in self.open_orders.items()
+                if order is not None
+            }
+            self.committed_qty = self.starting_dealt + sum(
+                order.dealt for order in self.completed_orders.values() if order is not None
+            ) + sum(self.committed_by_order.values())
+
+    def pop_settled_orders(self, keep=()):
+        """
+        Remove the completed and failed orders not in keep, and return the
+        completed ones for the caller to fold into its own dealt totals.
+        Their dealt quantity leaves dealt and the committed quantity.
+        """
+        with self.lock:
+            settled = {
+                order_id: order
+                for order_id, order in self.completed_orders.items()
+                if order_id not in keep
+            }
+            for order_id in settled:
+                self.completed_orders.pop(order_id, None)
+            self.committed_qty -= sum(
+                order.dealt for order in settled.values() if order is not None)
+            for order_id in list(self.failed_orders):
+                if order_id not in keep:
+                    self.failed_orders.pop(order_id, None)
+            for order_id in list(self.last_cancel_attempt):
+                if order_id not in keep and order_id not in self.open_orders:
+                    self.last_cancel_attempt.pop(order_id, None)
+                    self.cancel_count.pop(order_id, None)
+        return settled
+
+    def add(self, order_id, committed=None):
+        # fetched outside the lock so adds from several threads overlap
+        order = self.client.get_order_details(order_id=order_id)
+        order.pop('raw', None) # raw message detail is not required
         with self.lock:
             self.logger.debug(f'OrderMonitor added order {order_id}')
-            self.open_orders[order_id] = self.client.get_order_details(
-                order_id=order_id
-            )
-            self.open_orders[order_id].pop('raw', None) # raw message detail is not required
-        self.last_cancel_attempt[order_id] = time.time()
+            if committed is not None:
+                self.committed_by_order[order_id] = committed
+            self.open_orders[order_id] = order
+        self.last_cancel_attempt[order_id] = self.clock.time()
 
     def delete(self, order_id):
         with self.lock:
             self.logger.debug(f'OrderMonitor deleting order {order_id}')
-            self.open_orders.pop(order_id, None)
+            order = self.open_orders.pop(order_id, None)
+            self._settle_committed(order_id, order.dealt if order is not None else 0.0)
 
     def stop(self):
         self.stop_flag.set()
@@ -249,3 +333,47 @@ class OrderMonitor(threading.Thread, contextlib.AbstractContextManager):
         print('OrderMonitor exiting')
         self.logger.error(traceback.format_exc())
         self.stop()
+
+
+class OrderMonitorHub(threading.Thread):
+    """
+    One refresh thread for the order monitors of several legs, instead of
+    a thread per monitor. Registered monitors are not started themselves;
+    a stopped monitor is skipped.
+    """
+
+    def __init__(self, logger, refresh_interval=0.2):
+        super().__init__(name='OrderMonitorHub')
+        self.logger = logger
+        self.refresh_interval = refresh_interval
+        self.monitors = []
+        self.stop_flag = threading.Event()
+        self.lock = threading.Lock()
+
+    def register(self, order_monitor):
+        with self.lock:
+            self.monitors.append(order_monitor)
+            if not self.is_alive() and not self.stop_flag.is_set():
+                self.start()
+
+    def unregister(self, order_monitor):
+        with self.lock:
+            if order_monitor in self.monitors:
+                self.monitors.remove(order_monitor)
+
+    def run(self):
+        self.logger.info('Thread for OrderMonitorHub started')
+        while not self.stop_flag.is_set():
+            with self.lock:
+                monitors = list(self.monitors)
+            for order_monitor in monitors:
+                if order_monitor.stop_flag.is_set():
+                    continue
+                try:
+                    order_monitor.refresh()
+                except:
+                    self.logger.error(f'OrderMonitorHub error: {traceback.format_exc()}')
+            time.sleep(self.refresh_interval)
+
+    def stop(self):
+        self.stop_flag.set()
@@ -13,16 +13,23 @@ from math import ceil, fabs
 import json
 
 import cachetools
+from concurrent.futures import ThreadPoolExecutor
 from importlib import import_module
 
-from .OrderMonitor import OrderMonitor
+from .OrderMonitor import OrderMonitor, OrderMonitorHub
+from .PriceServer import price_server
 from . import config
+from .ConversionRates import conversion_rates
 from .HelmClient import HelmClient
+from .InstrumentCache import instrument_cache
+from .MergedOrderBook import MergedOrderBook
+from .SpreadHistory import SpreadHistory
 from altonomy.core import OrderBook, client
+from altonomy.core import Streams
+from altonomy.core.OrderBook import UDSOrderBook
 from altonomy.core.Side import BUY, SELL, Side
 from altonomy.core.exceptions import ErrorCode
 from altonomy.ref_data_api.api import InstrumentDataSession, InstrumentData
-import altonomy.price_server_api.api as psa
 from altonomy.core.Order import Order
 
 class Aggressiveness(IntEnum):
@@ -51,6 +58,7 @@ class TradableBitMask(IntEnum):
     StartConditionNotMeet = 1 << 9
     CancelConditionMeet = 1 << 10
     PriceOutRange = 1 << 11
+    MarketDataSkewed = 1 << 12
 
 class ConditionType(IntEnum):
     NO_CONDITION = 0
@@ -58,6 +66,8 @@ class ConditionType(IntEnum):
     SPREAD_SMALLER_THAN = 2
     SPREAD_BIGGER_THAN_WITH_DIRECTION = 3
     SPREAD_SMALLER_THAN_WITH_DIRECTION = 4
+    SPREAD_ZSCORE_BIGGER_THAN = 5
+    SPREAD_ZSCORE_SMALLER_THAN = 6
 
 class LegStatus(IntEnum):
     WAITING = 0
@@ -112,7 +122,7 @@ class SpreadLeg():
         Aggressiveness.TAKING: (lambda tob, toa, tick, multiplier: tob)
     }
 
-    def __init__(self, alt_coin, qoute_coin, account_id, instrument_type, qty, slice_size, side, order_type, aggressiveness, tick_multiplier, pair_leg, primary_leg, logger, service_id, pricer, alt_client=None, position=None) -> None:
+    def __init__(self, alt_coin, qoute_coin, account_id, instrument_type, qty, slice_size, side, order_type, aggressiveness, tick_multiplier, pair_leg, primary_leg, logger, service_id, pricer, alt_client=None, position=None, notional_ratio=1.0, order_monitor_hub=None, name=None) -> None:
         self.alt_coin = alt_coin
         self.qoute_coin = qoute_coin
         self.account_id = account_id
@@ -126,6 +136,10 @@ class SpreadLeg():
         self.tick_multiplier: float = tick_multiplier
         self.pair_leg : SpreadLeg = pair_leg
         self.primary_leg : bool = primary_leg
+        # notional of this leg per notional of pair_leg, and the legs hedging this one
+        self.notional_ratio : float = notional_ratio
+        self.hedge_legs : list = []
+        self.name = name
         self.initial_position = position
         self.remark = ''
 
@@ -133,6 +147,8 @@ class SpreadLeg():
         self.start_threshold = 0.0
         self.suspend_condition = ConditionType.NO_CONDITION
         self.suspend_threshold = 0.0
+        self.max_leg_skew = config.PAIR_MAX_LEG_SKEW
+        self.spread_history = SpreadHistory(config.SPREAD_HISTORY_SIZE, config.SPREAD_ZSCORE_MIN_SAMPLES)
 
         self.logger = logger
         self.service_id = service_id
@@ -151,6 +167,7 @@ class SpreadLeg():
         self.tob_size = None
         self.toa_size = None
         self.mid = None
+        self.book_ts = None
 
         self.order_id = None
         self.instrument_data = None
@@ -167,7 +184,10 @@ class SpreadLeg():
         self.usd_usdt_convertion_rate = 0.0
         self.rate_qty_update_ts = time.time()
         
-        self.order_monitor.start()
+        if order_monitor_hub is not None:
+            order_monitor_hub.register(self.order_monitor)
+        else:
+            self.order_monitor.start()
 
         self._last_error = None
         self.leg_status = LegStatus.WAITING
@@ -245,13 +265,9 @@ class SpreadLeg():
         
         try:
             exchange_id = self.exchange_id_of(account_id=self.account_id)
-            s = self.client.instrument_data()
-            instruments = s.get_active_instruments_for_exchange(exchange_id)
-
             exchange_symbol = self.get_exchange_symbol()
-            for ins in instruments:
-                if ins.exchange_symbol == exchange_symbol:
-                    self.instrument_data = ins
+            self.instrument_data = instrument_cache.get(
+                self.client, exchange_id, exchange_symbol) or self.instrument_data
 
             if self.instrument_data is None:
                 self.logger.error(f'post init - Instrument_data not found for {exchange_symbol}') 
@@ -264,6 +280,7 @@ class SpreadLeg():
         
             self.update_market_data()
             self.update_convertion_rates()   
+            self.stream_convertion_rates()
             self.deduce_quantities()
 
             self.start_book_listener()
@@ -282,47 +299,52 @@ class SpreadLeg():
         except Exception as e:
             self.logger.error(f'Book listener startup failed - {e}')
 
-    def update_convertion_rates(self):
-        self.usd_usdt_convertion_rate = self.get_usd_conversion_rate()
-        self.base_usdt_convertion_rate = self.get_base_conversion_rates()
-        
-    def get_usd_conversion_rate(self):
-        rate = self.get_rate("USDC", "USDT")
-        if rate and rate > 0:
-            self.logger.info(f'USDC->USDT rate - {rate}')
-            return rate
+    def update_convertion_rates(self, block=True):
+        """
+        Refresh the conversion rates. With block unset the rates are only
+        read from the conversion rate cache, and a missing rate keeps the
+        previous one.
+        """
+        rate = self.get_usd_conversion_rate(block)
+        if block or (rate and rate > 0):
+            self.usd_usdt_convertion_rate = rate
+        rate = self.get_base_conversion_rates(block)
+        if block or (rate and rate > 0):
+            self.base_usdt_convertion_rate = rate
+
+    def stream_convertion_rates(self):
+        """ stream the books of the conversion pairs into the rate cache """
+        try:
+            if self.usd_usdt_convertion_needed:
+                conversion_rates.stream(self.client, self.exchange_name, 'USDC', 'USDT')
+            if self.instrument_data.quote_coin not in ['USDT', 'USD', 'USDC', 'BUSD']:
+                conversion_rates.stream(self.client, self.exchange_name, self.alt_coin, 'USDT')
+        except Exception as e:
+            self.logger.error(f'stream_convertion_rates - {e}')
 
-        rate = self.get_rate("USD", "USDT")
+    def get_usd_conversion_rate(self, block=True):
+        rate = self.get_rate("USDC", "USDT", block=block)
         if rate and rate > 0:
-            self.logger.info(f'USD->USDT rate - {rate}')
+            self.logger.debug(f'USDC->USDT rate - {rate}')
             return rate
-        
-        ob = self.client.get_orderbook(pair="USDUSDT")
-        if self.validate_orderbook(ob):
-            rate = 0.5 * (ob.bids[0].price + ob.asks[0].price)
-        
-        self.logger.info(f'USDUSDT mid rate - {rate}')
+
+        # the USDUSDT book first, then the price server
+        rate = self.get_rate("USD", "USDT", alt_client=self.client, block=block)
+        self.logger.debug(f'USD->USDT rate - {rate}')
         return rate
 
-    def get_base_conversion_rates(self, retry_attempts = 0):
+    def get_base_conversion_rates(self, block=True):
         try:
             rate = 0.0
             if self.instrument_data.quote_coin in ['USDT']:
                 rate = self.mid
-                self.logger.info(f'base_conversion USDT rate - {rate}')
+                self.logger.debug(f'base_conversion USDT rate - {rate}')
             elif self.usd_usdt_convertion_rate and self.instrument_data.quote_coin in ['USD', 'USDC', 'BUSD']:
                 rate = self.mid * self.usd_usdt_convertion_rate
-                self.logger.info(f'base_conversion USD/USDC/BUSD rate - {rate}')
+                self.logger.debug(f'base_conversion USD/USDC/BUSD rate - {rate}')
             else:
-                ob = self.client.get_orderbook(pair=self.alt_coin+"USDT")
-                if self.validate_orderbook(ob):
-                    rate = 0.5 * (ob.bids[0].price + ob.asks[0].price)
-                    self.logger.info(f'base_conversion mid rate - {rate}')
-            if not (rate and rate > 0):
-                if retry_attempts < 3:
-                    return self.get_base_conversion_rates(retry_attempts + 1)
-                rate = self.get_rate(self.alt_coin, 'USDT')
-                self.logger.info(f'base_conversion get_rate - {rate}')
+                rate = self.get_rate(self.alt_coin, 'USDT', alt_client=self.client, block=block)
+                self.logger.debug(f'base_conversion rate - {rate}')
             return rate
         except Exception as e:
             self.logger.error(f'{e}')
@@ -385,9 +407,9 @@ class SpreadLeg():
         if not(self.instrument_data and self.pair_leg.instrument_data):
             return
 
-        pair_notional = self.pair_leg.get_notional(self.pair_leg.qty)
+        pair_notional = self.pair_leg.get_notional(self.pair_leg.qty) * self.notional_ratio
         self.qty = self.get_qty_for_notional(pair_notional)
-        pair_slice_notional = self.pair_leg.get_notional(self.pair_leg.slice_size)
+        pair_slice_notional = self.pair_leg.get_notional(self.pair_leg.slice_size) * self.notional_ratio
         self.slice_size = self.get_qty_for_notional(pair_slice_notional)
         self.logger.debug(
             f'Deduced Quantities - '
@@ -396,17 +418,14 @@ class SpreadLeg():
             f'self.qty = {self.qty} '
             f'self.slice_size  = {self.slice_size }')
 
-    def get_rate(self, coin1, coin2, retry_attemps = 0):
+    def get_rate(self, coin1, coin2, alt_client=None, block=True):
         try:
-            if not self.pricer:
+            if not self.pricer and alt_client is None:
                 self.logger.info('pricer not available')
-                return 0
-
-            time.sleep(1)
-            rate = self.pricer.get_rate(coin1, coin2)
-            if rate is None and retry_attemps < 3:
-                return self.get_rate(coin1, coin2, retry_attemps + 1)
-            return rate
+            rate = conversion_rates.get_rate(
+                coin1, coin2, self.pricer, alt_client, block=block,
+                exchange=self.exchange_name)
+            return rate or 0
         except Exception as e:
             self.logger.error(f'get_rate - {e}')
             return 0
@@ -475,8 +494,10 @@ class SpreadLeg():
         return True
 
     def update_market_data(self):
-        ob = self.orderbook()
-        
+        self.apply_orderbook(self.orderbook())
+
+    def apply_orderbook(self, ob):
+        """ take the top of book of a fetched or streamed order book """
         if not self.validate_orderbook(ob):
             return
 
@@ -487,6 +508,7 @@ class SpreadLeg():
         self.update_min_qty(self.mid)
         self.tob_size = ob.bids[0].amount
         self.toa_size = ob.asks[0].amount    
+        self.book_ts = float(ob.timestamp)
 
         if self.tradable_bit_mask & TradableBitMask.PricerNotReady > 0:
             self.tradable_bit_mask &= ~TradableBitMask.PricerNotReady
@@ -575,29 +597,67 @@ class SpreadLeg():
 
     def check_dependancy(self):
         notional = self.get_traded_notional(self.side)
-        dep_notional = self.pair_leg.get_traded_notional(self.contra_side if self.auto_side else self.pair_leg.side)
         self.logger.debug(f'min_order_qty pair_leg.min_order_qty {self.min_order_qty} {self.pair_leg.min_order_qty}')
-        if self.primary_leg:
-            dep_min_notional = self.pair_leg.get_notional(self.pair_leg.min_order_qty)
+        # wait for the legs hedging this one to catch up
+        for hedge_leg in self.hedge_legs:
+            dep_notional = hedge_leg.get_traded_notional(self.contra_side if self.auto_side else hedge_leg.side)
+            dep_min_notional = hedge_leg.get_notional(hedge_leg.min_order_qty)
 
-            self.logger.debug(f'primary - notional={notional}, dep_notional={dep_notional}, dep_min_notional={dep_min_notional}')
-            if notional - dep_notional >= dep_min_notional - 1e-10:
+            self.logger.debug(f'hedged - notional={notional}, dep_notional={dep_notional}, dep_min_notional={dep_min_notional}, ratio={hedge_leg.notional_ratio}')
+            if notional * hedge_leg.notional_ratio - dep_notional >= dep_min_notional - 1e-10:
                 return False
-        else:
+
+        if not self.primary_leg:
+            dep_notional = self.pair_leg.get_traded_notional(self.contra_side if self.auto_side else self.pair_leg.side)
             min_notional = self.get_notional(self.min_order_qty)
 
-            self.logger.debug(f'pair - notional={notional}, dep_notional={dep_notional}, min_notional={min_notional}')
-            if dep_notional - notional < min_notional - 1e-10:
+            self.logger.debug(f'pair - notional={notional}, dep_notional={dep_notional}, min_notional={min_notional}, ratio={self.notional_ratio}')
+            if dep_notional * self.notional_ratio - notional < min_notional - 1e-10:
                 return False
 
         return True
 
+    @property
+    def market_data_skew(self):
+        """ seconds between the book timestamps of the two legs """
+        if self.book_ts is None or self.pair_leg.book_ts is None:
+            return math.inf
+        return fabs(self.book_ts - self.pair_leg.book_ts)
+
     def is_market_data_good(self):
         if self.tradable_bit_mask & TradableBitMask.PricerNotReady == 0 and \
                 self.tradable_bit_mask & TradableBitMask.MarketStatus == 0:
             return True
         return False
 
+    @property
+    def ref_price(self):
+        """ price the spread is measured on, making price first """
+        if self.side == BUY:
+            if self.aggressiveness >= Aggressiveness.SUPER_AGGR:
+                return self.toa
+            return self.tob
+        if self.aggressiveness >= Aggressiveness.SUPER_AGGR:
+            return self.tob
+        return self.toa
+
+    @property
+    def spread(self):
+        """ spread with the pair leg in the direction of this leg's side """
+        ref_price = self.ref_price
+        pair_ref_price = self.pair_leg.ref_price
+        return ref_price - pair_ref_price if self.side == SELL else pair_ref_price - ref_price
+
+    def record_spread(self):
+        """ add the current spread to the rolling history of the primary leg """
+        if not self.primary_leg:
+            return
+        if not (self.is_market_data_good() and self.pair_leg.is_market_data_good()):
+            return
+        if self.market_data_skew > self.max_leg_skew:
+            return
+        self.spread_history.append(self.spread)
+
     def check_spread_condition(self):
         start_flag = True
         suspend_flag = False
@@ -613,32 +673,21 @@ class SpreadLeg():
             self.logger.error('pair leg market data is not available')
             return not start_flag, not suspend_flag
 
-        if self.side == BUY:
-            # Use making price first
-            ref_price = self.tob
-            if self.aggressiveness >= Aggressiveness.SUPER_AGGR:
-                ref_price = self.toa
-        else:
-            ref_price = self.toa
-            if self.aggressiveness >= Aggressiveness.SUPER_AGGR:
-                ref_price = self.tob
-                
-        if self.pair_leg.side == BUY:
-                # Use making price first
-            pair_ref_price = self.pair_leg.tob
-            if self.pair_leg.aggressiveness >= Aggressiveness.SUPER_AGGR:
-                pair_ref_price = self.pair_leg.toa
-        else:
-            pair_ref_price = self.pair_leg.toa
-            if self.pair_leg.aggressiveness >= Aggressiveness.SUPER_AGGR:
-                pair_ref_price = self.pair_leg.tob
-        
-        abs_price_diff = fabs(pair_ref_price - ref_price)
-        price_diff = ref_price - pair_ref_price if self.side == SELL else pair_ref_price - ref_price
-        price_diff_rev = pair_ref_price - ref_price if self.side == SELL else ref_price - pair_ref_price
-        
+        # the spread is only meaningful on books taken at about the same time
+        skew = self.market_data_skew
+        if skew > self.max_leg_skew:
+            self.logger.info(f'leg books skewed by {skew}s, max_leg_skew={self.max_leg_skew}')
+            self.tradable_bit_mask |= TradableBitMask.MarketDataSkewed
+            return not start_flag, not suspend_flag
+        if self.tradable_bit_mask & TradableBitMask.MarketDataSkewed > 0:
+            self.tradable_bit_mask &= ~TradableBitMask.MarketDataSkewed
+
+        price_diff = self.spread
+        price_diff_rev = -price_diff
+        abs_price_diff = fabs(price_diff)
+        zscore = self.spread_history.zscore()
 
-        self.logger.debug(f'price diff = {price_diff}')
+        self.logger.debug(f'price diff = {price_diff}, zscore = {zscore}, samples = {len(self.spread_history)}')
         if self.start_condition != ConditionType.NO_CONDITION :
             if self.start_condition == ConditionType.SPREAD_BIGGER_THAN:
                 start_flag = (abs_price_diff > self.start_threshold)
@@ -648,6 +697,10 @@ class SpreadLeg():
                 start_flag = (price_diff > self.start_threshold)
             elif self.start_condition == ConditionType.SPREAD_SMALLER_THAN_WITH_DIRECTION:
                 start_flag = (price_diff_rev < self.start_threshold)
+            elif self.start_condition == ConditionType.SPREAD_ZSCORE_BIGGER_THAN:
+                start_flag = zscore is not None and zscore > self.start_threshold
+            elif self.start_condition == ConditionType.SPREAD_ZSCORE_SMALLER_THAN:
+                start_flag = zscore is not None and zscore < self.start_threshold
             
         if self.suspend_condition != ConditionType.NO_CONDITION:
             if self.suspend_condition == ConditionType.SPREAD_BIGGER_THAN:
@@ -658,6 +711,11 @@ class SpreadLeg():
                 suspend_flag = (price_diff > self.start_threshold)
             elif self.suspend_condition == ConditionType.SPREAD_SMALLER_THAN_WITH_DIRECTION:
                 suspend_flag = (price_diff_rev < self.start_threshold)
+            # suspended until the spread history has enough samples
+            elif self.suspend_condition == ConditionType.SPREAD_ZSCORE_BIGGER_THAN:
+                suspend_flag = zscore is None or zscore > self.suspend_threshold
+            elif self.suspend_condition == ConditionType.SPREAD_ZSCORE_SMALLER_THAN:
+                suspend_flag = zscore is None or zscore < self.suspend_threshold
                 
         return start_flag, suspend_flag 
 
@@ -707,7 +765,7 @@ class SpreadLeg():
         dep_notional = self.pair_leg.get_traded_notional(self.contra_side if self.auto_side else self.pair_leg.side)
 
         self.logger.debug(f'notional={notional}, dep_notional={dep_notional}')
-        delta = max(dep_notional - notional, 0.0)
+        delta = max(dep_notional * self.notional_ratio - notional, 0.0)
         return self.get_qty_for_notional(delta)
 
     @property
@@ -872,6 +930,7 @@ class SpreadLeg():
         return {
             "Account Id" : self.account_id,
             "Sort Key" : self.primary_leg,
+            "Leg" : self.name,
             "Details" : {
                 "Account" : self.name_of(self.account_id),
                 "Ticker" : self.pair,
@@ -931,7 +990,7 @@ class SpreadLeg():
             self.leg_status = LegStatus.ERROR
             self.logger.error(error)
 
-    def execute(self):
+    def execute(self, market_data_updated=False):
         self.last_error = None
 
         if self.remain_qty == 0.0 or self.remain_qty < self.min_order_qty:
@@ -955,14 +1014,23 @@ class SpreadLeg():
         else:
             self.continues_failed_order_count = 0
         
-        self.logger.debug(f'updating market data')
-        self.update_market_data()
-        self.pair_leg.update_market_data()
+        if not market_data_updated:
+            self.logger.debug(f'updating market data')
+            self.update_market_data()
+            self.pair_leg.update_market_data()
+
+        # rates come from the conversion rate cache without blocking, the
+        # quantities are deduced again at the rate update frequency
+        self.update_convertion_rates(block=False)
+        if time.time() - self.rate_qty_update_ts > RATE_UPDATE_FREQUENCY_SECONDS:
+            self.rate_qty_update_ts = time.time()
+            self.deduce_quantities()
 
         self.logger.debug(f'checking auto side')
         if not self.set_auto_side():
             self.last_error = ERR_LEG_UNABLE_TO_SET_AUTO_SIDE
             return
+        self.record_spread()
 
         order_pending = self.order_monitor.pending > 0.0
         self.logger.debug(f'Leg - {str(self)}')
@@ -1010,12 +1078,6 @@ class SpreadLeg():
         self.order_monitor.add(self.order_id)
         self.logger.debug(f'Added to order monitor order_id = {self.order_id}')
         self.leg_status = LegStatus.ORDER_SUBMITTED
-
-        #ABOTS-189: update convertion rate is disabled for  now. Needs to be reevaluated.
-        # if time.time() - self.rate_qty_update_ts > RATE_UPDATE_FREQUENCY_SECONDS:
-        #     self.rate_qty_update_ts = time.time()
-        #     self.update_convertion_rates()
-        #     self.deduce_quantities()
         
     
 class PairTradingBot(AbstractContextManager):
@@ -1046,12 +1108,20 @@ class PairTradingBot(AbstractContextManager):
         self.service_id = service_id
         self.pricer = pricer
         self.set_pricer()
+        self.stream_market_data = False
+        self.concurrent_legs = False
+        self.book_cache = MergedOrderBook()
+        self.stream_exit_flags = []
+        # one worker per leg of a basket, see executor_for_legs
+        self.executor = None
+        self.executor_workers = 0
+        self.order_monitor_hub = None
         self.config = config
         self.config_error = None
         self.last_error = None
         self.delay = 2
 
-    def get_position(self, is_primary):
+    def get_position(self, is_primary, name=None):
         try:
             position = self.client.get(f'{config.BOT_OUTPUT_REDIS_KEY}:{self.bot_id}:position')
 
@@ -1063,7 +1133,7 @@ class PairTradingBot(AbstractContextManager):
                 leg_positions = json.loads(leg_positions)
 
             for pos in leg_positions:
-                if pos['Sort Key'] == is_primary:
+                if pos['Sort Key'] == is_primary and (name is None or pos.get('Leg') == name):
                     return pos
         except Exception as e:
             self.logger.error(f'get_position - {e}')
@@ -1071,12 +1141,28 @@ class PairTradingBot(AbstractContextManager):
         
         return None
 
+    @staticmethod
+    def leg_config(leg):
+        return {
+            "instrument_type": leg.instrument_type,
+            "account_id": leg.account_id,
+            "base": leg.alt_coin,
+            "quote": leg.qoute_coin,
+            "side": str(leg.side).upper(),
+            "order_type": leg.order_type,
+            "distance_to_tob": leg.aggressiveness.name,
+            "tick_multiplier": leg.tick_multiplier
+        }
+
+    @property
+    def basket(self):
+        return 'pair' not in self.legs
+
     @property
     def config(self):
         primary_leg = self.legs['primary']
-        pair_leg = self.legs['pair']
-        
-        return {
+
+        bot_config = {
             "instrument_type": primary_leg.instrument_type,
             "quantity": primary_leg.qty,
             "slice_size": primary_leg.slice_size,
@@ -1085,29 +1171,38 @@ class PairTradingBot(AbstractContextManager):
             "distance_to_tob": primary_leg.aggressiveness.name,
             "tick_multiplier": primary_leg.tick_multiplier,
             'remark': primary_leg.remark,
-            "pair_leg": json.dumps({
-                "instrument_type": pair_leg.instrument_type,
-                "account_id": pair_leg.account_id,
-                "base": pair_leg.alt_coin,
-                "quote": pair_leg.qoute_coin,
-                "side": str(pair_leg.side).upper(),
-                "order_type": pair_leg.order_type,
-                "distance_to_tob": pair_leg.aggressiveness.name,
-                "tick_multiplier": pair_leg.tick_multiplier
-            }),
+            'stream_market_data': str(self.stream_market_data),
+            'concurrent_legs': str(self.concurrent_legs),
             "spread_params": json.dumps({
                 "start_if": primary_leg.start_condition.name,
                 "start_threshold": primary_leg.start_threshold,
                 "suspend_if": primary_leg.suspend_condition.name,
-                "suspend_threshold": primary_leg.suspend_threshold
+                "suspend_threshold": primary_leg.suspend_threshold,
+                "max_leg_skew": primary_leg.max_leg_skew,
+                "zscore_window": primary_leg.spread_history.size
             })
         }
+        if self.basket:
+            bot_config["basket_legs"] = json.dumps([
+                {
+                    **self.leg_config(leg),
+                    "name": name,
+                    "hedges": leg.pair_leg.name,
+                    "notional_ratio": leg.notional_ratio
+                }
+                for name, leg in self.legs.items() if name != 'primary'
+            ])
+        else:
+            bot_config["pair_leg"] = json.dumps(self.leg_config(self.legs['pair']))
+        return bot_config
 
     def set_pricer(self):
         if self.pricer:
             return
         try:
-            self.pricer = psa.PriceServerSession()
+            # the process wide pool, its sessions are shared with other bots
+            price_server.warm(1)
+            self.pricer = price_server
         except Exception as e:
             self.pricer = None
             self.logger.error(f'set_pricer - {e}')
@@ -1119,6 +1214,11 @@ class PairTradingBot(AbstractContextManager):
         self.config_error = None
 
         try:
+            basket_config = config.get('basket_legs')
+            basket_config = json.loads(basket_config.replace("\'", "\"")) if isinstance(basket_config, str) else basket_config
+            if basket_config and self.order_monitor_hub is None:
+                self.order_monitor_hub = OrderMonitorHub(self.logger)
+
             if 'primary' in self.legs:
                 primary = self.legs['primary']
                 primary.instrument_type = config.get('instrument_type', 'SPOT')
@@ -1135,50 +1235,121 @@ class PairTradingBot(AbstractContextManager):
                                         config.get('side'), config.get('order_type'), config.get('distance_to_tob'),
                                         float(config.get('tick_multiplier', "1")),
                                         None, True, self.logger, self.service_id, self.pricer,
-                                        alt_client = self.primary_client if self.primary_client else None, position=self.get_position(True))
+                                        alt_client = self.primary_client if self.primary_client else None, position=self.get_position(True),
+                                        order_monitor_hub=self.order_monitor_hub, name='primary')
                 self.legs['primary'] = primary
             
             primary.post_init()
-            
-            pair_config = config.get('pair_leg')
-            pair_config = json.loads(pair_config.replace("\'", "\"")) if isinstance(pair_config, str) else pair_config
-            #pair leg
-            if 'pair' in self.legs:
-                pair = self.legs['pair']
-                pair.instrument_type = config.get('instrument_type', 'SPOT')
-                pair.order_type = pair_config.get('order_type')
-                pair.tick_multiplier = float(pair_config.get('tick_multiplier', "1"))
-                pair.aggressiveness = Aggressiveness[pair_config.get('distance_to_tob')]
+
+            if basket_config:
+                self.configure_basket(basket_config)
             else:
-                pair = config.get('pair_leg')
-                pair = SpreadLeg(pair_config.get('base') or '', pair_config.get('quote') or '', pair_config.get('account_id') or '',
-                                        pair_config.get('instrument_type', 'SPOT'), 0.0, 0.0,
-                                        pair_config.get('side'), pair_config.get('order_type'), pair_config.get('distance_to_tob'),
-                                        float(pair_config.get('tick_multiplier', "1")),
-                                        primary, False, self.logger, self.service_id, self.pricer,
-                                        alt_client = self.pair_client if self.pair_client else None, position=self.get_position(False))
-                primary.pair_leg = pair
-                self.legs['pair'] = pair
-
-            pair.post_init()
-
-            # update remark
-            primary.update_remark(config.get('remark', ''))
-            pair.update_remark(config.get('remark', ''))
+                self.configure_pair_leg(config, primary)
 
             #spread parameters
             spread_params = config.get('spread_params')
             spread_params = json.loads(spread_params.replace("\'", "\"")) if isinstance(spread_params, str) else spread_params
             for _, leg in self.legs.items():
+                leg.update_remark(config.get('remark', ''))
                 leg.start_condition = ConditionType[spread_params.get('start_if')]
                 leg.start_threshold = float(spread_params.get('start_threshold'))
                 leg.suspend_condition = ConditionType[spread_params.get('suspend_if')]
                 leg.suspend_threshold = float(spread_params.get('suspend_threshold'))
+                leg.max_leg_skew = float(spread_params.get('max_leg_skew', leg.max_leg_skew))
+                zscore_window = int(spread_params.get('zscore_window', leg.spread_history.size))
+                if zscore_window != leg.spread_history.size:
+                    leg.spread_history = SpreadHistory(zscore_window, leg.spread_history.min_count)
+
+            self.stream_market_data = str(config.get('stream_market_data', 'False')).lower() == 'true'
+            self.concurrent_legs = str(config.get('concurrent_legs', 'False')).lower() == 'true'
         except Exception as e:
             self.config_error = e
             self.logger.error('error when setting config')
             self.logger.error(traceback.format_exc())
 
+    def remove_leg(self, name):
+        """ stop a leg dropped from the config, and detach it from its hedged leg """
+        leg = self.legs.pop(name)
+        self.logger.info(f'removing {name} leg')
+        for other in self.legs.values():
+            if leg in other.hedge_legs:
+                other.hedge_legs.remove(leg)
+            if other.pair_leg is leg:
+                other.pair_leg = other.hedge_legs[0] if other.hedge_legs else None
+        if self.order_monitor_hub is not None:
+            self.order_monitor_hub.unregister(leg.order_monitor)
+        leg.on_process_exit()
+        # resubscribed for the remaining legs on the next run
+        for exit_flag in self.stream_exit_flags:
+            exit_flag.set()
+        self.stream_exit_flags = []
+
+    def configure_pair_leg(self, config, primary):
+        for name in [name for name in self.legs if name not in ('primary', 'pair')]:
+            self.remove_leg(name)
+        pair_config = config.get('pair_leg')
+        pair_config = json.loads(pair_config.replace("\'", "\"")) if isinstance(pair_config, str) else pair_config
+        #pair leg
+        if 'pair' in self.legs:
+            pair = self.legs['pair']
+            pair.instrument_type = config.get('instrument_type', 'SPOT')
+            pair.order_type = pair_config.get('order_type')
+            pair.tick_multiplier = float(pair_config.get('tick_multiplier', "1"))
+            pair.aggressiveness = Aggressiveness[pair_config.get('distance_to_tob')]
+        else:
+            pair = config.get('pair_leg')
+            pair = SpreadLeg(pair_config.get('base') or '', pair_config.get('quote') or '', pair_config.get('account_id') or '',
+                                    pair_config.get('instrument_type', 'SPOT'), 0.0, 0.0,
+                                    pair_config.get('side'), pair_config.get('order_type'), pair_config.get('distance_to_tob'),
+                                    float(pair_config.get('tick_multiplier', "1")),
+                                    primary, False, self.logger, self.service_id, self.pricer,
+                                    alt_client = self.pair_client if self.pair_client else None, position=self.get_position(False),
+                                    name='pair')
+            primary.pair_leg = pair
+            primary.hedge_legs = [pair]
+            self.legs['pair'] = pair
+
+        pair.post_init()
+
+    def configure_basket(self, basket_config):
+        """
+        Basket mode, legs hedging the primary leg or another leg listed
+        before them, each at notional_ratio of the notional of the leg it
+        hedges. The primary leg's spread conditions use its first hedge.
+        """
+        names = [
+            leg_config.get('name') or f'hedge_{i + 1}'
+            for i, leg_config in enumerate(basket_config)]
+        for name in [name for name in self.legs if name != 'primary' and name not in names]:
+            self.remove_leg(name)
+        for name, leg_config in zip(names, basket_config):
+            hedged = self.legs[leg_config.get('hedges') or 'primary']
+            if name in self.legs and self.legs[name].pair_leg is not hedged:
+                # now hedging another leg, rebuilt
+                self.remove_leg(name)
+            if name in self.legs:
+                leg = self.legs[name]
+                leg.instrument_type = leg_config.get('instrument_type', 'SPOT')
+                leg.order_type = leg_config.get('order_type')
+                leg.tick_multiplier = float(leg_config.get('tick_multiplier', "1"))
+                leg.aggressiveness = Aggressiveness[leg_config.get('distance_to_tob')]
+                leg.notional_ratio = float(leg_config.get('notional_ratio', 1))
+            else:
+                leg = SpreadLeg(leg_config.get('base') or '', leg_config.get('quote') or '', leg_config.get('account_id') or '',
+                                        leg_config.get('instrument_type', 'SPOT'), 0.0, 0.0,
+                                        leg_config.get('side'), leg_config.get('order_type'), leg_config.get('distance_to_tob'),
+                                        float(leg_config.get('tick_multiplier', "1")),
+                                        hedged, False, self.logger, self.service_id, self.pricer,
+                                        position=self.get_position(False, name),
+                                        notional_ratio=float(leg_config.get('notional_ratio', 1)),
+                                        order_monitor_hub=self.order_monitor_hub, name=name)
+                hedged.hedge_legs.append(leg)
+                if hedged.pair_leg is None:
+                    hedged.pair_leg = leg
+                self.legs[name] = leg
+
+            leg.post_init()
+
     def validate_config_parameters(self):
         try:
             valid = True
@@ -1189,6 +1360,76 @@ class PairTradingBot(AbstractContextManager):
             self.logger.error(traceback.format_exc())
             return False
 
+    def subscribe_order_books(self):
+        """ stream the L2 book of every leg into the book cache """
+        def subscribe_order_book(name, leg):
+            def cache_order_book(*args):
+                ob = UDSOrderBook(args, source=leg.account_id)
+                if ob.status != 1:
+                    return
+                self.book_cache.update(name, ob)
+
+            self.logger.debug(f'subscribing to order book of {leg.exchange_name} {leg.pair}')
+            return leg.client.subscribe_streams(
+                [[leg.exchange_name, leg.pair, Streams.l2_detailed, cache_order_book]]
+            )
+
+        return [subscribe_order_book(name, leg) for name, leg in self.legs.items()]
+
+    def executor_for_legs(self):
+        """
+        The executor of the leg stages, replaced by a larger one when legs
+        are added, with up to PAIR_TRADING_MAX_WORKERS workers
+        """
+        workers = max(min(len(self.legs), config.PAIR_TRADING_MAX_WORKERS), 1)
+        if self.executor is None or self.executor_workers < workers:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+            self.executor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix='PairTradingBot')
+            self.executor_workers = workers
+        return self.executor
+
+    @staticmethod
+    def cached_book_usable(ob):
+        """ streamed book valid and fresh enough to save the rpc """
+        return (
+            getattr(ob, 'status', 1) == 1
+            and bool(ob.timestamp)
+            and time.time() - float(ob.timestamp)
+            <= config.BROKER_ORDERBOOK_REFRESH_MAX_TIME
+        )
+
+    def update_market_data(self):
+        """
+        Market data stage of a run, one book per leg shared by both legs.
+        Streamed books are used when valid and fresh, the other legs are
+        fetched concurrently so the books are taken as close together as
+        possible.
+        """
+        if self.stream_market_data and not self.stream_exit_flags:
+            self.stream_exit_flags = self.subscribe_order_books()
+        books = {
+            name: ob for name, ob in self.book_cache.books.items()
+            if name in self.legs and self.cached_book_usable(ob)
+        } if self.stream_market_data else {}
+        executor = self.executor_for_legs()
+        futures = {
+            name: executor.submit(leg.orderbook)
+            for name, leg in self.legs.items() if name not in books
+        }
+        for name, future in futures.items():
+            try:
+                books[name] = future.result()
+            except Exception as e:
+                self.logger.error(f'update_market_data - {name} - {e}')
+        for name, ob in books.items():
+            self.legs[name].apply_orderbook(ob)
+
+        primary = self.legs.get('primary')
+        if primary is not None and primary.pair_leg is not None:
+            self.logger.debug(f'leg market data skew = {primary.market_data_skew}')
+
     def get_bot_status(self, bot_completed):
         if self.last_error:
             return self.last_error
@@ -1208,6 +1449,7 @@ class PairTradingBot(AbstractContextManager):
         pos = {
             "Status" : self.get_bot_status(bot_completed),
             "Overall Progress" : {},
+            "Price Server" : json.dumps(price_server.metrics),
             "Account Operations" : json.dumps(account_positions)
         }
         self.logger.debug(pos)
@@ -1229,10 +1471,34 @@ class PairTradingBot(AbstractContextManager):
             time.sleep(self.delay)
             return
 
+        self.update_market_data()
+
+        if self.concurrent_legs:
+            self.execute_legs_concurrently()
+            return
+
         for name, leg in self.legs.items():
             self.logger.debug(f"running for {name} ")
             self.logger.debug('-----------------------')
-            leg.execute()
+            leg.execute(market_data_updated=True)
+
+    def execute_legs_concurrently(self):
+        """
+        Run the leg cycles at the same time on the market data snapshot of
+        the run, so the hedge leg does not wait for the primary leg's
+        balance check, send and order monitor update
+        """
+        executor = self.executor_for_legs()
+        futures = {
+            name: executor.submit(leg.execute, market_data_updated=True)
+            for name, leg in self.legs.items()
+        }
+        for name, future in futures.items():
+            try:
+                future.result()
+            except Exception:
+                self.logger.error(f'{name} leg execution failed')
+                self.logger.error(traceback.format_exc())
         
     def __enter__(self):
         # self.order_monitor.start()
@@ -1241,6 +1507,12 @@ class PairTradingBot(AbstractContextManager):
     def __exit__(
         self, exc_type, exc_value, traceback,
     ):
+        for exit_flag in self.stream_exit_flags:
+            exit_flag.set()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+        if self.order_monitor_hub is not None:
+            self.order_monitor_hub.stop()
         for name, leg in self.legs.items():
             self.logger.info(f'{name} leg cleanup on bot exit')
             leg.on_process_exit()
@@ -15,11 +15,15 @@ from contextlib import AbstractContextManager
 import traceback
 
 from altonomy.core import client
+from altonomy.core import Streams
 from altonomy.core.Side import Side
 
 from . import config
 
+from .MarketHistory import market_history
 from .TWAPBot import TWAPBot, BotStatus
+from .VolumeProfile import VolumeProfile
+from .VolumeTracker import VolumeTracker
 
 BOT_ACTION_START = "START"
 BOT_ACTION_PAUSE = "PAUSE"
@@ -38,6 +42,9 @@ ERR_INVALID_DURATION = 'Invalid Duration ({})'
 
 ERR_NO_PRICE_QTY = 'Cannot decide Price/Qty'
 
+VOLUME_SOURCE_KLINE = 'KLINE'
+VOLUME_SOURCE_TRADES = 'TRADES'
+
 
 class ParticipationBot(AbstractContextManager):
     def __init__(
@@ -52,8 +59,26 @@ class ParticipationBot(AbstractContextManager):
         alt_client=None,
         logger=None,
         alt_twap_bot=None,
+        clock=None,
+        alt_ref_client=None,
+        alt_helm_client=None,
+        alt_instrument_cache=None,
+        alt_market_history=None,
+        alt_random=None,
     ):
+        """
+        :clock time module stand-in, with time() and sleep()
+        :alt_ref_client, alt_helm_client, alt_instrument_cache
+            passed on to the TWAPBot
+        :alt_random random module stand-in, e.g. a seeded random.Random
+        """
         self.logger = logger or logging.getLogger()
+        self.clock = clock or time
+        self.ref_client = alt_ref_client
+        self.helm_client = alt_helm_client
+        self.instrument_cache = alt_instrument_cache
+        self.market_history = alt_market_history or market_history
+        self.random = alt_random or random
         self.account_id = account_id
         self.bot_id = bot_id
         self.service_id = service_id
@@ -75,11 +100,19 @@ class ParticipationBot(AbstractContextManager):
         self.max_slice_size_multiplier = 5
         self.percentage_of_volume = 7.0
         self.kline_data_duration_sec = 60  # Kline data duration of 1minute
+        self.volume_source = VOLUME_SOURCE_KLINE
+        self.trades_window_sec = 10  # pov window sized from live trades
+        self.volume_tracker = None
+        self.trades_stream = None
+        self.use_volume_profile = False
+        self.volume_profile = None
         self.default_post_frequency = 5  # twap will send orders for every 5sec
         self.order_size_rand_range = 0.05
         self.remark = ''
         self.target_quantity = 0.0
         self.target_duration = 0
+        self.window_start_ts = 0
+        self.applied_twap_config = None
         self.trigger_condition = ' '
         self.stop_condition = ' '
         self.dealt_qty = 0.0
@@ -91,9 +124,9 @@ class ParticipationBot(AbstractContextManager):
         self.config_error = None
         self.last_error = None
         self.bot_status = BotStatus.WAITING
-        self.start_time = time.time()
+        self.start_time = self.clock.time()
         self.bot_progress_duration = 0
-        self.update_redis_ts = time.time()
+        self.update_redis_ts = self.clock.time()
 
         self.config = config_param
 
@@ -122,7 +155,11 @@ class ParticipationBot(AbstractContextManager):
                 self.twap_config,
                 alt_client=self.client,
                 logger=self.logger,
-                service_id=self.service_id)
+                service_id=self.service_id,
+                clock=self.clock,
+                alt_ref_client=self.ref_client,
+                alt_helm_client=self.helm_client,
+                alt_instrument_cache=self.instrument_cache)
 
         self.instrument_data = self.twap_bot.instrument_data
         self.om = self.twap_bot.order_monitor
@@ -169,17 +206,54 @@ class ParticipationBot(AbstractContextManager):
             self.logger.error(f'get_account_position - {e}')
 
     def get_market_history(self):
+        return self.query_market_history(
+            self.pair, self.kline_data_duration_sec, 10)
+
+    def query_market_history(self, pair, duration, count):
         try:
-            with self.client.zerorpc() as zrpc:
-                self.logger.debug(f'zrpc = {zrpc}')
-                history = zrpc.get_market_history(
-                    self.pair, self.kline_data_duration_sec, 10)
-                self.logger.debug(f'history={history}')
-                return history
+            history = self.market_history.get_market_history(
+                self.client, (self.exchange_name, self.account_id),
+                pair, duration, count)
+            self.logger.debug(f'history={history}')
+            return history
         except Exception as e:
             self.logger.error(f'Error in get_market_history - {e}')
             return None
 
+    def refresh_volume_profile(self):
+        """ volume profile of the pair if enabled and available """
+        if not self.use_volume_profile:
+            return None
+        if self.volume_profile is None:
+            self.volume_profile = VolumeProfile(self.pair, logger=self.logger)
+        if self.volume_profile.refresh(self.query_market_history):
+            return self.volume_profile
+        return None
+
+    def forecast_volume(self, trd_vol, ref_start, ref_end, duration):
+        """ Volume expected over the next duration seconds, given trd_vol
+            traded in [ref_start, ref_end]. Pro rated by time, or by the
+            intraday volume profile when it is enabled
+        """
+        now = self.clock.time()
+        profile = self.refresh_volume_profile()
+        factor = profile.seasonal_factor(
+            ref_start, ref_end, now, now + duration) if profile else None
+        if factor is None:
+            return trd_vol * duration / (ref_end - ref_start)
+        self.logger.info(f'volume profile factor = {factor}')
+        return trd_vol * factor
+
+    def schedule_twap_slices(self):
+        """ weight the TWAP slices by the volume profile of the window """
+        profile = self.refresh_volume_profile()
+        if not profile:
+            return
+        posts = self.twap_bot.total_no_of_posts \
+            - self.twap_bot.posts_completed + 1
+        self.twap_bot.set_slice_weights(profile.weights(
+            self.clock.time(), posts * self.twap_bot.post_frequency, posts))
+
     def update_market_history_data(self):
         try:
             self.kline_data = []
@@ -195,13 +269,78 @@ class ParticipationBot(AbstractContextManager):
             self.logger.error(f'Error in update_market_history_data - {e}')
             return False
 
+    @property
+    def use_trades_volume(self):
+        """ size the window from live trades, klines if the stream is stale """
+        return self.volume_source == VOLUME_SOURCE_TRADES \
+            and self.volume_tracker is not None \
+            and self.volume_tracker.is_live(self.kline_data_duration_sec)
+
+    def subscribe_trades(self):
+        if self.volume_source != VOLUME_SOURCE_TRADES or self.trades_stream:
+            return
+        try:
+            self.volume_tracker = VolumeTracker(
+                window_sec=max(
+                    self.kline_data_duration_sec, self.trades_window_sec),
+                logger=self.logger)
+            self.trades_stream = self.client.subscribe_streams(
+                [
+                    [
+                        self.exchange_name,
+                        self.pair,
+                        Streams.trades,
+                        self.volume_tracker.on_trades,
+                    ]
+                ]
+            )
+            self.logger.info(
+                f'Subscribed to trades of {self.exchange_name} {self.pair}')
+        except Exception as e:
+            self.trades_stream = None
+            self.logger.error(
+                f'Error in subscribe_trades, using kline data - {e}')
+
+    def unsubscribe_trades(self):
+        if self.trades_stream:
+            self.trades_stream.set()
+            self.trades_stream = None
+
+    def compute_target_qty_duration_from_trades(self):
+        """ pov of the volume traded over the last trades window """
+        try:
+            self.target_quantity = 0.0
+            self.target_duration = 0.0
+
+            total_trd_vol = self.volume_tracker.volume(self.trades_window_sec)
+            self.logger.info(
+                f'traded volume in last {self.trades_window_sec}s '
+                f'= {total_trd_vol}')
+            now = self.clock.time()
+            total_trd_vol = self.forecast_volume(
+                total_trd_vol, now - self.trades_window_sec, now,
+                self.trades_window_sec)
+            if total_trd_vol > 0.0:
+                total_trd_vol = \
+                    total_trd_vol * self.percentage_of_volume / 100
+                self.logger.info(f'pov of total_trd_vol = {total_trd_vol}')
+
+                self.target_quantity = self.apply_randomization(total_trd_vol)
+                self.target_duration = self.trades_window_sec
+                self.logger.info(
+                    f'Target Quantity = {self.target_quantity} '
+                    f'Target Duration = {self.target_duration} ')
+        except Exception as e:
+            self.logger.error(
+                f'Error in compute_target_qty_duration_from_trades - {e}')
+
     def compute_target_qty_duration(self):
         try:
             self.target_quantity = 0.0
             self.target_duration = 0.0
 
             time_open = self.kline_data[0]['time_open']
-            current_time = int(time.time())
+            current_time = int(self.clock.time())
             time_difference = current_time - time_open
             self.logger.debug(
                 f'current time - {current_time} '
@@ -210,6 +349,7 @@ class ParticipationBot(AbstractContextManager):
             if time_difference < self.kline_data_duration_sec:
                 # kline data for current min in progress
                 total_trd_vol = self.kline_data[1]['amount']
+                candle_open = time_open - self.kline_data_duration_sec
                 execution_time_window = \
                     self.kline_data_duration_sec - time_difference
             elif time_difference >= 2 * self.kline_data_duration_sec:
@@ -220,6 +360,7 @@ class ParticipationBot(AbstractContextManager):
             else:
                 # kline data for last min
                 total_trd_vol = self.kline_data[0]['amount']
+                candle_open = time_open
                 execution_time_window = \
                     self.kline_data_duration_sec * 2 - time_difference
 
@@ -227,8 +368,10 @@ class ParticipationBot(AbstractContextManager):
             self.logger.debug(f'execution_time_window={execution_time_window}')
 
             # Pro rate the total traded volume based on execution_time_window
-            total_trd_vol = total_trd_vol * execution_time_window \
-                / self.kline_data_duration_sec
+            total_trd_vol = self.forecast_volume(
+                total_trd_vol, candle_open,
+                candle_open + self.kline_data_duration_sec,
+                execution_time_window)
             self.logger.info(f'pro rated total_trd_vol = {total_trd_vol}')
 
             # Get pov(defaulted to 7%) of the historic kline data
@@ -249,7 +392,7 @@ class ParticipationBot(AbstractContextManager):
 
     def apply_randomization(self, quantity):
         self.logger.debug(f'quantity = {quantity}')
-        orderquantity = quantity * random.uniform(
+        orderquantity = quantity * self.random.uniform(
             1.0-self.order_size_rand_range, 1.0+self.order_size_rand_range)
 
         if orderquantity:
@@ -269,7 +412,7 @@ class ParticipationBot(AbstractContextManager):
 
     @property
     def remain_qty(self):
-        return self.total_quantity - self.dealt_qty
+        return self.total_quantity - self.total_dealt
 
     @property
     def total_dealt(self):
@@ -308,13 +451,13 @@ class ParticipationBot(AbstractContextManager):
     def update_action(self, value):
         if value == BOT_ACTION_PAUSE:
             # pause updating the bot duration
-            current_time_spent = time.time() - self.start_time
+            current_time_spent = self.clock.time() - self.start_time
             self.bot_progress_duration += current_time_spent
             self.logger.debug(f'update_action - {self.bot_progress_duration}')
             self.start_time = 0
         else:
             # resume the bot duration calculation
-            self.start_time = time.time()
+            self.start_time = self.clock.time()
         self._action = value
 
     @property
@@ -326,6 +469,9 @@ class ParticipationBot(AbstractContextManager):
             'threshold_price': self.threshold_price,
             'percentage_of_volume': self.percentage_of_volume,
             'kline_data_duration': int(self.kline_data_duration_sec / 60),
+            'volume_source': self.volume_source,
+            'trades_window': self.trades_window_sec,
+            'volume_profile': self.use_volume_profile,
             'default_post_frequency': self.default_post_frequency,
             'remark': self.remark,
             'max_slice_size_multiplier': self.max_slice_size_multiplier,
@@ -345,6 +491,17 @@ class ParticipationBot(AbstractContextManager):
                 config.get('percentage_of_volume', '7.0'))
             self.kline_data_duration_sec = int(float(
                 config.get('kline_data_duration', '1')) * 60)
+            self.volume_source = config.get(
+                'volume_source', VOLUME_SOURCE_KLINE).upper()
+            if self.volume_source not in (
+                    VOLUME_SOURCE_KLINE, VOLUME_SOURCE_TRADES):
+                raise ValueError(
+                    f'volume_source {self.volume_source} must be '
+                    f'{VOLUME_SOURCE_KLINE} or {VOLUME_SOURCE_TRADES}')
+            self.trades_window_sec = int(float(
+                config.get('trades_window', '10')))
+            self.use_volume_profile = str(
+                config.get('volume_profile', 'false')).lower() == 'true'
             self.default_post_frequency = int(float(
                 config.get('default_post_frequency', '5')))
             self.threshold_price = float(config.get('threshold_price', '-1'))
@@ -379,12 +536,12 @@ class ParticipationBot(AbstractContextManager):
 
     def push_bot_data_to_redis(self):
         """ push Participation trading bot data to redis """
-        if time.time() < (
+        if self.clock.time() < (
                 self.update_redis_ts
                 + config.UPDATE_REDIS_FREQUENCY):
             return
 
-        self.update_redis_ts = time.time()
+        self.update_redis_ts = self.clock.time()
         _position = self.position
         if _position:
             self.client.post(
@@ -470,27 +627,53 @@ class ParticipationBot(AbstractContextManager):
         self.logger.debug(pos)
         return pos
 
-    def clear_order_monitor(self):
-        self.om.completed_orders = {}
-        if self.om.open_orders:
-            self.logger.error(
-                f'Clearing open orders - {self.om.open_orders}')
-        self.om.open_orders = {}
-        if self.om.failed_orders:
-            self.logger.info(
-                f'Clearing failed orders - {self.om.failed_orders}')
-        self.om.failed_orders = {}
+    def fold_settled_orders(self):
+        """
+        Move the settled orders of the last windows from the order monitor
+        into dealt_qty / deal_price, so the monitor only holds what is still
+        working. The TWAP bot's last orders are kept for its unfilled check.
+        """
+        keep = set(self.twap_bot.child_orders or ())
+        if self.twap_bot.order_id:
+            keep.add(self.twap_bot.order_id)
+        settled = self.om.pop_settled_orders(keep)
+        orders = [order for order in settled.values() if order is not None]
+        dealt = sum(order.dealt for order in orders)
+        if dealt <= 0:
+            return
+        notional = sum(order.dealt * order.price for order in orders)
+        if self.deal_price and self.dealt_qty:
+            self.deal_price = (
+                self.deal_price * self.dealt_qty + notional) / (
+                self.dealt_qty + dealt)
+        else:
+            self.deal_price = notional / dealt
+        self.dealt_qty += dealt
+        self.logger.info(
+            f'Folded {len(settled)} settled orders, dealt {dealt} - '
+            f'dealt_qty = {self.dealt_qty} deal_price = {self.deal_price}')
+
+    def apply_twap_config(self):
+        """ re-apply the twap config only when a setting changed """
+        twap_config = {
+            k: v for k, v in self.twap_config.items()
+            if k not in ('quantity', 'duration')}
+        if twap_config == self.applied_twap_config:
+            return
+        self.logger.info(f'Applying twap config - {self.twap_config}')
+        self.twap_bot.config = self.twap_config
+        self.applied_twap_config = twap_config
 
     def run(self):
         if self.bot_status == BotStatus.STRATEGY_COMPLETED:
             self.logger.info('POV Bot strategy is completed !!!')
-            time.sleep(5)
+            self.clock.sleep(5)
             return
 
         if self.config_error:
             self.last_error = ERR_INVALID_CONFIG_FORMAT
             self.logger.error(f'Error when setting config - {self.config}')
-            time.sleep(5)
+            self.clock.sleep(5)
             return
 
         if not self.twap_bot.validate_config_parameters():
@@ -498,7 +681,7 @@ class ParticipationBot(AbstractContextManager):
             self.last_error = self.twap_bot.last_error
             self.logger.error(
                 f'Invalid config parametes !!! - {self.twap_config}')
-            time.sleep(5)
+            self.clock.sleep(5)
             return
 
         self.logger.debug(
@@ -510,20 +693,18 @@ class ParticipationBot(AbstractContextManager):
             f'self.twap_bot.bot_status - {self.twap_bot.bot_status}')
         if ((self.twap_bot.bot_status == BotStatus.STRATEGY_COMPLETED)
                 or
-                (self.twap_bot.start_time
-                    + self.target_duration < time.time())):
-            self.twap_bot.cancel_pending_order()
+                (self.window_start_ts
+                    + self.target_duration < self.clock.time())):
+            # open orders of the last window keep working and count
+            # towards the next one, settled orders leave the order monitor
+            self.fold_settled_orders()
             self.logger.info(
                 f'TWAP dealt - {self.om.dealt}'
                 f'TWAP quantity - {self.twap_config.get("quantity")}'
-                f'POV Total dealt - {self.dealt_qty}')
-            self.dealt_qty += self.om.dealt
-            self.deal_price = self.average_price
-
-            self.clear_order_monitor()
+                f'POV Total dealt - {self.total_dealt}')
 
             self.logger.info(
-                f'Current POV Total dealt - {self.dealt_qty} '
+                f'Current POV Total dealt - {self.total_dealt} '
                 f'Current POV Remaining Qty - {self.remain_qty} ')
             if self.remain_qty == 0.0 or \
                     self.remain_qty < self.twap_bot.min_order_qty:
@@ -531,18 +712,22 @@ class ParticipationBot(AbstractContextManager):
                 self.logger.info(f'Not much qty remaining - {self.remain_qty}')
                 return
 
-            if not self.update_market_history_data():
-                self.bot_status = BotStatus.ERROR
-                self.last_error = "Error in Market History (kline) Data"
-                self.logger.error(
-                    f'Invalid KLine data  - {self.kline_data}')
-                time.sleep(1)
-                return
-
-            self.compute_target_qty_duration()
+            self.subscribe_trades()
+            if self.use_trades_volume:
+                self.compute_target_qty_duration_from_trades()
+            else:
+                if not self.update_market_history_data():
+                    self.bot_status = BotStatus.ERROR
+                    self.last_error = "Error in Market History (kline) Data"
+                    self.logger.error(
+                        f'Invalid KLine data  - {self.kline_data}')
+                    self.clock.sleep(1)
+                    return
+
+                self.compute_target_qty_duration()
             if not self.target_quantity or not self.target_duration:
                 self.logger.warning('Target qty / duration not computed')
-                time.sleep(1)
+                self.clock.sleep(1)
                 return
 
             # Start TWAP startegy with new Qty
@@ -555,34 +740,36 @@ class ParticipationBot(AbstractContextManager):
                     self.target_duration, self.default_post_frequency)
             self.twap_config['quantity'] = self.target_quantity
             self.twap_config['duration'] = self.target_duration
-            self.twap_bot.reset_twap_strategy()
             self.logger.info(
-                f'Restarting twap startegy '
-                f' @ {int(time.time())}'
+                f'Retargeting twap startegy '
+                f' @ {int(self.clock.time())}'
                 f' for qty - {self.twap_config.get("quantity")}'
                 f' duration - {self.twap_config.get("duration")}')
-            self.twap_bot.config = self.twap_config
-            self.twap_bot.calculate_strategy_params(
+            self.apply_twap_config()
+            self.twap_bot.retarget(
                 self.twap_config.get('quantity'),
                 self.twap_config.get('duration'))
-            self.twap_bot.bot_status = BotStatus.WAITING
+            self.window_start_ts = self.clock.time()
+            self.schedule_twap_slices()
             self.last_error = None
 
         self.bot_status = self.twap_bot.bot_status
         self.twap_bot.run()
         self.last_error = self.twap_bot.reason
-        time.sleep(1)
+        self.clock.sleep(1)
 
     def __enter__(self):
         self.logger.debug('Participation bot entring!!')
         if self.om:
             self.om.start()
+        self.subscribe_trades()
         return self
 
     def __exit__(
         self, exc_type, exc_value, traceback,
     ):
         self.logger.debug('Participation bot exiting!!')
+        self.unsubscribe_trades()
         self.om.cancel_all_open_orders()
         self.om.stop()
         self.client.deregister_resource_usage(
@@ -0,0 +1,160 @@
+###############################################################################
+# Description: Process wide pooled price server client
+###############################################################################
+
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+import cachetools
+
+import altonomy.price_server_api.api as psa
+
+from . import config
+
+
+class PriceServerPool():
+    """
+    Price server sessions shared by the bots of the process. Up to size
+    sessions are kept open and handed out per request; a request waits up to
+    timeout seconds for a session to be given back, or dropped so it can
+    open a new one. Responses are cached for ttl seconds, and concurrent
+    identical requests wait on the one call in flight instead of each
+    calling the price server.
+    """
+
+    def __init__(
+        self,
+        size=config.PRICE_SERVER_POOL_SIZE,
+        ttl=config.PRICE_SERVER_CACHE_TTL,
+        session_factory=None,
+        timeout=10,
+        logger=None,
+    ):
+        self.logger = logger or logging.getLogger()
+        self.size = size
+        self.session_factory = session_factory or psa.PriceServerSession
+        self.timeout = timeout
+        # idle sessions, last released first, and sessions open or opening
+        self.idle = []
+        self.opened = 0
+        self.sessions_changed = threading.Condition(threading.Lock())
+        self.cache = cachetools.TTLCache(maxsize=1024, ttl=ttl)
+        self.in_flight = {}
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def warm(self, count=None):
+        """ open sessions ahead of the first requests """
+        for _ in range(min(count or self.size, self.size)):
+            with self.sessions_changed:
+                if self.opened >= self.size:
+                    return
+                self.opened += 1
+            self.release(self.open_session())
+
+    def open_session(self):
+        """ a new session, counted in opened by the caller """
+        try:
+            return self.session_factory()
+        except Exception:
+            with self.sessions_changed:
+                self.opened -= 1
+                self.sessions_changed.notify()
+            raise
+
+    def acquire(self, timeout=None):
+        """ an idle session, a new one while below size, else wait for one """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self.sessions_changed:
+            while not self.idle and self.opened >= self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(
+                        f'PriceServerPool no session within {timeout}s')
+                self.sessions_changed.wait(remaining)
+            if self.idle:
+                return self.idle.pop()
+            self.opened += 1
+        return self.open_session()
+
+    def release(self, session, healthy=True):
+        with self.sessions_changed:
+            if healthy:
+                self.idle.append(session)
+            else:
+                # dropped after an error, a waiter can open a new session
+                self.opened -= 1
+            self.sessions_changed.notify()
+        if healthy:
+            return
+        try:
+            getattr(session, 'close', lambda: None)()
+        except Exception as e:
+            self.logger.error(f'PriceServerPool close failed - {e}')
+
+    def call(self, method, *args):
+        """ result of a price server session method, cached and coalesced """
+        key = (method, args)
+        owner = False
+        with self.lock:
+            if key in self.cache:
+                self.counts['hits'] += 1
+                return self.cache[key]
+            future = self.in_flight.get(key)
+            if future is not None:
+                self.counts['coalesced'] += 1
+            else:
+                self.counts['misses'] += 1
+                future = self.in_flight[key] = Future()
+                future.set_running_or_notify_cancel()
+                owner = True
+        if not owner:
+            return future.result()
+
+        try:
+            session = self.acquire()
+            healthy = True
+            try:
+                result = getattr(session, method)(*args)
+            except Exception:
+                healthy = False
+                raise
+            finally:
+                self.release(session, healthy)
+        except Exception as e:
+            with self.lock:
+                self.counts['errors'] += 1
+                self.in_flight.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        with self.lock:
+            # the price server answers None while a rate is not available
+            if result is not None:
+                self.cache[key] = result
+            self.in_flight.pop(key, None)
+        future.set_result(result)
+        return result
+
+    def get_rate(self, coin1, coin2):
+        return self.call('get_rate', coin1, coin2)
+
+    @property
+    def metrics(self):
+        with self.lock:
+            requests = self.counts['hits'] + self.counts['misses'] + self.counts['coalesced']
+            return {
+                **self.counts,
+                'requests': requests,
+                'hit_ratio': round(
+                    (self.counts['hits'] + self.counts['coalesced']) / requests, 4
+                ) if requests else None,
+                'sessions': self.opened,
+            }
+
+
+price_server = PriceServerPool()
@@ -0,0 +1,458 @@
+###############################################################################
+# Description: Deterministic replay of TWAPBot / ParticipationBot runs
+###############################################################################
+
+import argparse
+import bisect
+import contextlib
+import json
+import logging
+import math
+import operator
+import random
+import time
+
+import numpy as np
+
+from altonomy.core.AccountBalance import AccountBalance
+from altonomy.core.Order import Order
+from altonomy.core.OrderBook import LegacyOrderBook
+from altonomy.core.Side import BUY, SELL
+from altonomy.ref_data_api.api import InstrumentData
+
+from .InstrumentCache import InstrumentCache
+from .MarketHistory import MarketHistoryService
+from .ParticipationBot import ParticipationBot
+from .TWAPBot import TWAPBot, BotStatus
+
+ORDER_STATE_OPEN = 'AO'
+ORDER_STATE_FILLED = 'FO'
+ORDER_STATE_CANCELLED = 'CO'
+
+
+def load_jsonl(path):
+    """ one json record per line, blank lines are skipped """
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class VirtualClock():
+    """
+    Stands in for the time module of the replayed bots.
+    Listeners run whenever a bot sleeps, in place of background threads.
+    """
+
+    def __init__(self, start_ts):
+        self.now = float(start_ts)
+        self.listeners = []
+        self._notifying = False
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(float(seconds), 0.0)
+        if self._notifying:
+            return
+        self._notifying = True
+        try:
+            for listener in self.listeners:
+                listener()
+        finally:
+            self._notifying = False
+
+
+class ReplayClient():
+    """
+    Stand-in for altonomy.core.client serving recorded data.
+
+    Order books are served as of the virtual clock, from records of
+    {"timestamp": ts, "bids": [[price, amount], ...], "asks": [...]}.
+    Books older than BROKER_ORDERBOOK_REFRESH_MAX_TIME are stale to the bots,
+    so they should be recorded at least once a second.
+    Klines are records of {"time_open": ts, "amount": volume, ...}.
+    Orders fill against the contra side of the current snapshot at the
+    level prices they cross; queue position of resting orders is ignored
+    and each snapshot's liquidity can only be consumed once.
+    """
+
+    def __init__(
+        self,
+        base,
+        quote,
+        orderbooks,
+        clock,
+        *,
+        klines=None,
+        balances=None,
+        instrument=None,
+        account_id=0,
+        exchange_name='Replay',
+        logger=None,
+    ):
+        self.logger = logger or logging.getLogger()
+        self.base = base
+        self.quote = quote
+        self.pair = base + quote
+        self.clock = clock
+        self.orderbooks = sorted(orderbooks, key=lambda ob: ob['timestamp'])
+        self.book_timestamps = [ob['timestamp'] for ob in self.orderbooks]
+        self.klines = sorted(
+            klines or [], key=lambda k: k['time_open'], reverse=True)
+        self.balances = dict(balances or {})
+        self.instrument = instrument
+        self.account_id = account_id
+        self._exchange_name = exchange_name
+        self.service_id = None
+        self.orders = {}
+        self.fills = []
+        self.consumed = {}
+        self.store = {}
+
+    @classmethod
+    def from_files(
+        cls, base, quote, book_path, clock=None, *, kline_path=None, **kwargs
+    ):
+        orderbooks = load_jsonl(book_path)
+        klines = load_jsonl(kline_path) if kline_path else None
+        clock = clock or VirtualClock(
+            min(ob['timestamp'] for ob in orderbooks))
+        return cls(base, quote, orderbooks, clock, klines=klines, **kwargs)
+
+    @property
+    def start_ts(self):
+        return self.book_timestamps[0]
+
+    @property
+    def end_ts(self):
+        return self.book_timestamps[-1]
+
+    def book_index(self, ts=None):
+        ts = self.clock.time() if ts is None else ts
+        return max(bisect.bisect_right(self.book_timestamps, ts) - 1, 0)
+
+    def mid(self, index):
+        ob = self.orderbooks[index]
+        return 0.5 * (ob['bids'][0][0] + ob['asks'][0][0])
+
+    # market data
+    def get_orderbook(self, pair=None, *args, **kwargs):
+        self.match_orders()
+        snapshot = self.orderbooks[self.book_index()]
+        ob = LegacyOrderBook({
+            self.pair: {
+                'asks': [
+                    {'price': price, 'volume': amount}
+                    for price, amount in snapshot['asks']],
+                'bids': [
+                    {'price': price, 'volume': amount}
+                    for price, amount in snapshot['bids']],
+            }
+        })
+        ob.timestamp = snapshot['timestamp']
+        return ob
+
+    def get_market_history(self, pair, duration, count, *args, **kwargs):
+        now = self.clock.time()
+        return [k for k in self.klines if k['time_open'] <= now][:count]
+
+    @contextlib.contextmanager
+    def zerorpc(self):
+        yield self
+
+    # orders
+    def buy(self, pair, price, size, *args, account_id=None, **kwargs):
+        return self.place_order(BUY, price, size, account_id)
+
+    def sell(self, pair, price, size, *args, account_id=None, **kwargs):
+        return self.place_order(SELL, price, size, account_id)
+
+    def place_order(self, side, price, size, account_id):
+        order_id = len(self.orders) + 1
+        self.orders[order_id] = {
+            'order_ref': order_id,
+            'pair': self.pair,
+            'side': side,
+            'price': price,
+            'size': size,
+            'dealt': 0.0,
+            'remaining_amount': size,
+            'state': ORDER_STATE_OPEN,
+            'account': account_id or self.account_id,
+        }
+        self.logger.debug(f'replay order {self.orders[order_id]}')
+        self.match_orders()
+        return order_id
+
+    def cancel(self, order_id, *args, **kwargs):
+        self.match_orders()
+        order = self.orders.get(order_id)
+        if order and order['state'] == ORDER_STATE_OPEN:
+            order['state'] = ORDER_STATE_CANCELLED
+
+    def get_order_details(self, *, order_id, **kwargs):
+        self.match_orders()
+        return Order(dict(self.orders[order_id]))
+
+    def match_orders(self):
+        index = self.book_index()
+        snapshot = self.orderbooks[index]
+        for order in self.orders.values():
+            if order['state'] != ORDER_STATE_OPEN:
+                continue
+            if order['side'] == BUY:
+                levels, crosses = snapshot['asks'], operator.le
+            else:
+                levels, crosses = snapshot['bids'], operator.ge
+            for price, amount in levels:
+                if order['remaining_amount'] <= 0 \
+                        or not crosses(price, order['price']):
+                    break
+                key = (index, price)
+                available = amount - self.consumed.get(key, 0.0)
+                fill = min(available, order['remaining_amount'])
+                if fill <= 0:
+                    continue
+                self.consumed[key] = self.consumed.get(key, 0.0) + fill
+                order['dealt'] += fill
+                order['remaining_amount'] -= fill
+                self.fills.append((self.clock.time(), order['side'], price, fill))
+                self.update_balances(order['side'], price, fill)
+            if math.isclose(order['remaining_amount'], 0, abs_tol=1e-12):
+                order['remaining_amount'] = 0.0
+                order['state'] = ORDER_STATE_FILLED
+
+    # account
+    def update_balances(self, side, price, amount):
+        sign = 1 if side == BUY else -1
+        if self.base in self.balances:
+            self.balances[self.base] += sign * amount
+        if self.quote in self.balances:
+            self.balances[self.quote] -= sign * amount * price
+
+    def get_account_balance(self, account_id=None, **kwargs):
+        balance = AccountBalance()
+        for coin, available in self.balances.items():
+            balance[coin].available = available
+        return balance
+
+    def get_account_config(self, config, account_id=None):
+        return {
+            'exchange_name': self._exchange_name,
+            'exchange_id': 0,
+            'name': f'replay-{account_id}',
+            'dual_side_position': 'False',
+        }.get(config)
+
+    def get_exchange_config(self, *args, **kwargs):
+        return None
+
+    def get_product_leverage(self, pair, account_id=None, **kwargs):
+        return 1
+
+    def instrument_data(self, **kwargs):
+        return self
+
+    def get_active_instruments_for_exchange(self, exchange_id):
+        return [self.instrument] if self.instrument else []
+
+    def exchange_name(self, name):
+        return name
+
+    def register_resource_usage(self, *args, **kwargs):
+        pass
+
+    def deregister_resource_usage(self, *args, **kwargs):
+        pass
+
+    # redis
+    def get(self, key):
+        return self.store.get(key)
+
+    def post(self, key, value):
+        self.store[key] = value
+
+
+def make_instrument(data: dict):
+    ins = InstrumentData()
+    for key, value in data.items():
+        setattr(ins, key, value)
+    return ins
+
+
+class ReplayHelmClient():
+    """ Stand-in for HelmClient, no book listeners are started offline """
+
+    def __init__(self, endpoint=None, logger=None):
+        self.endpoint = endpoint
+
+    def start_orderbook_listener(self, *args, **kwargs):
+        pass
+
+
+class BotFactory():
+    """
+    Bot factory of the replay,
+    bot_class(*args, **kwargs, **engine.dependencies_of(bot_class))
+    """
+
+    def __init__(self, bot_class, *args, **kwargs):
+        self.bot_class = bot_class
+        self.args = args
+        self.kwargs = kwargs
+
+    def __call__(self, engine):
+        return self.bot_class(
+            *self.args, **self.kwargs,
+            **engine.dependencies_of(self.bot_class))
+
+
+class ReplayEngine():
+    """
+    Drives a bot's run() on the virtual clock, the way legacy_bot loops it,
+    and reports execution quality and per-cycle cpu time.
+
+    The clock and the replay client are handed to the bot through its
+    constructor, so replays can run next to live bots in the same process.
+    """
+
+    def __init__(self, replay_client, *, cycle_interval=0.5, seed=0, logger=None):
+        self.logger = logger or logging.getLogger()
+        self.client = replay_client
+        self.clock = replay_client.clock
+        self.cycle_interval = cycle_interval
+        self.seed = seed
+        self.cycle_cpu_times = []
+
+    def dependencies_of(self, bot_class):
+        """ constructor arguments pointing a bot at the clock and the replay client """
+        dependencies = {
+            'alt_client': self.client,
+            'alt_ref_client': self.client,
+            'clock': self.clock,
+            'alt_helm_client': ReplayHelmClient,
+            # replayed instruments must not reach the shared cache snapshots
+            'alt_instrument_cache': InstrumentCache(
+                snapshot_dir=None, logger=self.logger),
+        }
+        if issubclass(bot_class, ParticipationBot):
+            dependencies['alt_market_history'] = MarketHistoryService(
+                timer=self.clock.time, logger=self.logger)
+            dependencies['alt_random'] = random.Random(self.seed)
+        return dependencies
+
+    @staticmethod
+    def order_monitor_of(bot):
+        return getattr(bot, 'order_monitor', None) or bot.om
+
+    def replay(self, bot_factory, until=None):
+        """
+        :bot_factory callable(engine) returning the bot to replay,
+            e.g. BotFactory
+        :until virtual timestamp to stop at, defaults to the last book
+        """
+        until = until or self.client.end_ts
+        bot = bot_factory(self)
+        # the order monitor thread gets to run whenever the bot sleeps
+        self.clock.listeners.append(self.order_monitor_of(bot).refresh)
+        start_ts = self.clock.time()
+        try:
+            while self.clock.time() < until:
+                cpu_start = time.process_time()
+                bot.run()
+                self.cycle_cpu_times.append(time.process_time() - cpu_start)
+                if bot.bot_status == BotStatus.STRATEGY_COMPLETED:
+                    break
+                self.clock.sleep(self.cycle_interval)
+        finally:
+            self.clock.listeners.remove(self.order_monitor_of(bot).refresh)
+        end_ts = self.clock.time()
+        return self.report(start_ts, end_ts)
+
+    def twap_benchmark(self, start_ts, end_ts):
+        """ time weighted mid over the replayed period """
+        first = self.client.book_index(start_ts)
+        last = self.client.book_index(end_ts)
+        timestamps = np.array(
+            [start_ts]
+            + self.client.book_timestamps[first + 1:last + 1]
+            + [end_ts])
+        mids = np.array([self.client.mid(i) for i in range(first, last + 1)])
+        weights = np.diff(timestamps)
+        if weights.sum() <= 0:
+            return float(mids[0])
+        return float(np.dot(mids, weights) / weights.sum())
+
+    def report(self, start_ts, end_ts):
+        fills = self.client.fills
+        dealt = sum(amount for _, _, _, amount in fills)
+        fill_price = (
+            sum(price * amount for _, _, price, amount in fills) / dealt
+            if dealt else None)
+        arrival_price = self.client.mid(self.client.book_index(start_ts))
+        twap_price = self.twap_benchmark(start_ts, end_ts)
+        side = fills[0][1] if fills else None
+
+        def slippage_bps(benchmark):
+            if fill_price is None:
+                return None
+            sign = 1 if side == BUY else -1
+            return round(sign * (fill_price - benchmark) / benchmark * 1e4, 3)
+
+        cpu_ms = np.array(self.cycle_cpu_times or [0.0]) * 1000
+        return {
+            'start_ts': start_ts,
+            'end_ts': end_ts,
+            'cycles': len(self.cycle_cpu_times),
+            'orders': len(self.client.orders),
+            'fills': len(fills),
+            'dealt': dealt,
+            'fill_price': fill_price,
+            'arrival_price': arrival_price,
+            'twap_price': twap_price,
+            'slippage_vs_arrival_bps': slippage_bps(arrival_price),
+            'slippage_vs_twap_bps': slippage_bps(twap_price),
+            'cycle_cpu_ms': {
+                'mean': float(cpu_ms.mean()),
+                'p50': float(np.percentile(cpu_ms, 50)),
+                'p99': float(np.percentile(cpu_ms, 99)),
+                'max': float(cpu_ms.max()),
+            },
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="aplbot-replay", description="replays a TWAP/POV bot offline")
+    parser.add_argument("bot", choices=["twap", "pov"])
+    parser.add_argument("--base", required=True)
+    parser.add_argument("--quote", required=True)
+    parser.add_argument("--books", required=True, help="order book jsonl")
+    parser.add_argument("--klines", help="kline jsonl, required for pov")
+    parser.add_argument("--config", required=True, help="bot config json")
+    parser.add_argument("--instrument", required=True, help="instrument json")
+    parser.add_argument("--balances", help="balances json, e.g. {\"BTC\": 1}")
+    parser.add_argument("--cycle", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        bot_config = json.load(f)
+    with open(args.instrument) as f:
+        instrument = make_instrument({
+            'exchange_symbol': args.base + args.quote, **json.load(f)})
+    balances = json.loads(args.balances) if args.balances else {
+        args.base: math.inf, args.quote: math.inf}
+
+    replay_client = ReplayClient.from_files(
+        args.base, args.quote, args.books, kline_path=args.klines,
+        balances=balances, instrument=instrument)
+    bot_class = TWAPBot if args.bot == "twap" else ParticipationBot
+    engine = ReplayEngine(replay_client, cycle_interval=args.cycle, seed=args.seed)
+    result = engine.replay(
+        BotFactory(bot_class, 0, args.base, args.quote, 0, bot_config))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
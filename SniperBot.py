@@ -12,15 +12,25 @@ from typing import Iterable
 from altonomy.core.Order import Order
 import operator
 
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import cachetools
 
+from .BalanceService import BalanceService
+from .MergedOrderBook import MergedOrderBook
 from .OrderMonitor import OrderMonitor
 from altonomy.core import OrderBook, client
+from altonomy.core import Streams
+from altonomy.core.OrderBook import UDSOrderBook
 from altonomy.core.Side import BUY, SELL, Side
 from altonomy.ref_data_api.api import InstrumentDataSession, InstrumentData
 
 from . import config
 from .HelmClient import HelmClient
+from .InstrumentCache import instrument_cache
+from .LatencyTracker import LatencyTracker, received
+from .LevelScan import qualifying_levels
 
 
 class SniperBot(AbstractContextManager):
@@ -53,6 +63,8 @@ class SniperBot(AbstractContextManager):
         self._cumulative_order_threshold = None
         self.trigger_condition = ' '
         self.stop_condition = ' '
+        self.streaming = False
+        self.concurrent = False
         self.base = base
         self.quote = quote
         self.config = config
@@ -62,6 +74,19 @@ class SniperBot(AbstractContextManager):
         self._max_slippage_threshold = None
         self.config_error = None
         self.order_monitor = OrderMonitor(self.client, self.logger, try_cancels=25)
+        self.balances = BalanceService(self.client, self.accounts, logger=self.logger)
+        self.book_cache = MergedOrderBook()
+        self.seen_book_seq = {}
+        self.seen_book_lock = threading.Lock()
+        # (ref_pair, ref_exchange) -> (fetched ts, price)
+        self.ref_prices = {}
+        self.stream_exit_flags = []
+        self.fire_lock = threading.Lock()
+        self.venue_locks = {account_id: threading.Lock() for account_id in self.accounts}
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(len(self.accounts), 1), thread_name_prefix='SniperBot')
+        self.latency = LatencyTracker()
+        self.config_valid = False
         self.delay = 2
         self.instrument_data = {}
         self.leverages = {}
@@ -88,6 +113,7 @@ class SniperBot(AbstractContextManager):
                 for key, order in position_completed_orders.items():
                     if order is not None:
                         self.order_monitor.completed_orders[key] = Order(order)
+                self.order_monitor.recompute_committed_qty()
 
                 self.logger.info(f'open_orders = {self.order_monitor.open_orders}')
                 self.logger.info(f'completed_orders = {self.order_monitor.completed_orders}')
@@ -113,8 +139,18 @@ class SniperBot(AbstractContextManager):
             return False
         return True
 
-    def get_reference_price(self, ref_pair, ref_exchange):
+    def get_reference_price(self, ref_pair, ref_exchange, cached=False):
+        """
+        Reference price from the reference book, or the price last fetched
+        if cached, None once older than the reference book max age
+        """
+        if cached:
+            ts, ref_price = self.ref_prices.get((ref_pair, ref_exchange), (0, None))
+            if time.time() - ts > config.REFERENCE_ORDERBOOK_REFRESH_MAX_TIME:
+                return None
+            return ref_price
         ref_price = None
+        fetch_ts = time.time()
         try:
             ob = self.ref_client.get_orderbook(
                 pair=ref_pair, exchange=ref_exchange)
@@ -131,6 +167,7 @@ class SniperBot(AbstractContextManager):
             self.logger.error(f'Error in get_reference_price - {e}')
 
         self.logger.debug(f'ref_price = {ref_price}')
+        self.ref_prices[(ref_pair, ref_exchange)] = (fetch_ts, ref_price)
         return ref_price
 
     def update_trigger_condition(self, trigger_condition):
@@ -155,22 +192,29 @@ class SniperBot(AbstractContextManager):
             self.logger.debug("invalid stop condition format - needs to be 'asset;direction;value'")
             self.stop_condition = ' '
 
-    def get_coin_tradable_balance(self, currency, account_id):
+    def get_balance(self, account_id, cached=False):
+        """ account balance, the last fetched one if cached """
+        if cached:
+            return self.balances.cached(account_id)
+        return self.balances.get(account_id)
+
+    def get_coin_tradable_balance(self, currency, account_id, cached=False):
         """ Gte account balance for given coin """
-        balance = self.client.get_account_balance(
-                    account_id, force_rpc=False)
-        if not balance or currency not in balance.keys():
+        balance = self.get_balance(account_id, cached)
+        available = self.balances.available(
+            account_id, currency, balance) if balance is not None else None
+        if available is None:
             self.logger.info(f'No Balance found for - {currency}')
             return -1.0
-        return balance[currency].get('available', 0.0)
+        return available
 
-    def check_stop_condition(self, account_id):
+    def check_stop_condition(self, account_id, cached=False):
         if self.stop_condition != ' ':
             try:
                 stop_asset, stop_direction, stop_value = \
                     [value.strip() for value in self.stop_condition.split(";")]
                 available_balance = self.get_coin_tradable_balance(
-                    stop_asset, account_id)
+                    stop_asset, account_id, cached)
                 self.logger.info(
                     f"Evaluating stop condition {stop_asset} "
                     f"{available_balance} {stop_direction} "
@@ -185,15 +229,20 @@ class SniperBot(AbstractContextManager):
                 self.logger.debug(f"failed to evaluation stop condition due to {e}")
         return False
 
-    def check_trigger_condition(self):
+    def reference_of(self):
+        """ (ref_pair, ref_exchange) of the trigger condition """
+        ref_exchange, ref_pair, _, _ = \
+            [value.strip() for value in self.trigger_condition.split(";")]
+        return ref_pair, self.client.exchange_name(ref_exchange.capitalize())
+
+    def check_trigger_condition(self, cached=False):
         if self.trigger_condition != ' ':
             try:
-                ref_exchange, ref_pair, trigger_direction, trigger_price = \
+                _, _, trigger_direction, trigger_price = \
                     [value.strip() for value in self.trigger_condition.split(
                         ";")]
-                ref_exchange = self.client.exchange_name(
-                    ref_exchange.capitalize())
-                ref_price = self.get_reference_price(ref_pair, ref_exchange)
+                ref_price = self.get_reference_price(
+                    *self.reference_of(), cached=cached)
                 self.logger.info(
                     f"Evaluating trigger condition {ref_price} "
                     f"{trigger_direction} {float(trigger_price)} ")
@@ -233,12 +282,10 @@ class SniperBot(AbstractContextManager):
 
             #instrument data
             exchange_id = self.exchange_id_of(account_id=account_id)
-            s = self.client.instrument_data()
-            instruments = s.get_active_instruments_for_exchange(exchange_id)
-            for ins in instruments:
-                if ins.exchange_symbol == self.pair:
-                    self.instrument_data[account_id] = ins
-                    self.logger.info(f'Adding instrument - {ins} for {account_id}')
+            ins = instrument_cache.get(self.client, exchange_id, self.pair)
+            if ins is not None:
+                self.instrument_data[account_id] = ins
+                self.logger.info(f'Adding instrument - {ins} for {account_id}')
 
 
     @property
@@ -369,6 +416,8 @@ class SniperBot(AbstractContextManager):
             'largeOrderThreshold': self.large_order_threshold,
             'cumulativeOrderThreshold': self.cumulative_order_threshold,
             'remark': self.remark,
+            'streaming': self.streaming,
+            'concurrent': self.concurrent,
         }
 
     @config.setter
@@ -388,6 +437,8 @@ class SniperBot(AbstractContextManager):
             self.update_remark(config.get('remark', ''))
             self.update_trigger_condition(config.get('trigger_condition', ' '))
             self.update_stop_condition(config.get('stop_condition', ' '))
+            self.streaming = str(config.get('streaming', 'False')).lower() == 'true'
+            self.concurrent = str(config.get('concurrent', 'False')).lower() == 'true'
         except Exception as e:
             self.config_error = e
             self.logger.error('error when setting config')
@@ -440,6 +491,7 @@ class SniperBot(AbstractContextManager):
             'completed_orders': json.dumps(self.order_monitor.completed_orders),
             'dealt_price' : str(self.order_monitor.dealt_price or 0.0),
             'dealt' : str(self.order_monitor.dealt or 0.0),
+            'latency': json.dumps(self.latency.summary()),
         }
 
     @property
@@ -508,9 +560,11 @@ class SniperBot(AbstractContextManager):
         alto_symbol = altonomy_symbol.split('/')
         return len(alto_symbol) >= 3 and alto_symbol[2] == 'COIN'
     
-    def balance_can_meet_order(self, account_id, order_price, order_amount) -> bool:
+    def balance_can_meet_order(self, account_id, order_price, order_amount, cached=False) -> bool:
         """ check if account has enough balance to place the order """
-        balance = self.client.get_account_balance(account_id, force_rpc=True)
+        balance = self.get_balance(account_id, cached)
+        if balance is None:
+            return False
         
         # Futures
         if self.is_futures_of():
@@ -552,9 +606,9 @@ class SniperBot(AbstractContextManager):
         # Spots
         else:
             if self.side == SELL:
-                start_bal = balance[self.base].available
+                start_bal = self.balances.available(account_id, self.base, balance) or 0.0
             elif self.side == BUY:
-                start_bal = balance[self.quote].available / order_price
+                start_bal = (self.balances.available(account_id, self.quote, balance) or 0.0) / order_price
             else:
                 raise ValueError
         self.logger.debug(f'start_bal: {start_bal} order amt: {order_amount}')
@@ -574,8 +628,263 @@ class SniperBot(AbstractContextManager):
         self.logger.debug(f'sending {self.side} order {size}@{price} for {self.pair}')
         return func(self.pair, price=price, size=size, order_type=self.get_order_type(), *args, **kwargs)
 
+    @property
+    def ready_to_fire(self):
+        """ quantity left that is not already pending """
+        if self.completed:
+            return False
+        return not (
+            math.isclose(
+                self.order_monitor.pending + self.order_monitor.dealt,
+                self.total_amount,
+                abs_tol=0.00001,
+            )
+            or self.order_monitor.pending + self.order_monitor.dealt > self.total_amount
+        )
+
+    def evaluate_book(self, account_id, ob, cached=False):
+        """
+        Send an order on the first qualifying level of the account's book.
+        Returns None if the book was not usable, True if an order was sent.
+        With cached, balances and reference prices are only read from what
+        run last fetched, so no rpc is made on the caller's thread.
+        """
+        if account_id in (
+            o.account_id for o in self.order_monitor.open_orders_snapshot()
+        ):
+            self.logger.debug(
+                f'ignoring {account_id} due to outstanding pending orders'
+            )
+            return None
+        if len(ob.bids) == 0 and len(ob.asks) == 0:
+            # ignore empty books, probably an error
+            return None
+        if not ob.timestamp:
+            # ignore books without timestamps, probably an error
+            return None
+        delay_threshold = self.order_book_delay_threshold(account_id)
+        if (
+            ob.timestamp
+            < max(
+                (
+                    o.update_time
+                    for o in self.order_monitor.orders_snapshot()
+                    if o.account_id == account_id and o.update_time
+                ),
+                default=0,
+            )
+            + delay_threshold
+        ):
+            self.logger.debug(f'waiting for order book update for {account_id}')
+            return None
+        self.logger.debug(f'obtained orderbook {ob}')
+
+        if self.side == BUY:
+            price_levels = ob.asks
+        else:
+            price_levels = ob.bids
+
+        remaining_amount = (
+            self.total_amount - self.order_monitor.pending - self.order_monitor.dealt
+        )
+        price_range = dict(
+            min_price=self.min_price,
+            max_price=self.max_price,
+            max_slippage_threshold=self.max_slippage_threshold,
+        )
+        qualifying = qualifying_levels(
+            price_levels,
+            self.side,
+            large_order_threshold=self.large_order_threshold,
+            cumulative_order_threshold=self.cumulative_order_threshold,
+            **price_range,
+        )
+
+        for i in qualifying:
+            price_level = price_levels[i]
+            self.logger.debug(
+                f'{price_level} meets large order threshold {self.large_order_threshold} '
+                f'and cumulative order threshold {self.cumulative_order_threshold}'
+            )
+            order_amount = min(remaining_amount, price_level.cumulative)
+
+            if self.check_stop_condition(account_id, cached):
+                break
+
+            if not self.check_trigger_condition(cached):
+                break
+
+            if not self.balance_can_meet_order(
+                account_id, price_level.price, order_amount, cached
+            ):
+                continue
+
+            decision_ts = time.time()
+            # venues firing at the same time share what is left of the total
+            order_amount = self.order_monitor.reserve(order_amount, self.total_amount)
+            if order_amount <= 0:
+                self.logger.debug(f'remaining amount already reserved, not firing on {account_id}')
+                return False
+            send_ts = time.time()
+            try:
+                order_id = self.send_order(
+                    price=price_level.price, size=order_amount, account_id=account_id, remark=self.remark
+                )
+            except Exception:
+                self.order_monitor.release(order_amount)
+                raise
+            if not order_id:
+                self.order_monitor.release(order_amount)
+                return False
+            sent_ts = time.time()
+            if self.is_futures_of():
+                self.balances.invalidate(account_id)
+            else:
+                self.balances.on_send(
+                    account_id, self.side, price_level.price, order_amount, self.base, self.quote
+                )
+            try:
+                self.order_monitor.add(order_id, committed=order_amount)
+            except Exception:
+                # the monitor never took over the reservation
+                self.order_monitor.release(order_amount)
+                raise
+            self.latency.record(
+                account_id,
+                order_id,
+                exchange_ts=ob.timestamp,
+                receive_ts=getattr(ob, 'receive_ts', None),
+                decision_ts=decision_ts,
+                send_ts=send_ts,
+                sent_ts=sent_ts,
+                ack_ts=time.time(),
+            )
+            return True
+        else:
+            self.logger.debug(f'no price level matches conditions')
+        return False
+
+    def fire_lock_of(self, account_id):
+        """ one lock for all venues, or one per venue in concurrent mode """
+        return self.venue_locks[account_id] if self.concurrent else self.fire_lock
+
+    def mark_book_seen(self, account_id, seq):
+        with self.seen_book_lock:
+            if seq > self.seen_book_seq.get(account_id, 0):
+                self.seen_book_seq[account_id] = seq
+
+    def cached_state_ready(self, account_id):
+        """ balance and reference price fresh enough to evaluate from cache """
+        if self.balances.cached(account_id) is None:
+            return False
+        if self.trigger_condition != ' ':
+            try:
+                ts, _ = self.ref_prices.get(self.reference_of(), (0, None))
+            except Exception:
+                return False
+            if time.time() - ts > config.REFERENCE_ORDERBOOK_REFRESH_MAX_TIME:
+                return False
+        return True
+
+    def refresh_cached_state(self):
+        """ fetch the state the stream callbacks evaluate books from """
+        self.balances.refresh()
+        for account_id in self.accounts:
+            self.order_book_delay_threshold(account_id)
+        if self.trigger_condition != ' ':
+            try:
+                self.get_reference_price(*self.reference_of())
+            except Exception as e:
+                self.logger.debug(f'failed to refresh reference price due to {e}')
+
+    def on_book_update(self, account_id, ob, seq):
+        """
+        Streaming mode, evaluate each book as it arrives from the state run
+        last fetched. A book arriving while another one fires, or before
+        that state is fresh, is left to run.
+        """
+        if not self.streaming:
+            # unsubscribed by the next run
+            return
+        fire_lock = self.fire_lock_of(account_id)
+        if not fire_lock.acquire(blocking=False):
+            return
+        try:
+            if not (self.config_valid and self.ready_to_fire):
+                return
+            self.balances.sync_fills(self.order_monitor)
+            if not self.cached_state_ready(account_id):
+                return
+            self.evaluate_book(account_id, ob, cached=True)
+            self.mark_book_seen(account_id, seq)
+        except Exception:
+            self.logger.error(f'failed to evaluate book of {account_id}')
+            self.logger.error(traceback.format_exc())
+        finally:
+            fire_lock.release()
+
+    def evaluate_venue(self, account_id, ob=None):
+        """ evaluate the given book of a venue, or fetch its latest book """
+        with self.venue_locks[account_id]:
+            if ob is None:
+                ob = received(self.orderbook(account_id=account_id))
+            return self.evaluate_book(account_id, ob)
+
+    def evaluate_books(self, books):
+        """
+        Concurrent mode, evaluate the books {account_id: ob or None} in
+        parallel and fire on every qualifying venue. The quantity is
+        reserved on the order monitor before each send, so the orders
+        together stay within total_amount.
+        """
+        futures = {
+            account_id: self.executor.submit(self.evaluate_venue, account_id, ob)
+            for account_id, ob in books.items()
+        }
+        results = {}
+        for account_id, future in futures.items():
+            try:
+                results[account_id] = future.result()
+            except Exception:
+                self.logger.error(f'failed to evaluate book of {account_id}')
+                self.logger.error(traceback.format_exc())
+                results[account_id] = None
+        return results
+
+    def subscribe_order_books(self):
+        """ stream the L2 book of every account into the book cache """
+        def subscribe_order_book(account_id):
+            def cache_order_book(*args):
+                ob = received(UDSOrderBook(args, source=account_id))
+                if ob.status != 1:
+                    return
+                seq = self.book_cache.update(account_id, ob)
+                self.on_book_update(account_id, ob, seq)
+
+            self.logger.debug(
+                f'subscribing to order book of {self.exchange_name_of(account_id)}'
+            )
+            return self.client.subscribe_streams(
+                [
+                    [
+                        self.exchange_name_of(account_id),
+                        self.pair,
+                        Streams.l2_detailed,
+                        cache_order_book,
+                    ]
+                ]
+            )
+
+        return [subscribe_order_book(account_id) for account_id in self.accounts]
+
+    def unsubscribe_order_books(self):
+        for exit_flag in self.stream_exit_flags:
+            exit_flag.set()
+        self.stream_exit_flags = []
+
     def run(self):
-        if not self.config_is_valid:
+        self.config_valid = self.config_is_valid
+        if not self.config_valid:
             self.logger.error(f'not running due to invalid config {self.config}')
             time.sleep(self.delay)
             return
@@ -589,14 +898,7 @@ class SniperBot(AbstractContextManager):
         self.logger.debug(
             f'pending {self.order_monitor.pending}, dealt {self.order_monitor.dealt}'
         )
-        if (
-            math.isclose(
-                self.order_monitor.pending + self.order_monitor.dealt,
-                self.total_amount,
-                abs_tol=0.00001,
-            )
-            or self.order_monitor.pending + self.order_monitor.dealt > self.total_amount
-        ):
+        if not self.ready_to_fire:
             self.logger.info(
                 f'possibly completed; awaiting update from open orders {self.order_monitor.open_orders}, not placing new order'
             )
@@ -604,91 +906,49 @@ class SniperBot(AbstractContextManager):
             return
         self.logger.debug('starting run cycle')
 
-        # start checking a different account each time
-        # TODO: aggregate order books and send the most favorable order first
-        for account_id in random.sample(self.accounts, len(self.accounts)):
-            if account_id in (
-                o.account_id for o in self.order_monitor.open_orders.values()
-            ):
-                self.logger.debug(
-                    f'ignoring {account_id} due to outstanding pending orders'
-                )
-                continue
-            ob = self.orderbook(account_id=account_id)
-            if len(ob.bids) == 0 and len(ob.asks) == 0:
-                # ignore empty books, probably an error
-                continue
-            if not ob.timestamp:
-                # ignore books without timestamps, probably an error
-                continue
-            delay_threshold = self.order_book_delay_threshold(account_id)
-            if (
-                ob.timestamp
-                < max(
-                    (
-                        o.update_time
-                        for o in self.order_monitor.orders.values()
-                        if o.account_id == account_id and o.update_time
-                    ),
-                    default=0,
-                )
-                + delay_threshold
-            ):
-                self.logger.debug(f'waiting for order book update for {account_id}')
-                continue
-            self.logger.debug(f'obtained orderbook {ob}')
-
-            if self.side == BUY:
-                price_levels = ob.asks
+        if self.streaming and not self.stream_exit_flags:
+            self.stream_exit_flags = self.subscribe_order_books()
+        elif not self.streaming and self.stream_exit_flags:
+            # streaming turned off by a config reload, resubscribed if
+            # it is turned back on
+            self.unsubscribe_order_books()
+        if self.streaming:
+            # books are evaluated as they arrive, catch up on the ones that
+            # arrived while an order was being fired or the state was stale
+            self.balances.sync_fills(self.order_monitor)
+            self.refresh_cached_state()
+            with self.seen_book_lock:
+                changed = self.book_cache.changed(self.seen_book_seq)
+            if self.concurrent:
+                self.evaluate_books({
+                    account_id: ob for account_id, (_, ob) in changed.items()
+                })
             else:
-                price_levels = ob.bids
-
-            for price_level in price_levels:
-                if price_level.amount < self.large_order_threshold:
-                    continue
-                if price_level.cumulative < self.cumulative_order_threshold:
-                    continue
-                self.logger.debug(
-                    f'{price_level} meets large order threshold {self.large_order_threshold} '
-                    f'and cumulative order threshold {self.cumulative_order_threshold}'
-                )
-                if (
-                    price_level.price < self.min_price
-                    or price_level.price > self.max_price
-                ):
-                    self.logger.debug(
-                        f'{price_level} not in price range {self.min_price}, {self.max_price}'
-                    )
-                    break
-                if price_level.slippage > self.max_slippage_threshold:
-                    break
-
-                order_amount = min(
-                    self.total_amount
-                    - self.order_monitor.pending
-                    - self.order_monitor.dealt,
-                    price_level.cumulative,
-                )
-
-                if self.check_stop_condition(account_id):
-                    break
+                with self.fire_lock:
+                    for account_id, (_, ob) in changed.items():
+                        if not self.ready_to_fire or self.evaluate_book(account_id, ob):
+                            break
+            time.sleep(0.05)
+            return
 
-                if not self.check_trigger_condition():
-                    break
+        self.balances.sync_fills(self.order_monitor)
 
-                if not self.balance_can_meet_order(
-                    account_id, price_level.price, order_amount
-                ):
-                    continue
+        if self.concurrent:
+            # fetch and evaluate every venue at once, firing on all that qualify
+            results = self.evaluate_books({account_id: None for account_id in self.accounts})
+            if not any(results.values()) and any(r is not None for r in results.values()):
+                time.sleep(self.delay)
+            return
 
-                order_id = self.send_order(
-                    price=price_level.price, size=order_amount, account_id=account_id, remark=self.remark
-                )
-                self.order_monitor.add(order_id)
+        # start checking a different account each time
+        # TODO: aggregate order books and send the most favorable order first
+        for account_id in random.sample(self.accounts, len(self.accounts)):
+            ob = received(self.orderbook(account_id=account_id))
+            evaluated = self.evaluate_book(account_id, ob)
+            if evaluated:
                 return
-            else:
-                self.logger.debug(f'no price level matches conditions')
-            time.sleep(self.delay)
+            if evaluated is not None:
+                time.sleep(self.delay)
 
     def __enter__(self):
         self.order_monitor.start()
@@ -697,7 +957,10 @@ class SniperBot(AbstractContextManager):
     def __exit__(
         self, exc_type, exc_value, traceback,
     ):
+        self.unsubscribe_order_books()
         self.order_monitor.stop()
+        self.balances.stop()
+        self.executor.shutdown(wait=False)
         self.logger.debug(
             f'bot exiting, remaining open orders are {self.order_monitor.open_orders}'
         )
@@ -0,0 +1,81 @@
+###############################################################################
+# Description: Rolling spread statistics for PairTradingBot
+###############################################################################
+
+import math
+
+import numpy as np
+
+
+class SpreadHistory():
+    """
+    Ring buffer of the last size spreads with a running sum and sum of
+    squares, so the rolling mean, std and z-score are O(1) per update.
+    The sums are of the spreads less a shift near their mean, so the
+    variance does not cancel out on spreads far from zero, and are rebuilt
+    from the buffer with a new shift each time it wraps around, which
+    keeps float drift bounded at an amortised O(1) cost.
+    """
+
+    def __init__(self, size, min_count=30):
+        self.size = int(size)
+        self.min_count = min(int(min_count), self.size)
+        self.values = np.zeros(self.size)
+        self.index = 0
+        self.count = 0
+        self.shift = None
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, spread):
+        spread = float(spread)
+        if self.shift is None:
+            self.shift = spread
+        if self.count == self.size:
+            old = self.values[self.index] - self.shift
+            self.total -= old
+            self.total_sq -= old * old
+        else:
+            self.count += 1
+        self.values[self.index] = spread
+        shifted = spread - self.shift
+        self.total += shifted
+        self.total_sq += shifted * shifted
+        self.index = (self.index + 1) % self.size
+        if self.index == 0:
+            self.shift = float(self.values.mean())
+            shifted = self.values - self.shift
+            self.total = float(shifted.sum())
+            self.total_sq = float(np.dot(shifted, shifted))
+
+    @property
+    def last(self):
+        return self.values[self.index - 1] if self.count else None
+
+    @property
+    def ready(self):
+        return self.count >= max(self.min_count, 2)
+
+    @property
+    def mean(self):
+        return self.shift + self.total / self.count if self.count else None
+
+    @property
+    def std(self):
+        if self.count < 2:
+            return None
+        mean = self.total / self.count
+        return math.sqrt(max(self.total_sq / self.count - mean * mean, 0.0))
+
+    def zscore(self, spread=None):
+        """ z-score of spread, the last one if not given, against the window """
+        if not self.ready:
+            return None
+        std = self.std
+        if not std:
+            return 0.0
+        spread = self.last if spread is None else spread
+        return (spread - self.mean) / std
@@ -0,0 +1,148 @@
+###############################################################################
+# Description: Cross venue sweep allocation over a merged order book
+###############################################################################
+
+import argparse
+import math
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from altonomy.core.Side import BUY, SELL
+
+
+def allocate_sweep(prices, amounts, venues, balances, total, side):
+    """
+    Split total across the merged levels, best first, without a venue
+    going over its balance. balances holds the available base (SELL) or
+    quote (BUY) balance of each venue. Returns {venue: (price, amount)},
+    the price being the worst level taken on the venue.
+    """
+    prices = np.asarray(prices, dtype=float)
+    amounts = np.asarray(amounts, dtype=float)
+    if not len(prices) or total <= 0:
+        return {}
+    venue_ids, venue_idx = np.unique(np.asarray(venues), return_inverse=True)
+    balance = np.array([balances[v] for v in venue_ids], dtype=float)
+
+    # venue capacity in base at each level price
+    if side == BUY:
+        capacity = balance[venue_idx] / prices
+    elif side == SELL:
+        capacity = balance[venue_idx]
+    else:
+        raise ValueError
+
+    # running amount per venue, capped by its capacity and never given back
+    order = np.argsort(venue_idx, kind='stable')
+    grouped = venue_idx[order]
+    cum = np.cumsum(amounts[order])
+    starts = np.flatnonzero(np.r_[True, grouped[1:] != grouped[:-1]])
+    group_start = np.repeat(starts, np.diff(np.r_[starts, len(grouped)]))
+    cum -= (cum - amounts[order])[group_start]
+    capped = np.minimum(cum, capacity[order])
+    capped = np.maximum(capped, 0.0)
+    for start, end in zip(starts, np.r_[starts[1:], len(grouped)]):
+        np.maximum.accumulate(capped[start:end], out=capped[start:end])
+    level_alloc = np.empty_like(amounts)
+    level_alloc[order] = np.diff(capped, prepend=0.0)
+    level_alloc[order[starts]] = capped[starts]
+
+    # take levels in merged order until the total is reached
+    queued_before = np.cumsum(level_alloc) - level_alloc
+    level_alloc = np.clip(total - queued_before, 0.0, level_alloc)
+    # drop float residue of the cumulative sums
+    level_alloc[level_alloc < 1e-12] = 0.0
+
+    taken = level_alloc > 0
+    venue_amounts = np.bincount(
+        venue_idx, weights=level_alloc, minlength=len(venue_ids))
+    worst = np.full(len(venue_ids), np.nan)
+    if side == BUY:
+        np.fmax.at(worst, venue_idx[taken], prices[taken])
+    else:
+        np.fmin.at(worst, venue_idx[taken], prices[taken])
+    return {
+        venue_ids[i].item(): (float(worst[i]), float(venue_amounts[i]))
+        for i in np.flatnonzero(venue_amounts > 0)
+    }
+
+
+def sweepable_levels(levels, balances, total, side):
+    """
+    Levels of a merged ladder, best first, read lazily up to the level
+    where the venue capacities taken reach total; allocate_sweep gives
+    nothing to the levels after it. Levels of venues not in balances are
+    skipped.
+    """
+    used = defaultdict(float)
+    queued = 0.0
+    for level in levels:
+        if queued >= total:
+            return
+        if level.source not in balances:
+            continue
+        balance = balances[level.source]
+        capacity = balance / level.price if side == BUY else balance
+        size = min(level.amount, max(capacity - used[level.source], 0.0))
+        used[level.source] += size
+        queued += size
+        yield level
+
+
+def allocate_sweep_loop(prices, amounts, venues, balances, total, side):
+    """ level by level allocation, reference for allocate_sweep """
+    order_amounts = defaultdict(float)
+    order_prices = {}
+    queued = 0.0
+    for price, amount, venue in zip(prices, amounts, venues):
+        if math.isclose(queued, total, abs_tol=1e-9) or queued >= total:
+            break
+        capacity = balances[venue] / price if side == BUY else balances[venue]
+        size = min(amount, max(capacity - order_amounts[venue], 0.0), total - queued)
+        if size < 1e-12:
+            continue
+        order_amounts[venue] += size
+        order_prices[venue] = price
+        queued += size
+    return {
+        venue: (order_prices[venue], amount)
+        for venue, amount in order_amounts.items() if amount > 0
+    }
+
+
+def random_merged_book(n_venues, depth, side, seed=0):
+    rng = np.random.default_rng(seed)
+    step = 0.01 if side == BUY else -0.01
+    prices = 100 + step * (np.arange(depth) + rng.random((n_venues, depth)))
+    amounts = rng.exponential(1.0, (n_venues, depth))
+    venues = np.repeat(np.arange(n_venues), depth)
+    order = np.argsort(prices.ravel() * (1 if side == BUY else -1), kind='stable')
+    return prices.ravel()[order], amounts.ravel()[order], venues[order]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the sweep allocator on deep multi venue books')
+    parser.add_argument('--venues', type=int, default=20)
+    parser.add_argument('--depth', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    prices, amounts, venues = random_merged_book(args.venues, args.depth, BUY)
+    balances = {v: 100 * args.depth * 0.3 for v in range(args.venues)}
+    total = amounts.sum() * 0.5
+    for func in (allocate_sweep_loop, allocate_sweep):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            orders = func(prices, amounts, venues, balances, total, BUY)
+        elapsed = (time.perf_counter() - start) / args.repeat
+        print(
+            f'{func.__name__}: {elapsed * 1000:.3f} ms per sweep, '
+            f'{len(orders)} orders, '
+            f'{sum(a for _, a in orders.values()):.4f} allocated')
+
+
+if __name__ == '__main__':
+    main()
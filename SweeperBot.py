@@ -1,19 +1,22 @@
-from collections import defaultdict
 import functools
 import logging
 import math
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import AbstractContextManager, contextmanager
 from datetime import datetime
-from threading import Lock
 from typing import Iterable
 
 import cachetools
 
+from .BalanceService import BalanceService
+from .LatencyTracker import LatencyTracker, received
+from .MergedOrderBook import MergedOrderBook
 from .OrderMonitor import OrderMonitor
+from .SweepAllocator import allocate_sweep, sweepable_levels
 import altonomy.core.Streams as Streams
-from altonomy.core.OrderBook import OrderBook, UDSOrderBook
+from altonomy.core.OrderBook import UDSOrderBook
 from altonomy.core import Streams as Streams
 from altonomy.core import client
 from altonomy.core.Side import BUY, SELL, Side
@@ -45,6 +48,10 @@ class SweeperBot(AbstractContextManager):
         self.max_slippage_threshold = None
         self.delay = 2
         self.order_monitor = OrderMonitor(self.client, self.logger, try_cancels=25)
+        self.dispatcher = ThreadPoolExecutor(
+            max_workers=max(len(account_ids), 1), thread_name_prefix='SweeperBot')
+        self.latency = LatencyTracker()
+        self.balances = BalanceService(self.client, account_ids, logger=self.logger)
         self.streams = self.subscribe_order_books()
         self.logger.info(f'SweeperBot started on accounts {account_ids}')
 
@@ -114,6 +121,7 @@ class SweeperBot(AbstractContextManager):
             'dealt_price': self.order_monitor.dealt_price,
             'open_orders': self.order_monitor.open_orders,
             'completed_orders': self.order_monitor.completed_orders,
+            'latency': self.latency.summary(),
         }
 
     def send_order(self, price, size, *args, account_id, **kwargs):
@@ -125,9 +133,49 @@ class SweeperBot(AbstractContextManager):
             self.pair, price=price, size=size, *args, account_id=account_id, **kwargs
         )
 
+    def dispatch_order(self, price, size, account_id, ob=None, decision_ts=None):
+        """ send an order and add it to the order monitor, timing each stage """
+        send_ts = time.time()
+        order_id = self.send_order(
+            price, size, account_id=account_id, remark=self.remark
+        )
+        sent_ts = time.time()
+        self.balances.on_send(account_id, self.side, price, size, self.base, self.quote)
+        self.order_monitor.add(order_id)
+        self.latency.record(
+            account_id,
+            order_id,
+            exchange_ts=getattr(ob, 'timestamp', None),
+            receive_ts=getattr(ob, 'receive_ts', None),
+            decision_ts=decision_ts,
+            send_ts=send_ts,
+            sent_ts=sent_ts,
+            ack_ts=time.time(),
+        )
+        return order_id
+
+    def dispatch_orders(self, orders, books=None):
+        """ send the orders of all venues concurrently """
+        decision_ts = time.time()
+        futures = {
+            account_id: self.dispatcher.submit(
+                self.dispatch_order, price, amount, account_id,
+                (books or {}).get(account_id), decision_ts,
+            )
+            for account_id, (price, amount) in orders.items()
+        }
+        for account_id, future in futures.items():
+            try:
+                future.result()
+            except Exception:
+                self.logger.error(
+                    f'failed to send order {orders[account_id]} on {account_id}'
+                )
+                self.logger.error(traceback.format_exc())
+
     @contextmanager
     def subscribe_order_books(self):
-        cached_order_books = {}
+        merged_book = MergedOrderBook()
 
         def subscribe_order_book(account_id):
             def cache_order_book(*args):
@@ -136,8 +184,7 @@ class SweeperBot(AbstractContextManager):
                 except AttributeError:
                     cache_order_book.was_invalid_book = False
                     was_invalid_book = False
-                lock = Lock()
-                ob = UDSOrderBook(args, source=account_id)
+                ob = received(UDSOrderBook(args, source=account_id))
                 if ob.status != 1:
                     if not was_invalid_book:
                         self.logger.error(
@@ -145,9 +192,8 @@ class SweeperBot(AbstractContextManager):
                         )
                         cache_order_book.was_invalid_book = True
                     return
-                with lock:
-                    cache_order_book.was_invalid_book = False
-                    cached_order_books[account_id] = ob
+                cache_order_book.was_invalid_book = False
+                merged_book.update(account_id, ob)
 
             self.logger.debug(
                 f'subscribing to order book of {self.exchange_name_of(account_id)}'
@@ -166,13 +212,13 @@ class SweeperBot(AbstractContextManager):
 
         exit_flags = [subscribe_order_book(account_id) for account_id in self.accounts]
         try:
-            while len(cached_order_books) < max(len(self.accounts) // 2, 1):
+            while len(merged_book) < max(len(self.accounts) // 2, 1):
                 self.logger.debug(
                     f'waiting for at least {max(len(self.accounts) // 2, 1)}'
-                    f'streams to be ready, currently {len(cached_order_books)}'
+                    f'streams to be ready, currently {len(merged_book)}'
                 )
                 time.sleep(0.05)
-            yield cached_order_books
+            yield merged_book
         finally:
             for exit_flag in exit_flags:
                 exit_flag.set()
@@ -195,19 +241,15 @@ class SweeperBot(AbstractContextManager):
             self.total_amount, self.order_monitor.dealt, abs_tol=0.0001
         )
 
-    def remaining_balance_for_order(self, balance, order_price, order_amount):
-        """ remaining account balance for the order denoted in base currency """
+    def available_balance(self, account_id, balance):
+        """ available account balance for the order, base to sell or quote to buy """
         if self.side == SELL:
-            start_bal = balance[self.base].available
+            currency = self.base
         elif self.side == BUY:
-            start_bal = balance[self.quote].available / order_price
+            currency = self.quote
         else:
             raise ValueError
-        self.logger.debug(f'start_bal: {start_bal} order amt: {order_amount}')
-        if math.isclose(start_bal, order_amount, rel_tol=0.001):
-            return 0
-        else:
-            return start_bal - order_amount
+        return self.balances.available(account_id, currency, balance) or 0.0
 
     @cachetools.cached(cache=cachetools.TTLCache(maxsize=64, ttl=60))
     def order_book_delay_threshold(self, account_id, default=0.5):
@@ -271,137 +313,102 @@ class SweeperBot(AbstractContextManager):
         self.logger.debug(
             f'pending {self.order_monitor.pending}, dealt {self.order_monitor.dealt}'
         )
-        lock = Lock()
-        with lock:
-            # check order books if they have timed out
-            order_books_valid = {}
-            for account_id in list(self.cached_order_books.keys()):
-                # pop the order book so it's not re-used without an update from the same exchange
-                ob = self.cached_order_books.pop(account_id)
-                self.logger.debug(f'account_id {account_id} order book {ob}')
-                if ob.source in (
-                    o.account_id for o in self.order_monitor.open_orders.values()
-                ):
-                    self.logger.debug(f'ignoring book due to pending orders')
-
-                delay_threshold = self.order_book_delay_threshold(account_id)
-                if len(ob.bids) == 0 and len(ob.asks) == 0:
-                    # ignore empty books, probably an error
-                    continue
-                if not ob.timestamp:
-                    # ignore books without timestamps, probably an error
-                    continue
-                if (
-                    ob.timestamp
-                    < max(
-                        (
-                            o.update_time
-                            for o in self.order_monitor.orders.values()
-                            if o.account_id == account_id and o.update_time
-                        ),
-                        default=0,
-                    )
-                    + delay_threshold
-                ):
-                    self.logger.debug(
-                        f'waiting for order book update for {account_id} for recently completed orders'
-                    )
-                    continue
-                delay = datetime.utcnow().timestamp() - ob.timestamp
-
-                self.logger.debug(f'book delay is {delay}')
-
-                if delay < delay_threshold:
-                    order_books_valid[account_id] = ob
-                else:
-                    self.logger.debug(
-                        f'order book for account_id {self.name_of(account_id)} invalid as '
-                        f'order book delay of {delay} '
-                        f'is more than {delay_threshold} '
-                    )
-            if not order_books_valid:
-                self.logger.debug(f'no order books within threshold, not progressing')
-                return
+        # check order books if they have timed out
+        order_books_valid = {}
+        # only books with a newer sequence than the last run, so a book is
+        # not re-used or re-validated without an update from the same exchange
+        for account_id, (_, ob) in self.merged_book.changed(self.seen_book_seq).items():
+            self.logger.debug(f'account_id {account_id} order book {ob}')
+            if ob.source in (
+                o.account_id for o in self.order_monitor.open_orders.values()
+            ):
+                self.logger.debug(f'ignoring book due to pending orders')
+
+            delay_threshold = self.order_book_delay_threshold(account_id)
+            if len(ob.bids) == 0 and len(ob.asks) == 0:
+                # ignore empty books, probably an error
+                continue
+            if not ob.timestamp:
+                # ignore books without timestamps, probably an error
+                continue
+            if (
+                ob.timestamp
+                < max(
+                    (
+                        o.update_time
+                        for o in self.order_monitor.orders.values()
+                        if o.account_id == account_id and o.update_time
+                    ),
+                    default=0,
+                )
+                + delay_threshold
+            ):
+                self.logger.debug(
+                    f'waiting for order book update for {account_id} for recently completed orders'
+                )
+                continue
+            delay = datetime.utcnow().timestamp() - ob.timestamp
+
+            self.logger.debug(f'book delay is {delay}')
+
+            if delay < delay_threshold:
+                order_books_valid[account_id] = ob
             else:
-                self.logger.debug(f'valid books: {order_books_valid}')
-                merged_book = OrderBook.merge(*order_books_valid.values())
-                self.logger.debug(f'merged book {merged_book}')
+                self.logger.debug(
+                    f'order book for account_id {self.name_of(account_id)} invalid as '
+                    f'order book delay of {delay} '
+                    f'is more than {delay_threshold} '
+                )
+        if not order_books_valid:
+            self.logger.debug(f'no order books within threshold, not progressing')
+            return
+        else:
+            self.logger.debug(f'valid books: {order_books_valid}')
 
         if self.side == BUY:
-            price_levels = merged_book.asks
+            price_levels = MergedOrderBook.merge_levels(
+                order_books_valid.values(), 'asks')
         elif self.side == SELL:
-            price_levels = merged_book.bids
+            price_levels = MergedOrderBook.merge_levels(
+                order_books_valid.values(), 'bids')
         else:
             raise ValueError
-        account_balances = {
-            account_id: self.client.get_account_balance(account_id)
-            for account_id in self.accounts
-        }
-
-        order_amounts = defaultdict(float)
-        order_prices = {}
+        self.balances.sync_fills(self.order_monitor)
+        account_balances = self.balances.snapshot()
 
         total_order_size = self.remaining_amount - self.order_monitor.pending
+        available_balances = {
+            account_id: self.available_balance(account_id, balance)
+            for account_id, balance in account_balances.items()
+        }
 
-        for price_level in price_levels:
-            if math.isclose(
-                sum(order_amounts.values()), total_order_size, abs_tol=0.001
-            ):
-                self.logger.debug(f'finished generating all orders')
-                break
-            elif sum(order_amounts.values()) >= total_order_size:
-                self.logger.error(
-                    f'illegal state, somehow queued more order amounts than required'
-                )
-                raise Exception
-            else:
-                self.logger.debug(f'queued order size {sum(order_amounts.values())}')
-
-            self.logger.debug(f'processing {price_level}')
-
-            remaining_order_capacity = self.remaining_balance_for_order(
-                account_balances[price_level.source],
-                order_price=order_prices.get(price_level.source, price_level.price),
-                order_amount=order_amounts[price_level.source],
-            )
-
-            if remaining_order_capacity == 0:
-                self.logger.debug(
-                    f'account balance of {price_level.source} assumed depleted '
-                    f'at {account_balances[price_level.source]} '
-                    f'with order size {order_amounts[price_level.source]}@{order_prices.get(price_level.source)} queued'
-                )
-                continue
-            self.logger.debug(
-                f'using lowest amount from {price_level.amount}/'
-                f'{remaining_order_capacity}/'
-                f'{total_order_size - sum(order_amounts.values())}'
-            )
-            order_amounts[price_level.source] += min(
-                price_level.amount,
-                remaining_order_capacity,
-                total_order_size - sum(order_amounts.values()),
-            )
-            order_prices[price_level.source] = price_level.price
+        # only the levels the sweep can reach are merged
+        price_levels = list(sweepable_levels(
+            price_levels, available_balances, total_order_size, self.side))
+        orders = allocate_sweep(
+            [level.price for level in price_levels],
+            [level.amount for level in price_levels],
+            [level.source for level in price_levels],
+            available_balances,
+            total_order_size,
+            self.side,
+        )
+        self.logger.debug(f'allocated {orders} for {total_order_size}')
 
-        for account_id, amount in order_amounts.items():
-            if account_id not in order_prices or amount == 0:
-                continue
-            price = order_prices[account_id]
-            order_id = self.send_order(
-                price, amount, account_id=account_id, remark=self.remark
-            )
-            self.order_monitor.add(order_id)
+        self.dispatch_orders(orders, order_books_valid)
 
     def __enter__(self):
         self.order_monitor.start()
-        self.cached_order_books = self.streams.__enter__()
+        self.merged_book = self.streams.__enter__()
+        self.seen_book_seq = {}
         return self
 
     def __exit__(
         self, exc_type, exc_value, traceback,
     ):
         self.streams.__exit__(None, None, None)
+        self.dispatcher.shutdown(wait=True)
+        self.balances.stop()
         self.order_monitor.stop()
         self.logger.debug(
             f'bot exiting, remaining open orders are {self.order_monitor.open_orders}'
@@ -4,6 +4,7 @@
 ###############################################################################
 
 import functools
+import math
 import logging
 import time
 import json
@@ -11,11 +12,14 @@ import operator
 from importlib import import_module
 from contextlib import AbstractContextManager
 import traceback
+from typing import Iterable
 from altonomy.core.Order import Order
 
 import cachetools
+import numpy as np
 
 from .OrderMonitor import OrderMonitor
+from .InstrumentCache import instrument_cache
 from altonomy.core import client
 from altonomy.core.Side import BUY, SELL, Side
 
@@ -44,6 +48,7 @@ ERR_QTY_LESS_THAN_MIN_QTY = 'Total Qty({}) must be gt Min Order Qty({})'
 ERR_SLICE_SIZE_LESS_THAN_MIN_QTY = 'Slice Size({}) lt Min Order Qty({})'
 ERR_MAX_ORDER_SIZE_BREACH = 'Order Size({}) >= Slice size ({}) x {}'
 ERR_INVALID_DURATION = 'Invalid Duration ({})'
+ERR_MULTI_VENUE_SPOT_ONLY = 'Multi venue routing supports SPOT only'
 
 ERR_NO_PRICE_QTY = 'Cannot decide Price/Qty'
 
@@ -88,9 +93,24 @@ class TWAPBot(AbstractContextManager):
         service_id=None,
         alt_client=None,
         logger=None,
+        account_ids: Iterable = None,
+        clock=None,
+        alt_ref_client=None,
+        alt_helm_client=None,
+        alt_instrument_cache=None,
     ):
+        """
+        :clock time module stand-in, with time() and sleep()
+        :alt_helm_client HelmClient stand-in, called with endpoint and logger
+        """
         self.logger = logger or logging.getLogger()
+        self.clock = clock or time
+        self.helm_client = alt_helm_client or HelmClient
+        self.instrument_cache = alt_instrument_cache or instrument_cache
         self.account_id = account_id
+        # venues available for multi venue routing, main account first
+        self.venue_account_ids = [account_id] + [
+            a for a in (account_ids or []) if a != account_id]
         self.bot_id = bot_id
         self.service_id = service_id
         if alt_client:
@@ -102,7 +122,7 @@ class TWAPBot(AbstractContextManager):
             )
         if service_id:
             self.client.service_id = service_id
-        self.ref_client = client(logger=self.logger)
+        self.ref_client = alt_ref_client or client(logger=self.logger)
         self.base = base
         self.quote = quote
         self.pair = self.base + self.quote
@@ -116,6 +136,12 @@ class TWAPBot(AbstractContextManager):
         self.default_post_frequency = 10  # twap will send orders every 10sec
         self.trigger_condition = ' '
         self.stop_condition = ' '
+        self.multi_venue = False
+        self.venue_fees = {}
+        self.venue_instruments = {}
+        # accounts with a started and registered book listener
+        self.book_listener_accounts = None
+        self.depth_slippage_threshold = -1
         self._action = BOT_ACTION_START
         self.config = config
         self.config_error = None
@@ -130,9 +156,12 @@ class TWAPBot(AbstractContextManager):
         self.tob = None
         self.toa = None
         self.mid = None
+        self.last_ob = None
 
         self.order_id = None
         self.order_quantity = 0
+        self.child_orders = {}
+        self.deferred_qty = 0.0
         self.instrument_data = None
         self.leverage = 1
 
@@ -141,6 +170,8 @@ class TWAPBot(AbstractContextManager):
         self.tradable_bit_mask |= TradableBitMask.MarketStatus
 
         self.slice_size = 0
+        self.slice_weights = []
+        self.slice_weights_start = 0
         self.post_frequency = self.default_post_frequency
         self.total_no_of_posts = 0
         self.posts_completed = 0
@@ -149,16 +180,16 @@ class TWAPBot(AbstractContextManager):
         self.last_min_order_qty = 0
         self.min_order_qty = 0
 
-        self.last_force_rpc_balance_ts = time.time()
+        self.last_force_rpc_balance_ts = self.clock.time()
         self.balance_check_backoff = None
 
         self.continues_failed_order_count = 0
-        self.continues_failed_order_count_ts = time.time()
+        self.continues_failed_order_count_ts = self.clock.time()
 
-        self.instrument_load_ts = time.time()
-        self.update_redis_ts = time.time()
+        self.instrument_load_ts = self.clock.time()
+        self.update_redis_ts = self.clock.time()
 
-        self.start_time = time.time()
+        self.start_time = self.clock.time()
 
         self.account_operation = None
 
@@ -167,12 +198,14 @@ class TWAPBot(AbstractContextManager):
             self.logger,
             refresh_interval=0.5,
             try_cancels=10,
-            try_cancel_interval=0.2
+            try_cancel_interval=0.2,
+            clock=self.clock
         )
         self.get_account_operation()
 
         self.initialise_order_monitor()
 
+        self.book_listener_accounts = set()
         self.start_book_listener()
 
         self.load_instruments_data()
@@ -198,19 +231,40 @@ class TWAPBot(AbstractContextManager):
         self.bot_status = BotStatus.WAITING
         self.order_id = None
         self.order_quantity = 0
+        self.child_orders = {}
+        self.deferred_qty = 0.0
 
         self.tradable_bit_mask = TradableBitMask.ALL_GOOD
         self.tradable_bit_mask |= TradableBitMask.PricerNotReady
         self.tradable_bit_mask |= TradableBitMask.MarketStatus
 
         self.slice_size = 0
+        self.slice_weights = []
+        self.slice_weights_start = 0
         self.post_frequency = self.default_post_frequency
         self.total_no_of_posts = 0
         self.posts_completed = 0
         self.bot_progress_duration = 0
         self.last_post_ts = 0
         self.last_min_order_qty = self.min_order_qty
-        self.start_time = time.time()
+        self.start_time = self.clock.time()
+
+    def retarget(self, quantity, duration):
+        """ Trade quantity more over the next duration seconds, in place.
+            Open orders count towards quantity and keep working, the order
+            monitor, post schedule and market data are carried over
+        """
+        self.total_quantity = self.order_monitor.dealt + quantity
+        self.total_duration = self.get_bot_progress_duration() + duration
+        self.deferred_qty = 0.0
+        self.slice_weights = []
+        self.calculate_strategy_params(quantity, duration)
+        self.bot_status = BotStatus.WAITING
+        self.last_error = None
+        self.logger.info(
+            f'Retargeted to {quantity} over {duration}s, '
+            f'total_quantity = {self.total_quantity} '
+            f'total_no_of_posts = {self.total_no_of_posts}')
 
     def load_startegy_params(self):
         try:
@@ -237,10 +291,14 @@ class TWAPBot(AbstractContextManager):
             self.bot_progress_duration = float(
                 details.get("Bot_Progress_Duration"))
             self.last_min_order_qty = float(details.get("Last_Min_Order_Qty"))
+            self.deferred_qty = float(details.get("Deferred_Qty") or 0.0)
 
             if status != BotStatus.MAX_ORDER_SIZE_BREACH.name:
                 self.order_id = int(details.get("Last_Order_Id"))
                 self.order_quantity = float(details.get("Last_Order_Qty"))
+                self.child_orders = {
+                    int(order_id): float(qty) for order_id, qty in
+                    json.loads(details.get("Last_Child_Orders") or '{}').items()}
 
             self.logger.info(
                 f'Loaded - order_id = {self.order_id} '
@@ -299,6 +357,29 @@ class TWAPBot(AbstractContextManager):
             f'qty = {self.total_quantity}'
         )
 
+    def set_slice_weights(self, weights):
+        """ Scale the slices of the coming posts, e.g. by expected volume.
+            Weights are normalised to average 1 so the schedule total holds
+        """
+        weights = [max(float(w), 0.0) for w in weights or []]
+        total = sum(weights)
+        if total <= 0:
+            self.slice_weights = []
+            return
+        self.slice_weights = [w * len(weights) / total for w in weights]
+        self.slice_weights_start = self.posts_completed
+        self.logger.debug(f'slice_weights = {self.slice_weights}')
+
+    @property
+    def current_slice_size(self):
+        """ slice size of the next post, at least min_order_qty """
+        post = self.posts_completed - self.slice_weights_start
+        if 0 <= post < len(self.slice_weights):
+            return max(
+                self.slice_size * self.slice_weights[post],
+                self.min_order_qty)
+        return self.slice_size
+
     def validate_ref_orderbook(self, ob):
         if len(ob.bids) == 0 or len(ob.asks) == 0:
             # ignore empty books, probably an error
@@ -308,7 +389,7 @@ class TWAPBot(AbstractContextManager):
             # ignore books without timestamps, probably an error
             self.logger.error('ref_orderbook - book without timestamps')
             return False
-        if time.time() - float(ob.timestamp) > (
+        if self.clock.time() - float(ob.timestamp) > (
                 config.REFERENCE_ORDERBOOK_REFRESH_MAX_TIME):
             self.logger.error(
                 f'ref_orderbook - staled market data - {ob.timestamp}')
@@ -380,46 +461,78 @@ class TWAPBot(AbstractContextManager):
 
             self.order_monitor.completed_orders = completed_orders
             self.order_monitor.open_orders = open_orders
+            self.order_monitor.recompute_committed_qty()
             self.logger.debug(f'total_dealt = {self.order_monitor.dealt}')
         except Exception as e:
             self.logger.error(f'initialise_order_monitor - {e}')
 
     def start_book_listener(self):
+        """
+        Start and register the book listeners of newly routed accounts,
+        and deregister the ones no longer routed
+        """
+        if self.book_listener_accounts is None:
+            return  # not constructed yet, started from __init__
+        routed = set(self.routed_account_ids)
+        for account_id in self.book_listener_accounts - routed:
+            self.stop_book_listener(account_id)
         try:
-            account = self.name_of(self.account_id)
-            hc = HelmClient(endpoint=config.HELM_REPO, logger=self.logger)
-            hc.start_orderbook_listener(
-                account, self.exchange_name, self.base, self.quote)
-            self.client.register_resource_usage(
+            for account_id in self.routed_account_ids:
+                if account_id in self.book_listener_accounts:
+                    continue
+                account = self.name_of(account_id)
+                exchange_name = self.exchange_name_of(account_id)
+                hc = self.helm_client(
+                    endpoint=config.HELM_REPO, logger=self.logger)
+                hc.start_orderbook_listener(
+                    account, exchange_name, self.base, self.quote)
+                self.client.register_resource_usage(
+                    "book",
+                    self.client.exchange_name(exchange_name),
+                    self.pair)
+                self.book_listener_accounts.add(account_id)
+                self.logger.info(
+                    f'Register resource usage: '
+                    f'resource_type=book exchange={exchange_name} '
+                    f'pair={self.pair}')
+        except Exception as e:
+            self.logger.error(f'Book listener startup failed - {e}')
+
+    def stop_book_listener(self, account_id):
+        try:
+            exchange_name = self.exchange_name_of(account_id)
+            self.client.deregister_resource_usage(
                 "book",
-                self.client.exchange_name(self.exchange_name),
+                self.client.exchange_name(exchange_name),
                 self.pair)
             self.logger.info(
-                f'Register resource usage: '
-                f'resource_type=book exchange={self.exchange_name} '
-                f'pair={self.pair}')
+                f'Deregister resource usage: resource_type=book, '
+                f'exchange={exchange_name}, pair={self.pair}')
         except Exception as e:
-            self.logger.error(f'Book listener startup failed - {e}')
+            self.logger.error(f'Book listener deregister failed - {e}')
+        self.book_listener_accounts.discard(account_id)
 
     def update_min_qty(self, price):
+        self.min_order_qty = self.min_qty_of(self.instrument_data, price)
+
+    def min_qty_of(self, instrument_data, price):
+        """ minimum order quantity of an instrument at price """
         if self.is_coin_margin:
-            self.min_order_qty = 1.0
-        elif self.instrument_data.min_order_notional:
-            self.min_order_qty = (
-                self.instrument_data.min_order_notional / price + 1e-10)
-            self.min_order_qty = round(
-                self.min_order_qty,
-                self.instrument_data.size_precision)
-            if self.min_order_qty == 0.0 or (
-                    self.min_order_qty
-                    < self.instrument_data.min_order_size + 1e-10):
-                self.min_order_qty = round(
-                    self.instrument_data.min_order_size,
-                    self.instrument_data.size_precision)
-        else:
-            self.min_order_qty = round(
-                self.instrument_data.min_order_size,
-                self.instrument_data.size_precision)
+            return 1.0
+        if instrument_data.min_order_notional:
+            min_order_qty = round(
+                instrument_data.min_order_notional / price + 1e-10,
+                instrument_data.size_precision)
+            if min_order_qty == 0.0 or (
+                    min_order_qty
+                    < instrument_data.min_order_size + 1e-10):
+                min_order_qty = round(
+                    instrument_data.min_order_size,
+                    instrument_data.size_precision)
+            return min_order_qty
+        return round(
+            instrument_data.min_order_size,
+            instrument_data.size_precision)
 
     def get_bot_status(self, bot_completed):
         if self.last_error:
@@ -429,7 +542,8 @@ class TWAPBot(AbstractContextManager):
 
         return 'RUNNING'
 
-    def validate_orderbook(self, ob):
+    def validate_orderbook(self, ob, account_id=None):
+        account_id = account_id or self.account_id
         if len(ob.bids) == 0 or len(ob.asks) == 0:
             # ignore empty books, probably an error
             self.tradable_bit_mask |= TradableBitMask.PricerNotReady
@@ -438,23 +552,23 @@ class TWAPBot(AbstractContextManager):
             # ignore books without timestamps, probably an error
             self.tradable_bit_mask |= TradableBitMask.MarketStatus
             return False
-        if time.time() - float(ob.timestamp) > (
+        if self.clock.time() - float(ob.timestamp) > (
                 config.BROKER_ORDERBOOK_REFRESH_MAX_TIME):
             self.logger.error(f'staled market data - timestamp={ob.timestamp}')
             self.tradable_bit_mask |= TradableBitMask.MarketDataStale
             return False
 
-        delay_threshold = self.order_book_delay_threshold(self.account_id)
+        delay_threshold = self.order_book_delay_threshold(account_id)
         if (
             ob.timestamp * 1000
             < max(
-                self.order_monitor.get_latest_update_time(self.account_id),
+                self.order_monitor.get_latest_update_time(account_id),
                 default=0,
             )
             + delay_threshold
         ):
             self.logger.debug(
-                f'waiting for order book update for {self.account_id}, '
+                f'waiting for order book update for {account_id}, '
                 f'current ob timestamp={ob.timestamp}')
             self.tradable_bit_mask |= TradableBitMask.MarketDataStale
             return False
@@ -472,6 +586,7 @@ class TWAPBot(AbstractContextManager):
             self.tob = ob.bids[0].price
             self.toa = ob.asks[0].price
             self.mid = 0.5 * (self.tob + self.toa)
+            self.last_ob = ob
 
             if self.tradable_bit_mask & TradableBitMask.PricerNotReady > 0:
                 self.tradable_bit_mask &= ~TradableBitMask.PricerNotReady
@@ -488,13 +603,10 @@ class TWAPBot(AbstractContextManager):
     def load_instruments_data(self):
         try:
             exchange_id = self.exchange_id_of(account_id=self.account_id)
-            s = self.client.instrument_data()
-            instruments = s.get_active_instruments_for_exchange(exchange_id)
-
             exchange_symbol = self.get_exchange_symbol()
-            for ins in instruments:
-                if ins.exchange_symbol == exchange_symbol:
-                    self.instrument_data = ins
+            self.instrument_data = self.instrument_cache.get(
+                self.client, exchange_id, exchange_symbol
+            ) or self.instrument_data
             if self.instrument_data is None:
                 self.logger.error(
                     f'Instrument_data not found for {exchange_symbol}')
@@ -552,12 +664,31 @@ class TWAPBot(AbstractContextManager):
                 "needs to be 'asset;direction;value'")
             self.stop_condition = ' '
 
-    def get_exchange_symbol(self):
+    def update_venue_fees(self, venue_fees):
+        """
+        :venue_fees (dict|str) fee rate per account, e.g. "{'1': 0.001}"
+        :update venue_fees
+        """
+        if isinstance(venue_fees, str):
+            venue_fees = json.loads(venue_fees.replace("\'", "\"")) \
+                if venue_fees.strip() else {}
+        self.venue_fees = {
+            str(account_id): float(fee)
+            for account_id, fee in (venue_fees or {}).items()}
+
+    @property
+    def routed_account_ids(self):
+        if self.multi_venue:
+            return self.venue_account_ids
+        return [self.account_id]
+
+    def get_exchange_symbol(self, exchange_name=None):
+        exchange_name = exchange_name or self.exchange_name
         try:
-            self.logger.info(f'exchange_name={self.exchange_name}')
+            self.logger.info(f'exchange_name={exchange_name}')
             exchange = getattr(
-                import_module(f"altonomy.exchanges.{self.exchange_name}"),
-                self.exchange_name)('', '', logger=self.logger)
+                import_module(f"altonomy.exchanges.{exchange_name}"),
+                exchange_name)('', '', logger=self.logger)
             exchange_symbol = exchange.symbol_convert_from_common(self.pair)
             self.logger.info(
                 f'pair={self.pair}, exchange_symbol={exchange_symbol}')
@@ -585,13 +716,13 @@ class TWAPBot(AbstractContextManager):
     def update_action(self, value):
         if value == BOT_ACTION_PAUSE:
             # pause updating the bot duration
-            current_time_spent = time.time() - self.start_time
+            current_time_spent = self.clock.time() - self.start_time
             self.bot_progress_duration += current_time_spent
             self.logger.debug(f'update_action - {self.bot_progress_duration}')
             self.start_time = 0
         else:
             # resume the bot duration calculation
-            self.start_time = time.time()
+            self.start_time = self.clock.time()
         self._action = value
 
     @property
@@ -604,7 +735,10 @@ class TWAPBot(AbstractContextManager):
             'threshold_price': self.threshold_price,
             'default_post_frequency': self.default_post_frequency,
             'remark': self.remark,
-            'max_slice_size_multiplier': self.max_slice_size_multiplier
+            'max_slice_size_multiplier': self.max_slice_size_multiplier,
+            'multi_venue': self.multi_venue,
+            'venue_fees': self.venue_fees,
+            'depth_slippage_threshold': self.depth_slippage_threshold,
         }
 
     @config.setter
@@ -624,6 +758,12 @@ class TWAPBot(AbstractContextManager):
             self.update_stop_condition(config.get('stop_condition', ' '))
             self.max_slice_size_multiplier = float(
                 config.get('max_slice_size_multiplier', '5'))
+            self.multi_venue = str(
+                config.get('multi_venue', 'False')).lower() == 'true'
+            self.update_venue_fees(config.get('venue_fees', {}))
+            self.depth_slippage_threshold = float(
+                config.get('depth_slippage_threshold', '-1'))
+            self.start_book_listener()
         except Exception as e:
             self.config_error = e
             self.logger.error('error when setting config')
@@ -735,7 +875,7 @@ class TWAPBot(AbstractContextManager):
             return price < self.threshold_price  # Floor for the sell
 
     def max_order_size_breached(self, size):
-        if size >= self.slice_size * self.max_slice_size_multiplier:
+        if size >= self.current_slice_size * self.max_slice_size_multiplier:
             return True
         return False
 
@@ -752,7 +892,7 @@ class TWAPBot(AbstractContextManager):
         """ check if account has enough balance to place the order """
         try:
             if self.balance_check_backoff and \
-                    (time.time() - self.last_force_rpc_balance_ts) > \
+                    (self.clock.time() - self.last_force_rpc_balance_ts) > \
                     self.balance_check_backoff:
                 self.logger.info(
                     f'Force rpc balance check, balance_check_backoff='
@@ -764,7 +904,7 @@ class TWAPBot(AbstractContextManager):
                     FORCE_BALANCE_CHECK_BACKOFF_RATE
                     * self.balance_check_backoff
                 )
-                self.last_force_rpc_balance_ts = time.time()
+                self.last_force_rpc_balance_ts = self.clock.time()
             else:
                 balance = self.client.get_account_balance(
                     self.account_id, force_rpc=False)
@@ -853,12 +993,12 @@ class TWAPBot(AbstractContextManager):
 
     def push_bot_data_to_redis(self):
         """ push twap trading bot data to redis """
-        if time.time() < (
+        if self.clock.time() < (
                 self.update_redis_ts
                 + config.UPDATE_REDIS_FREQUENCY):
             return
 
-        self.update_redis_ts = time.time()
+        self.update_redis_ts = self.clock.time()
         _position = self.position
         if _position:
             self.client.post(
@@ -926,7 +1066,7 @@ class TWAPBot(AbstractContextManager):
         if self.action == BOT_ACTION_PAUSE:
             return self.bot_progress_duration
 
-        current_time_spent = time.time() - self.start_time
+        current_time_spent = self.clock.time() - self.start_time
         return self.bot_progress_duration + current_time_spent
 
     def get_theorotical_progress(self):
@@ -958,6 +1098,9 @@ class TWAPBot(AbstractContextManager):
                 "Last_Min_Order_Qty": self.last_min_order_qty,
                 "Last_Order_Id": self.order_id,
                 "Last_Order_Qty": self.order_quantity,
+                "Last_Child_Orders": json.dumps(
+                    {str(k): v for k, v in self.child_orders.items()}),
+                "Deferred_Qty": self.deferred_qty,
             },
             "Balance": self.balance,
             "Progress": {
@@ -1024,11 +1167,14 @@ class TWAPBot(AbstractContextManager):
             self.last_error = ERR_INVALID_DURATION.format(
                 self.total_duration)
             return False
+        if self.multi_venue and self.is_futures_of():
+            self.last_error = ERR_MULTI_VENUE_SPOT_ONLY
+            return False
 
         return True
 
     def adjusted_post_time(self):
-        current_time = time.time()
+        current_time = self.clock.time()
         elapsed_time = current_time - self.last_post_ts
         if elapsed_time < 2 * self.post_frequency:
             self.logger.debug(f'Elapsed time - {elapsed_time}')
@@ -1039,74 +1185,75 @@ class TWAPBot(AbstractContextManager):
                 f'{elapsed_time}')
             return current_time
 
+    @property
+    def pending_order_ids(self):
+        if self.child_orders:
+            return [
+                order_id for order_id in self.child_orders
+                if order_id in self.order_monitor.open_orders]
+        return [self.order_id]
+
     def cancel_pending_order(self):
         # Check the previous order. cancel it if still not filled and
         self.consecutive_cancel_count = 0
         while self.order_monitor.pending > 0.0:
             if self.consecutive_cancel_count > 0 and \
-                time.time() - self.consecutive_cancel_count_ts \
+                self.clock.time() - self.consecutive_cancel_count_ts \
                     < CONSECUTIVE_CANCELLATION_WAITING_SECONDS:
                 self.logger.info(
                     f'Consecutive order cancellations - '
                     f'{self.consecutive_cancel_count}')
-                time.sleep(0.5)
+                self.clock.sleep(0.5)
             else:
-                self.logger.info(
-                    f'Cancelling the pending order id {self.order_id}'
-                    f' with pending  {self.order_monitor.pending}')
-                self.client.cancel(order_id=self.order_id, remark=self.remark)
+                for order_id in self.pending_order_ids:
+                    self.logger.info(
+                        f'Cancelling the pending order id {order_id}'
+                        f' with pending  {self.order_monitor.pending}')
+                    self.client.cancel(order_id=order_id, remark=self.remark)
                 self.consecutive_cancel_count += 1
-                self.consecutive_cancel_count_ts = time.time()
+                self.consecutive_cancel_count_ts = self.clock.time()
                 self.bot_status = BotStatus.ORDER_CANCELLED
 
             if self.consecutive_cancel_count > 5:
-                self.logger.info(
-                    f'Giving up after {self.consecutive_cancel_count} '
-                    f'tries. Deleting cancelled order - {self.order_id}')
-                self.order_monitor.delete(self.order_id)
+                for order_id in self.pending_order_ids:
+                    self.logger.info(
+                        f'Giving up after {self.consecutive_cancel_count} '
+                        f'tries. Deleting cancelled order - {order_id}')
+                    self.order_monitor.delete(order_id)
 
     def get_placed_orders_volume(self):
         """
-        Calculate total volume of orders that have been placed.
-        Uses OrderMonitor as the authoritative source.
-        Returns the sum of original order sizes for all open orders + completed orders.
+        Total volume of orders that have been placed.
+        Uses the OrderMonitor committed quantity, which counts open orders
+        in full and finished orders by their dealt quantity.
         """
-        open_orders_volume = 0.0
-        completed_orders_volume = 0.0
-
-        # Sum up original order sizes of all open orders
-        for order_id, order in self.order_monitor.open_orders.items():
-            if order and hasattr(order, 'size'):
-                open_orders_volume += order.size
-
-        # Sum up original order sizes of all completed orders
-        for order_id, order in self.order_monitor.completed_orders.items():
-            if order and hasattr(order, 'size'):
-                completed_orders_volume += order.size
-
-        placed_volume = open_orders_volume + completed_orders_volume
-
-        self.logger.debug(
-            f'Placed orders volume: {placed_volume} '
-            f'(open: {open_orders_volume}, completed: {completed_orders_volume})')
+        placed_volume = self.order_monitor.committed_qty
+        self.logger.debug(f'Placed orders volume: {placed_volume}')
         return placed_volume
 
+    def get_unfilled_qty(self, order_id, order_quantity):
+        if self.order_monitor.is_completed_order(order_id):
+            self.logger.debug(f'Checking last sent order {order_id}')
+            return self.order_monitor.get_remaining_qty(order_id)
+        elif self.order_monitor.is_failed_order(order_id):
+            self.bot_status = BotStatus.ORDER_FAILED
+            self.logger.error(
+                f'Last sent order {order_id} '
+                f'is failed without any fills.')
+            return order_quantity
+        else:
+            self.logger.debug(
+                f'The last order {order_id} with '
+                f'{order_quantity} didnt get executed')
+            return order_quantity
+
     def get_last_unfilled_qty(self):
-        if self.order_id:
-            if self.order_monitor.is_completed_order(self.order_id):
-                self.logger.debug(f'Checking last sent order {self.order_id}')
-                return self.order_monitor.get_remaining_qty(self.order_id)
-            elif self.order_monitor.is_failed_order(self.order_id):
-                self.bot_status = BotStatus.ORDER_FAILED
-                self.logger.error(
-                    f'Last sent order {self.order_id} '
-                    f'is failed without any fills.')
-                return self.order_quantity
-            else:
-                self.logger.debug(
-                    f'The last order {self.order_id} with '
-                    f'{self.order_quantity} didnt get executed')
-                return self.order_quantity
+        if self.child_orders:
+            return sum(
+                self.get_unfilled_qty(order_id, order_quantity)
+                for order_id, order_quantity in self.child_orders.items())
+        elif self.order_id:
+            return self.get_unfilled_qty(self.order_id, self.order_quantity)
         else:
             self.logger.info('About to prepare the first order')
             return 0
@@ -1130,6 +1277,210 @@ class TWAPBot(AbstractContextManager):
                 price = self.tob
         return price
 
+    def get_depth_available_qty(self, ob):
+        """
+        Liquidity on the contra side of the book within
+        depth_slippage_threshold of the touch price
+        """
+        levels = ob.asks if self.side == BUY else ob.bids
+        if not levels:
+            return 0.0
+        prices = np.fromiter(
+            (level.price for level in levels), dtype=float, count=len(levels))
+        amounts = np.fromiter(
+            (level.amount for level in levels), dtype=float, count=len(levels))
+        # asks are ascending and bids descending, search on an ascending view
+        if self.side == BUY:
+            limit = prices[0] * (1 + self.depth_slippage_threshold) + 1e-10
+            n_levels = np.searchsorted(prices, limit, side='right')
+        else:
+            limit = prices[0] * (1 - self.depth_slippage_threshold) - 1e-10
+            n_levels = np.searchsorted(-prices, -limit, side='right')
+        available_qty = float(amounts[:n_levels].sum())
+        self.logger.debug(
+            f'depth available {available_qty} in {n_levels} levels '
+            f'up to {limit}')
+        return available_qty
+
+    def cap_order_size_to_depth(self, order_size, aggressiveness):
+        """
+        Cap the size of taking orders at the liquidity within the slippage
+        band, the remainder is deferred to the next slots. Passive orders
+        rest on the book and are not capped.
+        """
+        if self.depth_slippage_threshold <= 0 or self.last_ob is None \
+                or aggressiveness != Aggressiveness.TAKING:
+            self.deferred_qty = 0.0
+            return order_size
+
+        available_qty = self.get_depth_available_qty(self.last_ob)
+        capped_size = round(
+            min(order_size, available_qty),
+            self.instrument_data.size_precision)
+        if capped_size < self.min_order_qty:
+            capped_size = min(order_size, self.min_order_qty)
+        self.deferred_qty = round(
+            order_size - capped_size, self.instrument_data.size_precision)
+        if self.deferred_qty > 0:
+            self.logger.info(
+                f'Order size {order_size} capped at {capped_size} by book '
+                f'depth, deferring {self.deferred_qty}')
+        return capped_size
+
+    def venue_instrument_data(self, account_id):
+        """ instrument data of the pair on the venue of account_id """
+        if account_id == self.account_id:
+            return self.instrument_data
+        if self.venue_instruments.get(account_id) is None:
+            exchange_symbol = self.get_exchange_symbol(
+                self.exchange_name_of(account_id))
+            self.venue_instruments[account_id] = self.instrument_cache.get(
+                self.client, self.exchange_id_of(account_id), exchange_symbol)
+        return self.venue_instruments[account_id]
+
+    def get_venue_price(self, ob, aggressiveness):
+        """ Same pricing as get_price, on the given venue book """
+        if (self.side == BUY) == (aggressiveness == Aggressiveness.TICK_BETTER):
+            return ob.bids[0].price
+        return ob.asks[0].price
+
+    def venue_capacity(self, account_id, order_price):
+        """ order capacity of the venue denoted in base currency """
+        try:
+            balance = self.client.get_account_balance(
+                account_id, force_rpc=False)
+            if self.side == SELL:
+                return balance[self.base].available
+            elif self.side == BUY:
+                return balance[self.quote].available / order_price
+            else:
+                raise ValueError
+        except Exception as e:
+            self.logger.error(f'venue_capacity {account_id} - {e}')
+            return 0.0
+
+    def get_venue_quotes(self, aggressiveness):
+        """
+        Quote every routed venue for the next slice.
+        Returns (fee adjusted price, account_id, price, depth, capacity,
+        instrument data) sorted best venue first.
+        """
+        quotes = []
+        for account_id in self.routed_account_ids:
+            try:
+                ob = self.orderbook(account_id=account_id)
+                # a bad book on one venue must not block the other venues
+                tradable_bit_mask = self.tradable_bit_mask
+                is_valid = self.validate_orderbook(ob, account_id)
+                self.tradable_bit_mask = tradable_bit_mask
+                if not is_valid:
+                    self.logger.debug(f'skipping venue {account_id} book')
+                    continue
+
+                price = self.get_venue_price(ob, aggressiveness)
+                if self.threshold_price_breached(price):
+                    continue
+                instrument_data = self.venue_instrument_data(account_id)
+                if instrument_data is None:
+                    self.logger.error(
+                        f'skipping venue {account_id}, no instrument data')
+                    continue
+                depth = (ob.asks if self.side == BUY else ob.bids)[0].amount
+                fee = self.venue_fees.get(str(account_id), 0.0)
+                if self.side == BUY:
+                    effective_price = price * (1 + fee)
+                else:
+                    effective_price = price * (1 - fee)
+                capacity = self.venue_capacity(account_id, price)
+                quotes.append((
+                    effective_price, account_id, price, depth, capacity,
+                    instrument_data))
+            except Exception as e:
+                self.logger.error(f'get_venue_quotes {account_id} - {e}')
+
+        quotes.sort(key=lambda q: q[0], reverse=self.side == SELL)
+        self.logger.debug(f'venue quotes - {quotes}')
+        return quotes
+
+    def route_order(self, order_size, aggressiveness):
+        """
+        Split an order across venues, best fee adjusted price first.
+        Each venue gets up to its top of book depth, any remainder goes to
+        the best venues with balance left. Sizes are rounded and checked
+        against the minimum order quantity of each venue's instrument.
+        Returns {account_id: (price, size)}
+        """
+        quotes = self.get_venue_quotes(aggressiveness)
+        sizes = {}
+        remaining = order_size
+        for _, account_id, _, depth, capacity, _ in quotes:
+            size = max(min(depth, capacity, remaining), 0.0)
+            sizes[account_id] = size
+            remaining -= size
+        for _, account_id, _, _, capacity, _ in quotes:
+            if remaining <= 0:
+                break
+            size = max(min(capacity - sizes[account_id], remaining), 0.0)
+            sizes[account_id] += size
+            remaining -= size
+
+        routes = {}
+        leftover = 0.0
+        for _, account_id, price, _, capacity, instrument_data in quotes:
+            # rounded down so a venue never gets more than it was sized for
+            precision = 10 ** instrument_data.size_precision
+            size = math.floor(sizes[account_id] * precision + 1e-9) / precision
+            leftover += sizes[account_id] - size
+            if size <= 0:
+                continue
+            if size < self.min_qty_of(instrument_data, price):
+                leftover += size
+                continue
+            routes[account_id] = (price, size)
+
+        # fold child orders below min qty into the best venue that can take it
+        for _, account_id, price, _, capacity, instrument_data in quotes:
+            if leftover <= 0:
+                break
+            if account_id not in routes:
+                continue
+            precision = 10 ** instrument_data.size_precision
+            size = math.floor(
+                min(routes[account_id][1] + leftover, capacity)
+                * precision + 1e-9) / precision
+            leftover -= size - routes[account_id][1]
+            routes[account_id] = (price, size)
+
+        self.logger.info(
+            f'route_order {order_size} - routes={routes} '
+            f'unrouted={max(remaining, 0.0) + max(leftover, 0.0)}')
+        return routes
+
+    def send_child_orders(self, routes):
+        """ Send one child order per venue, all tracked by the order monitor """
+        self.child_orders = {}
+        for account_id, (price, size) in routes.items():
+            try:
+                order_id = self.send_order(
+                    price=price, size=size, account_id=account_id)
+            except Exception as e:
+                self.logger.error(f'send_child_orders {account_id} - {e}')
+                self.order_monitor.release(size)
+                continue
+            try:
+                self.order_monitor.add(order_id, committed=size)
+            except Exception as e:
+                self.logger.error(f'send_child_orders {account_id} - {e}')
+                self.order_monitor.release(size)
+                continue
+            self.child_orders[order_id] = size
+        if not self.child_orders:
+            return False
+
+        self.order_id = max(self.child_orders, key=self.child_orders.get)
+        self.order_quantity = sum(self.child_orders.values())
+        return True
+
     def check_stop_condition(self):
         if self.stop_condition != ' ':
             try:
@@ -1177,7 +1528,7 @@ class TWAPBot(AbstractContextManager):
 
     def run(self):
         self.last_error = None
-        current_date_time = time.time()
+        current_date_time = self.clock.time()
         self.logger.debug(
             f'Running TWAP startegy cycle @ {current_date_time}')
 
@@ -1189,14 +1540,14 @@ class TWAPBot(AbstractContextManager):
             self.last_error = ERR_INVALID_CONFIG_FORMAT
             self.logger.error(
                 'invalid config due to error when setting config')
-            time.sleep(1)
+            self.clock.sleep(1)
             return
 
         if not self.validate_config_parameters():
             self.bot_status = BotStatus.ERROR
             self.logger.error(
                 f'not running due to invalid config parametes {self.config}')
-            time.sleep(1)
+            self.clock.sleep(1)
             return
 
         if self.remain_qty == 0.0 or self.remain_qty < self.min_order_qty:
@@ -1215,7 +1566,7 @@ class TWAPBot(AbstractContextManager):
 
         # Error handling
         if self.continues_failed_order_count > 0 and \
-            time.time() - self.continues_failed_order_count_ts \
+            self.clock.time() - self.continues_failed_order_count_ts \
                 < min(
                     self.continues_failed_order_count,
                     FAILED_ORDER_WAIT_SLEEP_SECONDS):
@@ -1226,7 +1577,7 @@ class TWAPBot(AbstractContextManager):
         if self.order_monitor.is_failed_order(self.order_id):
             self.logger.info(f'order_id failed, {self.order_id}')
             self.continues_failed_order_count += 1
-            self.continues_failed_order_count_ts = time.time()
+            self.continues_failed_order_count_ts = self.clock.time()
             self.bot_status = BotStatus.ORDER_FAILED
         else:
             self.continues_failed_order_count = 0
@@ -1270,9 +1621,10 @@ class TWAPBot(AbstractContextManager):
 
         # set Aggressivenes to Taker if anything pending from last post
         if last_unfilled_qty > 0:
-            target_price = self.get_price(Aggressiveness.TAKING)
+            aggressiveness = Aggressiveness.TAKING
         else:
-            target_price = self.get_price(Aggressiveness.TICK_BETTER)
+            aggressiveness = Aggressiveness.TICK_BETTER
+        target_price = self.get_price(aggressiveness)
 
         if self.threshold_price_breached(target_price):
             self.logger.debug(
@@ -1281,10 +1633,13 @@ class TWAPBot(AbstractContextManager):
             self.bot_status = BotStatus.THRESHOLD_PRICE_BREACH
             return
 
-        order_size = min(self.slice_size + last_unfilled_qty, self.remain_qty)
+        order_size = min(
+            self.current_slice_size + last_unfilled_qty + self.deferred_qty,
+            self.remain_qty)
         order_size = round(
             order_size,
             self.instrument_data.size_precision)
+        order_size = self.cap_order_size_to_depth(order_size, aggressiveness)
 
         self.logger.debug(
             f'self.order_size = {order_size} '
@@ -1293,7 +1648,8 @@ class TWAPBot(AbstractContextManager):
 
         if self.max_order_size_breached(order_size):
             self.last_error = ERR_MAX_ORDER_SIZE_BREACH.format(
-                order_size, self.slice_size, self.max_slice_size_multiplier)
+                order_size, self.current_slice_size,
+                self.max_slice_size_multiplier)
             self.logger.error(
                 f'Max Order Size breached for the  order. '
                 f'- {self.last_error} '
@@ -1309,55 +1665,91 @@ class TWAPBot(AbstractContextManager):
             self.bot_status = BotStatus.TRIGGER_CONDITION_BREACH
             return
 
-        if not self.balance_can_meet_order(target_price, order_size):
+        # multi venue balances are checked per venue when routing
+        if not self.multi_venue and \
+                not self.balance_can_meet_order(target_price, order_size):
             self.logger.debug(
                 f'Balance cannot meet the order '
                 f'{self.account_id} {target_price} {order_size}')
             self.bot_status = BotStatus.NOT_ENOUGH_BALANCE
             return
 
-        self.order_quantity = order_size
-
         # Safeguard: Final check before placing order to prevent overshooting
-        # This prevents overshooting when order listener is down
-        current_placed_volume = self.get_placed_orders_volume()
-        total_exposure = current_placed_volume + self.order_quantity
-
-        if total_exposure > self.total_quantity:
-            max_allowed_order_size = self.total_quantity - current_placed_volume
-            if max_allowed_order_size <= 0:
-                self.logger.warning(
-                    f'Safeguard: Cannot place order. Already placed {current_placed_volume} '
-                    f'out of {self.total_quantity} total quantity. Preventing overshoot.')
-                return
-            else:
-                original_size = self.order_quantity
-                self.order_quantity = max_allowed_order_size
-                self.logger.warning(
-                    f'Safeguard: Reducing order size from {original_size} to {max_allowed_order_size} '
-                    f'to prevent overshooting. Already placed: {current_placed_volume}')
+        # The size is reserved against the committed quantity before the
+        # send, so it holds when order listener is down
+        self.order_quantity = self.order_monitor.reserve(
+            order_size, self.total_quantity)
+
+        if self.order_quantity <= 0:
+            self.logger.warning(
+                f'Safeguard: Cannot place order. Already placed '
+                f'{self.order_monitor.committed_qty} out of '
+                f'{self.total_quantity} total quantity. Preventing overshoot.')
+            return
+        elif self.order_quantity < order_size:
+            self.logger.warning(
+                f'Safeguard: Reducing order size from {order_size} to '
+                f'{self.order_quantity} to prevent overshooting. '
+                f'Already placed: '
+                f'{self.order_monitor.committed_qty - self.order_quantity}')
 
         self.logger.debug(
             f'Final order check - placing order of size {self.order_quantity}, '
-            f'current_placed_volume = {current_placed_volume}, '
-            f'total_exposure = {current_placed_volume + self.order_quantity}')
-
-        # Send order to exchange
-        self.order_id = self.send_order(
-            price=target_price,
-            size=self.order_quantity,
-            account_id=self.account_id
-            )
+            f'total_exposure = {self.order_monitor.committed_qty}')
+
+        if self.multi_venue:
+            routes = self.route_order(self.order_quantity, aggressiveness)
+            routed_qty = sum(size for _, size in routes.values())
+            unrouted_qty = round(
+                self.order_quantity - routed_qty,
+                self.instrument_data.size_precision)
+            self.order_monitor.release(self.order_quantity - routed_qty)
+            if unrouted_qty > 0:
+                # carried to the next slots like quantity capped by depth
+                self.deferred_qty = round(
+                    self.deferred_qty + unrouted_qty,
+                    self.instrument_data.size_precision)
+                self.logger.info(
+                    f'{unrouted_qty} not routed, deferring {self.deferred_qty}')
+            if not routes:
+                self.logger.debug(
+                    f'No venue can meet the order {self.order_quantity}')
+                self.bot_status = BotStatus.NOT_ENOUGH_BALANCE
+                return
+
+            # Send child orders to the venues, added to Order Monitor
+            if not self.send_child_orders(routes):
+                self.bot_status = BotStatus.ORDER_FAILED
+                return
+        else:
+            # Send order to exchange
+            try:
+                self.order_id = self.send_order(
+                    price=target_price,
+                    size=self.order_quantity,
+                    account_id=self.account_id
+                    )
+            except Exception:
+                self.order_monitor.release(self.order_quantity)
+                raise
+            self.child_orders = {}
 
         self.last_post_ts = self.adjusted_post_time() \
-            if self.last_post_ts else time.time()
+            if self.last_post_ts else self.clock.time()
         self.logger.debug(f' Order sent at - {self.last_post_ts}')
 
         # Add to Order Monitor
-        self.order_monitor.add(self.order_id)
+        if not self.child_orders:
+            try:
+                self.order_monitor.add(
+                    self.order_id, committed=self.order_quantity)
+            except Exception:
+                self.order_monitor.release(self.order_quantity)
+                raise
         self.bot_status = BotStatus.ORDER_SUBMITTED
         cancel_attempt = self.last_post_ts + self.post_frequency
-        self.order_monitor.last_cancel_attempt[self.order_id] = cancel_attempt
+        for order_id in self.child_orders or [self.order_id]:
+            self.order_monitor.last_cancel_attempt[order_id] = cancel_attempt
 
         self.posts_completed += 1
         return
@@ -1375,10 +1767,5 @@ class TWAPBot(AbstractContextManager):
 
         self.order_monitor.cancel_all_open_orders()
         self.order_monitor.stop()
-        self.client.deregister_resource_usage(
-            "book",
-            self.client.exchange_name(self.exchange_name),
-            self.pair)
-        self.logger.info(
-            f'Deregister resource usage: resource_type=book, '
-            f'exchange={self.exchange_name}, pair={self.pair}')
+        for account_id in list(self.book_listener_accounts or ()):
+            self.stop_book_listener(account_id)
@@ -0,0 +1,172 @@
+###############################################################################
+# Description: Intraday traded volume profile by time of day
+###############################################################################
+
+import logging
+import os
+import time
+
+import numpy as np
+
+from . import config
+
+SECONDS_PER_DAY = 86400
+
+
+class VolumeProfile():
+    """
+    Average traded volume per time of day bin, built from the klines of the
+    last lookback_days. The curve is saved under cache_dir and rebuilt once
+    it is older than refresh_sec, so bots on the same pair load it from disk.
+    A failed build is retried after retry_sec at the earliest, callers keep
+    the flat schedule until then.
+    """
+
+    def __init__(
+        self,
+        pair,
+        *,
+        bin_sec=config.VOLUME_PROFILE_BIN_SEC,
+        lookback_days=config.VOLUME_PROFILE_LOOKBACK_DAYS,
+        refresh_sec=config.VOLUME_PROFILE_REFRESH,
+        retry_sec=config.VOLUME_PROFILE_RETRY,
+        cache_dir=config.VOLUME_PROFILE_DIR,
+        logger=None,
+    ):
+        self.logger = logger or logging.getLogger()
+        self.pair = pair
+        self.bin_sec = bin_sec
+        self.n_bins = SECONDS_PER_DAY // bin_sec
+        self.lookback_days = lookback_days
+        self.refresh_sec = refresh_sec
+        self.retry_sec = min(retry_sec, refresh_sec)
+        self.cache_dir = cache_dir
+        self.curve = None
+        self.cumulative = None
+        self.built_ts = 0
+        self.failed_ts = 0
+
+    @property
+    def ready(self):
+        return self.cumulative is not None and self.cumulative[-1] > 0
+
+    @property
+    def stale(self):
+        return time.time() - self.built_ts > self.refresh_sec
+
+    @property
+    def backing_off(self):
+        return time.time() - self.failed_ts < self.retry_sec
+
+    @property
+    def cache_path(self):
+        return os.path.join(
+            self.cache_dir, f'volume_profile_{self.pair}_{self.bin_sec}.npy')
+
+    def build(self, klines):
+        """ average volume of each time of day bin over the klines """
+        times = np.array([k['time_open'] for k in klines], dtype=float)
+        amounts = np.array([k['amount'] for k in klines], dtype=float)
+        bins = ((times % SECONDS_PER_DAY) // self.bin_sec).astype(int)
+        volume = np.bincount(bins, weights=amounts, minlength=self.n_bins)
+        counts = np.bincount(bins, minlength=self.n_bins)
+        self.set_curve(volume / np.maximum(counts, 1))
+
+    def set_curve(self, curve):
+        self.curve = np.asarray(curve, dtype=float)
+        self.cumulative = np.concatenate(([0.0], np.cumsum(self.curve)))
+
+    def refresh(self, get_market_history):
+        """ load the curve from disk, rebuild it from klines if stale """
+        if self.ready and not self.stale:
+            return True
+        if self.load():
+            return True
+        if self.backing_off:
+            return self.ready
+        try:
+            count = self.lookback_days * self.n_bins
+            klines = get_market_history(self.pair, self.bin_sec, count)
+            if not klines:
+                self.failed_ts = time.time()
+                self.logger.warning(
+                    f'No klines for volume profile {self.pair}, '
+                    f'retrying in {self.retry_sec}s')
+                return self.ready
+            self.build(klines)
+            self.built_ts = time.time()
+            self.failed_ts = 0
+            self.save()
+            self.logger.info(
+                f'Built volume profile for {self.pair} '
+                f'from {len(klines)} klines')
+        except Exception as e:
+            self.failed_ts = time.time()
+            self.logger.error(
+                f'Error in VolumeProfile.refresh, '
+                f'retrying in {self.retry_sec}s - {e}')
+        return self.ready
+
+    def load(self):
+        if not self.cache_dir:
+            return False
+        try:
+            path = self.cache_path
+            if not os.path.exists(path):
+                return False
+            built_ts = os.path.getmtime(path)
+            if time.time() - built_ts > self.refresh_sec:
+                return False
+            curve = np.load(path)
+            if len(curve) != self.n_bins:
+                return False
+            self.set_curve(curve)
+            self.built_ts = built_ts
+            return self.ready
+        except Exception as e:
+            self.logger.error(f'Error in VolumeProfile.load - {e}')
+            return False
+
+    def save(self):
+        if not self.cache_dir:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self.cache_path
+            with open(f'{path}.tmp', 'wb') as f:
+                np.save(f, self.curve)
+            os.replace(f'{path}.tmp', path)
+        except Exception as e:
+            self.logger.error(f'Error in VolumeProfile.save - {e}')
+
+    def cumulative_volume(self, ts):
+        """ expected volume from epoch 0 up to ts, vectorized over ts """
+        ts = np.asarray(ts, dtype=float)
+        days, seconds = np.divmod(ts, SECONDS_PER_DAY)
+        return days * self.cumulative[-1] + np.interp(
+            seconds / self.bin_sec, np.arange(self.n_bins + 1), self.cumulative)
+
+    def expected_volume(self, start_ts, end_ts):
+        return float(
+            self.cumulative_volume(end_ts) - self.cumulative_volume(start_ts))
+
+    def seasonal_factor(self, ref_start_ts, ref_end_ts, start_ts, end_ts):
+        """
+        Expected volume of [start_ts, end_ts] relative to the observed
+        window [ref_start_ts, ref_end_ts], None without a reference volume
+        """
+        ref = self.expected_volume(ref_start_ts, ref_end_ts)
+        if ref <= 0:
+            return None
+        return self.expected_volume(start_ts, end_ts) / ref
+
+    def weights(self, start_ts, duration, n):
+        """ expected volume share of n equal sub-windows, averaging to 1 """
+        if n <= 0:
+            return []
+        edges = start_ts + np.linspace(0, duration, n + 1)
+        volume = np.diff(self.cumulative_volume(edges))
+        total = volume.sum()
+        if total <= 0:
+            return [1.0] * n
+        return list(volume * n / total)
@@ -0,0 +1,126 @@
+###############################################################################
+# Description: Rolling traded volume from the public trades stream
+###############################################################################
+
+import json
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+
+# trades stream payload, a trade or a list of trades, possibly json encoded
+# {"price": 100.0, "amount": 0.5, "timestamp": 1700000000000}
+# timestamps are in milliseconds
+TRADE_AMOUNT_KEY = 'amount'
+TRADE_TIMESTAMP_KEY = 'timestamp'
+
+
+class VolumeTracker():
+    """
+    Traded volume over the last window_sec, in time buckets of bucket_sec
+    kept in a ring buffer. Adding a trade and reading the window total
+    are O(1); partial windows sum at most window_sec / bucket_sec buckets.
+    """
+
+    def __init__(self, window_sec=60, bucket_sec=1, logger=None):
+        self.logger = logger or logging.getLogger()
+        self.bucket_sec = bucket_sec
+        self.n_buckets = max(int(math.ceil(window_sec / bucket_sec)), 1)
+        self.buckets = np.zeros(self.n_buckets)
+        self.total = 0.0
+        self.last_bucket = None
+        self.last_trade_ts = None
+        self.unparsed = 0
+        self.lock = threading.Lock()
+
+    @property
+    def window_sec(self):
+        return self.n_buckets * self.bucket_sec
+
+    def _advance(self, bucket):
+        # clear the buckets that rolled out of the window since the last one
+        if self.last_bucket is None:
+            self.last_bucket = bucket
+            return
+        if bucket <= self.last_bucket:
+            return
+        if bucket - self.last_bucket >= self.n_buckets:
+            self.buckets[:] = 0.0
+            self.total = 0.0
+        else:
+            for b in range(self.last_bucket + 1, bucket + 1):
+                i = b % self.n_buckets
+                self.total -= self.buckets[i]
+                self.buckets[i] = 0.0
+        self.last_bucket = bucket
+
+    def add(self, amount, ts=None):
+        ts = ts or time.time()
+        bucket = int(ts // self.bucket_sec)
+        with self.lock:
+            self._advance(bucket)
+            if bucket <= self.last_bucket - self.n_buckets:
+                return  # older than the window
+            self.buckets[bucket % self.n_buckets] += amount
+            self.total += amount
+            self.last_trade_ts = max(self.last_trade_ts or ts, ts)
+
+    def volume(self, window_sec=None, now=None):
+        """ traded volume over the last window_sec, up to the full window """
+        now = now or time.time()
+        with self.lock:
+            self._advance(int(now // self.bucket_sec))
+            if window_sec is None or window_sec >= self.window_sec:
+                return max(self.total, 0.0)
+            n = max(int(math.ceil(window_sec / self.bucket_sec)), 1)
+            end = self.last_bucket % self.n_buckets + 1
+            if n <= end:
+                return float(self.buckets[end - n:end].sum())
+            return float(
+                self.buckets[:end].sum()
+                + self.buckets[self.n_buckets - (n - end):].sum())
+
+    def is_live(self, max_age_sec):
+        """ a trade was seen within max_age_sec """
+        return self.last_trade_ts is not None \
+            and time.time() - self.last_trade_ts <= max_age_sec
+
+    def on_trades(self, *args):
+        """ stream callback, the trades payload is the last argument """
+        try:
+            trades = parse_trades(args[-1] if args else None)
+        except (TypeError, ValueError) as e:
+            # counted so an unexpected payload never reads as no volume
+            self.unparsed += 1
+            self.logger.error(
+                f'VolumeTracker unrecognized trades payload '
+                f'#{self.unparsed} - {e} - {str(args)[:200]}')
+            return
+        for amount, ts in trades:
+            self.add(amount, ts)
+
+
+def parse_trades(payload):
+    """
+    [(amount, timestamp sec)] of a trades stream payload,
+    raises ValueError if it is not in the trades stream format
+    """
+    if isinstance(payload, (str, bytes)):
+        payload = json.loads(payload)
+    if isinstance(payload, dict):
+        payload = [payload]
+    if not isinstance(payload, list):
+        raise ValueError('expected a trade or a list of trades')
+    trades = []
+    for trade in payload:
+        if not isinstance(trade, dict) \
+                or TRADE_AMOUNT_KEY not in trade \
+                or TRADE_TIMESTAMP_KEY not in trade:
+            raise ValueError(
+                f'trade without {TRADE_AMOUNT_KEY}/{TRADE_TIMESTAMP_KEY}')
+        trades.append((
+            abs(float(trade[TRADE_AMOUNT_KEY])),
+            float(trade[TRADE_TIMESTAMP_KEY]) / 1000))
+    return trades
@@ -70,6 +70,78 @@ try:
     RELOAD_INSTRUMENT_DATA_FREQUENCY = float(config['Trading'].get('RELOAD_INSTRUMENT_DATA_FREQUENCY', 14400))
 except BaseException as e:
     RELOAD_INSTRUMENT_DATA_FREQUENCY = 14400
+try:
+    INSTRUMENT_CACHE_TTL = float(config['Trading'].get('INSTRUMENT_CACHE_TTL', 600))
+except BaseException as e:
+    INSTRUMENT_CACHE_TTL = 600
+try:
+    INSTRUMENT_CACHE_SNAPSHOT_MAX_AGE = float(config['Trading'].get('INSTRUMENT_CACHE_SNAPSHOT_MAX_AGE', 86400))
+except BaseException as e:
+    INSTRUMENT_CACHE_SNAPSHOT_MAX_AGE = 86400
+try:
+    INSTRUMENT_CACHE_SNAPSHOT_DIR = config['Trading'].get('INSTRUMENT_CACHE_SNAPSHOT_DIR', f'{home}/.altonomy/instruments')
+except BaseException as e:
+    INSTRUMENT_CACHE_SNAPSHOT_DIR = f'{home}/.altonomy/instruments'
+try:
+    VOLUME_PROFILE_DIR = config['Trading'].get('VOLUME_PROFILE_DIR', f'{home}/.altonomy/volume_profiles')
+except BaseException as e:
+    VOLUME_PROFILE_DIR = f'{home}/.altonomy/volume_profiles'
+try:
+    VOLUME_PROFILE_REFRESH = float(config['Trading'].get('VOLUME_PROFILE_REFRESH', 86400))
+except BaseException as e:
+    VOLUME_PROFILE_REFRESH = 86400
+try:
+    VOLUME_PROFILE_RETRY = float(config['Trading'].get('VOLUME_PROFILE_RETRY', 300))
+except BaseException as e:
+    VOLUME_PROFILE_RETRY = 300
+try:
+    VOLUME_PROFILE_BIN_SEC = int(config['Trading'].get('VOLUME_PROFILE_BIN_SEC', 300))
+except BaseException as e:
+    VOLUME_PROFILE_BIN_SEC = 300
+try:
+    VOLUME_PROFILE_LOOKBACK_DAYS = int(config['Trading'].get('VOLUME_PROFILE_LOOKBACK_DAYS', 7))
+except BaseException as e:
+    VOLUME_PROFILE_LOOKBACK_DAYS = 7
+try:
+    MARKET_HISTORY_CACHE_TTL = float(config['Trading'].get('MARKET_HISTORY_CACHE_TTL', 2))
+except BaseException as e:
+    MARKET_HISTORY_CACHE_TTL = 2
+try:
+    ZERORPC_IDLE_TIMEOUT = float(config['Trading'].get('ZERORPC_IDLE_TIMEOUT', 60))
+except BaseException as e:
+    ZERORPC_IDLE_TIMEOUT = 60
+try:
+    BALANCE_CACHE_TTL = float(config['Trading'].get('BALANCE_CACHE_TTL', 1))
+except BaseException as e:
+    BALANCE_CACHE_TTL = 1
+try:
+    PAIR_MAX_LEG_SKEW = float(config['Trading'].get('PAIR_MAX_LEG_SKEW', 1))
+except BaseException as e:
+    PAIR_MAX_LEG_SKEW = 1
+try:
+    CONVERSION_RATE_TTL = float(config['Trading'].get('CONVERSION_RATE_TTL', 30))
+except BaseException as e:
+    CONVERSION_RATE_TTL = 30
+try:
+    SPREAD_HISTORY_SIZE = int(config['Trading'].get('SPREAD_HISTORY_SIZE', 300))
+except BaseException as e:
+    SPREAD_HISTORY_SIZE = 300
+try:
+    SPREAD_ZSCORE_MIN_SAMPLES = int(config['Trading'].get('SPREAD_ZSCORE_MIN_SAMPLES', 30))
+except BaseException as e:
+    SPREAD_ZSCORE_MIN_SAMPLES = 30
+try:
+    PRICE_SERVER_POOL_SIZE = int(config['Trading'].get('PRICE_SERVER_POOL_SIZE', 2))
+except BaseException as e:
+    PRICE_SERVER_POOL_SIZE = 2
+try:
+    PRICE_SERVER_CACHE_TTL = float(config['Trading'].get('PRICE_SERVER_CACHE_TTL', 1))
+except BaseException as e:
+    PRICE_SERVER_CACHE_TTL = 1
+try:
+    PAIR_TRADING_MAX_WORKERS = int(config['Trading'].get('PAIR_TRADING_MAX_WORKERS', 8))
+except BaseException as e:
+    PAIR_TRADING_MAX_WORKERS = 8
 try:
     UPDATE_REDIS_FREQUENCY = float(config['Trading'].get('UPDATE_REDIS_FREQUENCY', 5))
 except BaseException as e:
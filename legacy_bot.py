@@ -365,7 +365,7 @@ class legacy_bot(background_process):
             self.logger.info('starting twap bot')
             self._load_data(parent_input)
 
-            with TWAPBot(self.account_ids[0], self.altcoin, self.quotecoin, self.bot_id, self.configuration, service_id=self.service_id, logger=self.logger) as bot:
+            with TWAPBot(self.account_ids[0], self.altcoin, self.quotecoin, self.bot_id, self.configuration, service_id=self.service_id, logger=self.logger, account_ids=self.account_ids) as bot:
                 self.bot = bot
                 self.logger.info('starting twap bot from Legacy Bot')
                 heartbeat_id = f'twap_bot_{self.altcoin}_{self.quotecoin}_{self.service_id}'
@@ -0,0 +1,91 @@
+import logging
+import threading
+import time
+from types import SimpleNamespace
+
+from altonomy.apl_bots.InstrumentCache import InstrumentCache
+
+logger = logging.getLogger()
+
+
+def instrument(symbol):
+    return SimpleNamespace(exchange_symbol=symbol, altonomy_symbol=symbol)
+
+
+class FakeClient:
+    def __init__(self, delays=None, failures=0):
+        self.delays = delays or {}
+        self.failures = failures
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def instrument_data(self):
+        return self
+
+    def get_active_instruments_for_exchange(self, exchange_id):
+        with self.lock:
+            self.calls.append(exchange_id)
+            failing = self.failures > 0
+            self.failures -= 1
+        time.sleep(self.delays.get(exchange_id, 0.0))
+        if failing:
+            raise ConnectionError('ref data unavailable')
+        return [instrument(f'BTC{exchange_id}')]
+
+
+def run_threads(targets):
+    threads = [threading.Thread(target=target) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_concurrent_first_loads_fetch_once():
+    client = FakeClient(delays={1: 0.2})
+    cache = InstrumentCache(snapshot_dir=None, logger=logger)
+    results = []
+
+    run_threads([
+        lambda: results.append(cache.get(client, 1, 'BTC1'))
+        for _ in range(8)])
+
+    assert client.calls == [1]
+    assert len(results) == 8
+    assert all(ins.exchange_symbol == 'BTC1' for ins in results)
+
+
+def test_slow_first_load_does_not_block_other_exchanges():
+    client = FakeClient(delays={1: 0.5})
+    cache = InstrumentCache(snapshot_dir=None, logger=logger)
+    waited = {}
+
+    def get_fast():
+        time.sleep(0.05)
+        start = time.monotonic()
+        cache.get(client, 2, 'BTC2')
+        waited[2] = time.monotonic() - start
+
+    run_threads([lambda: cache.get(client, 1, 'BTC1'), get_fast])
+
+    assert waited[2] < 0.25
+    assert sorted(client.calls) == [1, 2]
+
+
+def test_waiters_retry_a_failed_first_load():
+    client = FakeClient(delays={1: 0.1}, failures=1)
+    cache = InstrumentCache(snapshot_dir=None, logger=logger)
+    results, errors = [], []
+
+    def get():
+        try:
+            results.append(cache.get(client, 1, 'BTC1'))
+        except ConnectionError as e:
+            errors.append(e)
+
+    run_threads([get for _ in range(4)])
+
+    assert len(errors) == 1
+    assert len(results) == 3
+    assert all(ins is not None for ins in results)
+    assert client.calls == [1, 1]
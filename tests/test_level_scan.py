@@ -0,0 +1,58 @@
+from types import SimpleNamespace
+
+import pytest
+
+from altonomy.core.Side import BUY, SELL
+from altonomy.apl_bots.LevelScan import (
+    levels_in_band, qualifying_levels, qualifying_levels_loop, random_levels)
+
+
+def thresholds(**kwargs):
+    return {
+        'large_order_threshold': 1.0,
+        'cumulative_order_threshold': 0.0,
+        'min_price': 0.0,
+        'max_price': 1e9,
+        'max_slippage_threshold': 1.0,
+        **kwargs,
+    }
+
+
+@pytest.mark.parametrize('side', [BUY, SELL])
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('case', [
+    {},
+    {'large_order_threshold': 2.5},
+    {'large_order_threshold': 100.0},
+    {'cumulative_order_threshold': 20.0},
+    {'max_slippage_threshold': 0.002},
+    {'max_slippage_threshold': 0.0},
+    {'min_price': 99.5, 'max_price': 100.5},
+    {'min_price': 100.2, 'max_price': 100.3},
+    {'min_price': 99.7, 'max_price': 99.8},
+])
+def test_qualifying_levels_match_loop(side, seed, case):
+    levels = random_levels(200, side, seed=seed)
+    assert list(qualifying_levels(levels, side, **thresholds(**case))) \
+        == qualifying_levels_loop(levels, side, **thresholds(**case))
+
+
+def test_levels_in_band():
+    levels = random_levels(100, BUY)
+    band = thresholds(max_price=100.305)
+    assert levels_in_band(levels, BUY, **{
+        k: band[k] for k in ('min_price', 'max_price', 'max_slippage_threshold')
+    }) == 30
+    assert levels_in_band([], BUY, min_price=0, max_price=1, max_slippage_threshold=1) == 0
+
+
+def test_scan_stops_at_qualifying_level_better_than_range():
+    levels = [
+        SimpleNamespace(price=99.0, amount=0.5, cumulative=0.5, slippage=0.0),
+        SimpleNamespace(price=99.5, amount=5.0, cumulative=5.5, slippage=0.005),
+        SimpleNamespace(price=100.5, amount=5.0, cumulative=10.5, slippage=0.015),
+    ]
+    # a small level under the range is skipped, a large one ends the scan
+    assert qualifying_levels(levels, BUY, **thresholds(min_price=99.2)) == [1, 2]
+    assert qualifying_levels(levels, BUY, **thresholds(min_price=99.7)) == []
+    assert qualifying_levels(levels, BUY, **thresholds(max_price=100.0)) == [1]
@@ -0,0 +1,85 @@
+import logging
+import threading
+import time
+
+from altonomy.apl_bots.OrderDetailsSnapshot import OrderDetailsSnapshot
+
+logger = logging.getLogger()
+
+
+class FakeClient:
+    def __init__(self, delay=0.0, failing=()):
+        self.delay = delay
+        self.failing = set(failing)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def get_order_details(self, tradingpair, ordertype, orderid, data_format=None):
+        assert data_format == 'legacy'
+        with self.lock:
+            self.calls.append(orderid)
+        time.sleep(self.delay)
+        if orderid in self.failing:
+            raise ConnectionError(f'cannot fetch {orderid}')
+        return {'orderid': orderid, 'ordertype': ordertype, 'pair': tradingpair}
+
+
+def test_cycle_fetches_each_order_once_in_parallel():
+    client = FakeClient(delay=0.1)
+    snapshot = OrderDetailsSnapshot(max_workers=8, logger=logger)
+    orders = [('BUY', i) for i in range(1, 9)]
+    start = time.monotonic()
+    snapshot.refresh(client, 'BTCUSDT', orders)
+    assert time.monotonic() - start < 0.5
+    for _ in range(3):
+        for ordertype, orderid in orders:
+            assert snapshot.get(client, 'BTCUSDT', ordertype, orderid)['orderid'] == orderid
+    assert sorted(client.calls) == list(range(1, 9))
+    assert snapshot.fetches == 8
+    snapshot.stop()
+
+
+def test_missing_orders_are_fetched_and_kept():
+    client = FakeClient()
+    snapshot = OrderDetailsSnapshot(logger=logger)
+    snapshot.refresh(client, 'BTCUSDT', [('BUY', 1), ('SELL', None)])
+    assert client.calls == [1]
+    snapshot.get(client, 'BTCUSDT', 'SELL', 2)
+    snapshot.get(client, 'BTCUSDT', 'SELL', 2)
+    assert client.calls == [1, 2]
+    snapshot.stop()
+
+
+def test_failed_fetch_is_retried_on_demand():
+    client = FakeClient(failing={2})
+    snapshot = OrderDetailsSnapshot(logger=logger)
+    snapshot.refresh(client, 'BTCUSDT', [('BUY', 1), ('BUY', 2)])
+    assert 2 not in snapshot.details
+    client.failing.clear()
+    assert snapshot.get(client, 'BTCUSDT', 'BUY', 2)['orderid'] == 2
+    snapshot.stop()
+
+
+def test_lookups_outside_a_cycle_are_live():
+    client = FakeClient()
+    snapshot = OrderDetailsSnapshot(logger=logger)
+    snapshot.get(client, 'BTCUSDT', 'BUY', 1)
+    snapshot.get(client, 'BTCUSDT', 'BUY', 1)
+    assert client.calls == [1, 1]
+
+    snapshot.refresh(client, 'BTCUSDT', [('BUY', 1)])
+    snapshot.clear()
+    assert not snapshot.active
+    snapshot.get(client, 'BTCUSDT', 'BUY', 1)
+    assert client.calls == [1, 1, 1, 1]
+    snapshot.stop()
+
+
+def test_refresh_starts_a_new_cycle():
+    client = FakeClient()
+    snapshot = OrderDetailsSnapshot(logger=logger)
+    snapshot.refresh(client, 'BTCUSDT', [('BUY', 1)])
+    snapshot.refresh(client, 'BTCUSDT', [('BUY', 2)])
+    assert set(snapshot.details) == {2}
+    assert snapshot.fetches == 1
+    snapshot.stop()
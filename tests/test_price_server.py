@@ -0,0 +1,139 @@
+import threading
+import time
+
+import pytest
+
+from altonomy.apl_bots.PriceServer import PriceServerPool
+
+
+class FakeSession:
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+        self.closed = False
+
+    def get_rate(self, coin1, coin2):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError('price server down')
+        return 1.0 if coin1 == coin2 else 2.0
+
+    def close(self):
+        self.closed = True
+
+
+class Factory:
+    """ sessions made by the pool, failing the first fail_opens opens """
+
+    def __init__(self, fail_opens=0, **session_kwargs):
+        self.fail_opens = fail_opens
+        self.session_kwargs = session_kwargs
+        self.sessions = []
+
+    def __call__(self):
+        if self.fail_opens > 0:
+            self.fail_opens -= 1
+            raise ConnectionError('cannot connect')
+        session = FakeSession(**self.session_kwargs)
+        self.sessions.append(session)
+        return session
+
+
+def call_in_threads(func, n):
+    results = [None] * n
+    errors = []
+
+    def target(i):
+        try:
+            results[i] = func()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results, errors
+
+
+def test_concurrent_requests_are_coalesced():
+    factory = Factory(delay=0.2)
+    pool = PriceServerPool(size=2, ttl=60, session_factory=factory)
+    results, errors = call_in_threads(lambda: pool.get_rate('BTC', 'USDT'), 10)
+    assert not errors
+    assert results == [2.0] * 10
+    assert sum(session.calls for session in factory.sessions) == 1
+    metrics = pool.metrics
+    assert metrics['misses'] == 1
+    assert metrics['coalesced'] == 9
+
+
+def test_responses_are_cached():
+    factory = Factory()
+    pool = PriceServerPool(size=1, ttl=60, session_factory=factory)
+    assert pool.get_rate('ETH', 'USDT') == 2.0
+    assert pool.get_rate('ETH', 'USDT') == 2.0
+    assert pool.get_rate('USDT', 'USDT') == 1.0
+    assert pool.metrics['hits'] == 1
+    assert sum(session.calls for session in factory.sessions) == 2
+
+
+def test_failed_open_frees_its_slot():
+    pool = PriceServerPool(size=1, ttl=60, session_factory=Factory(fail_opens=1))
+    with pytest.raises(ConnectionError):
+        pool.get_rate('BTC', 'USDT')
+    assert pool.opened == 0
+    assert pool.get_rate('BTC', 'USDT') == 2.0
+    assert pool.opened == 1
+
+
+def test_failed_call_drops_the_session():
+    factory = Factory(fail=True)
+    pool = PriceServerPool(size=1, ttl=60, session_factory=factory)
+    with pytest.raises(ConnectionError):
+        pool.get_rate('BTC', 'USDT')
+    assert factory.sessions[0].closed
+    assert pool.opened == 0
+    assert pool.metrics['errors'] == 1
+    # the failed request is not cached or left in flight
+    assert not pool.in_flight
+
+
+def test_dropped_session_wakes_a_waiter():
+    factory = Factory()
+    pool = PriceServerPool(size=1, ttl=60, session_factory=factory, timeout=5)
+    session = pool.acquire()
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+    waiter.start()
+    time.sleep(0.1)
+    assert not acquired
+    pool.release(session, healthy=False)
+    waiter.join(2)
+    assert acquired and acquired[0] is not session
+    assert len(factory.sessions) == 2
+    assert pool.opened == 1
+
+
+def test_acquire_times_out():
+    pool = PriceServerPool(size=1, ttl=60, session_factory=Factory())
+    session = pool.acquire()
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        pool.acquire(timeout=0.1)
+    assert time.monotonic() - start < 1
+    pool.release(session)
+    assert pool.acquire(timeout=0.1) is session
+
+
+def test_concurrent_failures_do_not_deadlock():
+    factory = Factory(delay=0.05, fail=True)
+    pool = PriceServerPool(size=2, ttl=60, session_factory=factory, timeout=2)
+    results, errors = call_in_threads(
+        lambda: pool.get_rate('BTC', f'C{threading.get_ident()}'), 8)
+    assert len(errors) == 8
+    assert all(isinstance(e, ConnectionError) for e in errors)
+    assert pool.opened == 0
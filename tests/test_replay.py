@@ -0,0 +1,82 @@
+import logging
+
+from altonomy.core.Side import BUY
+
+from altonomy.apl_bots.Replay import (
+    BotFactory, ReplayClient, ReplayEngine, VirtualClock, make_instrument)
+from altonomy.apl_bots.TWAPBot import TWAPBot
+
+logger = logging.getLogger()
+
+START_TS = 1_600_000_000.0
+
+
+def recorded_books(seconds=60, interval=0.5):
+    """ flat market, 101 offered for 1 at every snapshot """
+    return [
+        {
+            'timestamp': START_TS + i * interval,
+            'bids': [[99.0, 1.0], [98.0, 5.0]],
+            'asks': [[101.0, 1.0], [102.0, 5.0]],
+        }
+        for i in range(int(seconds / interval) + 1)
+    ]
+
+
+def replay_client():
+    instrument = make_instrument({
+        'exchange_symbol': 'BTCUSDT',
+        'altonomy_symbol': 'BTCUSDT',
+        'min_order_size': 0.01,
+        'min_order_notional': 0.0,
+        'lot_size': 0.01,
+        'size_precision': 2,
+        'price_precision': 1,
+        'tick_size': 0.1,
+    })
+    return ReplayClient(
+        'BTC', 'USDT', recorded_books(), VirtualClock(START_TS),
+        balances={'BTC': 0.0, 'USDT': 1e6}, instrument=instrument,
+        logger=logger)
+
+
+def replay_twap():
+    engine = ReplayEngine(replay_client(), cycle_interval=0.5, logger=logger)
+    bot_config = {
+        'side': 'BUY',
+        'quantity': '2',
+        'duration': '20',
+        'default_post_frequency': '2',
+        'threshold_price': '-1',
+    }
+    result = engine.replay(
+        BotFactory(TWAPBot, 0, 'BTC', 'USDT', 0, bot_config, logger=logger))
+    return engine, result
+
+
+def test_replay_fills_on_the_virtual_clock():
+    engine, result = replay_twap()
+    fills = engine.client.fills
+
+    assert fills
+    assert result['fills'] == len(fills)
+    assert result['dealt'] == sum(amount for _, _, _, amount in fills)
+    assert 0 < result['dealt'] <= 2 + 1e-9
+    assert all(side == BUY for _, side, _, _ in fills)
+    assert all(price in (101.0, 102.0) for _, _, price, _ in fills)
+    # fills are stamped with the replayed session time, not the wall clock
+    assert result['start_ts'] == START_TS
+    assert all(
+        START_TS <= ts <= result['end_ts'] for ts, _, _, _ in fills)
+    assert all((ts - START_TS) % 0.5 == 0 for ts, _, _, _ in fills)
+    assert result['end_ts'] <= engine.client.end_ts + engine.cycle_interval
+    assert [ts for ts, _, _, _ in fills] == sorted(
+        ts for ts, _, _, _ in fills)
+
+
+def test_replay_is_deterministic():
+    first, first_result = replay_twap()
+    second, second_result = replay_twap()
+
+    assert first.client.fills == second.client.fills
+    assert first_result['end_ts'] == second_result['end_ts']
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from altonomy.apl_bots.SpreadHistory import SpreadHistory
+
+
+def window_of(values, size):
+    return np.asarray(values[-size:], dtype=float)
+
+
+@pytest.mark.parametrize('size,n', [(10, 5), (10, 10), (10, 11), (10, 37), (300, 1000)])
+def test_stats_match_numpy_over_the_window(size, n):
+    rng = np.random.default_rng(n)
+    values = list(100 + rng.normal(0, 2, n))
+    history = SpreadHistory(size, min_count=2)
+    for value in values:
+        history.append(value)
+
+    window = window_of(values, size)
+    assert len(history) == len(window)
+    assert history.last == values[-1]
+    assert history.mean == pytest.approx(window.mean(), rel=1e-12)
+    assert history.std == pytest.approx(window.std(), rel=1e-9)
+    assert history.zscore() == pytest.approx(
+        (values[-1] - window.mean()) / window.std(), rel=1e-9)
+    assert history.zscore(105.0) == pytest.approx(
+        (105.0 - window.mean()) / window.std(), rel=1e-9)
+
+
+def test_stats_after_many_wraps():
+    # the sums are rebuilt on every wrap, so large levels don't drift
+    history = SpreadHistory(50, min_count=2)
+    values = list(1e6 + np.sin(np.arange(5003)))
+    for value in values:
+        history.append(value)
+    window = window_of(values, 50)
+    assert history.mean == pytest.approx(window.mean(), rel=1e-12)
+    assert history.std == pytest.approx(window.std(), rel=1e-9)
+
+
+def test_not_ready_below_min_count():
+    history = SpreadHistory(100, min_count=30)
+    assert history.last is None
+    assert history.mean is None
+    assert history.zscore() is None
+    for i in range(29):
+        history.append(i)
+    assert not history.ready
+    assert history.zscore() is None
+    history.append(29)
+    assert history.ready
+    assert history.zscore() is not None
+
+
+def test_flat_spread_has_zero_zscore():
+    history = SpreadHistory(10, min_count=2)
+    for _ in range(15):
+        history.append(1.5)
+    assert history.std == pytest.approx(0.0, abs=1e-12)
+    assert history.zscore() == 0.0
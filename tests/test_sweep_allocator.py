@@ -0,0 +1,89 @@
+from typing import NamedTuple
+
+import pytest
+
+from altonomy.core.Side import BUY, SELL
+from altonomy.apl_bots.SweepAllocator import (
+    allocate_sweep, allocate_sweep_loop, random_merged_book, sweepable_levels)
+
+
+class Level(NamedTuple):
+    price: float
+    amount: float
+    source: int
+
+
+def assert_same_orders(orders, expected):
+    assert orders.keys() == expected.keys()
+    for venue, (price, amount) in expected.items():
+        assert orders[venue][0] == pytest.approx(price)
+        assert orders[venue][1] == pytest.approx(amount)
+
+
+@pytest.mark.parametrize('side', [BUY, SELL])
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('fraction', [0.01, 0.3, 0.9, 2.0])
+def test_allocate_sweep_matches_loop(side, seed, fraction):
+    prices, amounts, venues = random_merged_book(5, 50, side, seed=seed)
+    balance = 100 * 50 * 0.2 if side == BUY else 50 * 0.2
+    balances = {v: balance * (v + 1) / 3 for v in range(5)}
+    total = amounts.sum() * fraction
+    assert_same_orders(
+        allocate_sweep(prices, amounts, venues, balances, total, side),
+        allocate_sweep_loop(prices, amounts, venues, balances, total, side))
+
+
+def test_allocate_sweep_respects_balances():
+    prices = [100.0, 101.0, 102.0]
+    amounts = [1.0, 1.0, 1.0]
+    venues = ['a', 'a', 'b']
+    orders = allocate_sweep(
+        prices, amounts, venues, {'a': 150.0, 'b': 1000.0}, 3.0, BUY)
+    # 'a' can only pay for 1.5 at its first two levels
+    assert orders['a'][0] == 101.0
+    assert orders['a'][1] == pytest.approx(150.0 / 101.0)
+    assert orders['b'] == (102.0, 1.0)
+
+
+def test_allocate_sweep_empty():
+    assert allocate_sweep([], [], [], {}, 1.0, BUY) == {}
+    assert allocate_sweep([100.0], [1.0], ['a'], {'a': 1.0}, 0.0, SELL) == {}
+
+
+@pytest.mark.parametrize('side', [BUY, SELL])
+@pytest.mark.parametrize('fraction', [0.05, 0.5, 2.0])
+def test_sweepable_levels_keep_the_allocation(side, fraction):
+    prices, amounts, venues = random_merged_book(4, 100, side, seed=7)
+    levels = [Level(*level) for level in zip(prices, amounts, venues.tolist())]
+    balance = 100 * 100 * 0.1 if side == BUY else 100 * 0.1
+    balances = {v: balance for v in range(3)}  # venue 3 has no balance
+    total = amounts.sum() * fraction
+
+    reachable = list(sweepable_levels(iter(levels), balances, total, side))
+    assert all(level.source in balances for level in reachable)
+    if fraction < 1:
+        assert len(reachable) < len(levels)
+
+    def allocate(levels):
+        return allocate_sweep(
+            [level.price for level in levels],
+            [level.amount for level in levels],
+            [level.source for level in levels],
+            balances, total, side)
+
+    assert_same_orders(
+        allocate(reachable),
+        allocate([level for level in levels if level.source in balances]))
+
+
+def test_sweepable_levels_is_lazy():
+    consumed = []
+
+    def ladder():
+        for i in range(1000):
+            consumed.append(i)
+            yield Level(100.0 + i, 1.0, 'a')
+
+    levels = list(sweepable_levels(ladder(), {'a': 1e9}, 3.0, BUY))
+    assert len(levels) == 3
+    assert len(consumed) == 4
@@ -0,0 +1,74 @@
+import json
+import logging
+
+import pytest
+
+from altonomy.apl_bots.VolumeTracker import VolumeTracker, parse_trades
+
+logger = logging.getLogger()
+
+NOW = 1700000000.0
+
+
+def trade(amount, ts, price=100.0):
+    return {'price': price, 'amount': amount, 'timestamp': ts * 1000}
+
+
+def test_parse_trades_formats():
+    assert parse_trades(trade(1.5, NOW)) == [(1.5, NOW)]
+    assert parse_trades([trade(1, NOW), trade(-2, NOW + 1)]) == [
+        (1.0, NOW), (2.0, NOW + 1)]
+    assert parse_trades(json.dumps([trade(3, NOW)])) == [(3.0, NOW)]
+    assert parse_trades([]) == []
+
+
+@pytest.mark.parametrize('payload', [
+    None,
+    42,
+    'not json',
+    {'volume': 1, 'ts': NOW},
+    [trade(1, NOW), {'qty': 1}],
+    {'data': [trade(1, NOW)]},
+])
+def test_parse_trades_rejects_unknown_payloads(payload):
+    with pytest.raises(ValueError):
+        parse_trades(payload)
+
+
+def test_on_trades_counts_unrecognized_payloads():
+    tracker = VolumeTracker(window_sec=60, logger=logger)
+    tracker.on_trades('BINANCE', 'BTCUSDT', {'size': 5, 'time': NOW})
+    assert tracker.unparsed == 1
+    assert tracker.last_trade_ts is None
+
+    tracker.on_trades('BINANCE', 'BTCUSDT', [trade(5, NOW)])
+    assert tracker.unparsed == 1
+    assert tracker.volume(now=NOW) == 5
+
+
+def test_volume_over_windows():
+    tracker = VolumeTracker(window_sec=10, bucket_sec=1, logger=logger)
+    for i in range(10):
+        tracker.add(1.0, NOW + i)
+    now = NOW + 9
+    assert tracker.volume(now=now) == pytest.approx(10)
+    assert tracker.volume(3, now=now) == pytest.approx(3)
+    # rolled out of the window
+    assert tracker.volume(now=now + 5) == pytest.approx(5)
+    assert tracker.volume(now=now + 60) == pytest.approx(0)
+
+
+def test_partial_window_wraps_around_the_ring():
+    tracker = VolumeTracker(window_sec=5, bucket_sec=1, logger=logger)
+    for i in range(8):
+        tracker.add(float(i), NOW + i)
+    now = NOW + 7
+    assert tracker.volume(now=now) == pytest.approx(3 + 4 + 5 + 6 + 7)
+    assert tracker.volume(3, now=now) == pytest.approx(5 + 6 + 7)
+
+
+def test_trades_older_than_the_window_are_ignored():
+    tracker = VolumeTracker(window_sec=5, bucket_sec=1, logger=logger)
+    tracker.add(1.0, NOW)
+    tracker.add(7.0, NOW - 10)
+    assert tracker.volume(now=NOW) == pytest.approx(1)